@@ -0,0 +1,306 @@
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from result_store import iter_new_results
+
+# 角色编码
+ROLE_CIVILIAN = 0
+ROLE_UNDERCOVER = 1
+ROLE_NONE = -1  # 无人获胜
+ROLE_CODES = {"平民": ROLE_CIVILIAN, "卧底": ROLE_UNDERCOVER}
+# 反思方式编码，-1表示结果中没有记录
+REFLECTION_CODES = {"per_player": 0, "batched": 1}
+
+# 每局一行
+GAME_DTYPE = np.dtype([
+    ("winner_role", np.int8),
+    ("rounds", np.int16),
+    ("undercover_survival", np.int16),  # 卧底被淘汰的回合，未被淘汰时为总回合数
+    ("word_pair", np.int32),  # 词语对编号，-1表示结果中没有记录
+    ("pk_rounds", np.int16),
+])
+
+# 每局每个玩家一行
+PLAYER_DTYPE = np.dtype([
+    ("game", np.int32),
+    ("player", np.int32),
+    ("role", np.int8),
+    ("won", np.bool_),
+    ("rounds_alive", np.int16),
+    ("votes_cast", np.int16),  # 不含弃权
+    ("correct_votes", np.int16),  # 投给卧底的票
+    ("ballots", np.int16),  # 投出的全部票（含惩罚票，不含弃权）
+    ("penalty_votes", np.int16),  # 响应无法解析或投给不存在的玩家时投给自己的惩罚票
+    ("pk_rounds", np.int16),  # 进入PK的次数
+    ("reflection", np.int8),  # 反思方式
+])
+
+
+class _Table:
+    """按行追加、按列读取的定长记录表，容量不足时翻倍扩容"""
+
+    def __init__(self, dtype: np.dtype, capacity: int = 1024):
+        self._data = np.zeros(capacity, dtype=dtype)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, rows: List[tuple]):
+        needed = self._size + len(rows)
+        if needed > len(self._data):
+            capacity = max(needed, 2 * len(self._data))
+            data = np.zeros(capacity, dtype=self._data.dtype)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+        self._data[self._size:needed] = np.array(rows, dtype=self._data.dtype)
+        self._size = needed
+
+    @property
+    def data(self) -> np.ndarray:
+        return self._data[:self._size]
+
+    @classmethod
+    def from_array(cls, array: np.ndarray) -> "_Table":
+        table = cls(array.dtype, capacity=max(1024, len(array)))
+        table._data[:len(array)] = array
+        table._size = len(array)
+        return table
+
+
+class GameAnalytics:
+    """增量的列式对局统计
+
+    每局结束后调用add_result追加一行对局记录和每个玩家一行的参与记录，不保留原始结果，也不创建玩家；
+    各项统计都是对列的向量化计算。refresh从结果存储上次读到的位置继续读取，save/load把统计表和读取位置
+    保存为npz快照，下次分析只需读取新追加的对局。
+    """
+
+    def __init__(self):
+        self.games = _Table(GAME_DTYPE)
+        self.players = _Table(PLAYER_DTYPE)
+        self.player_names: List[str] = []
+        self.word_pairs: List[str] = []
+        self._player_index: Dict[str, int] = {}
+        self._word_pair_index: Dict[str, int] = {}
+        self.source: Optional[str] = None  # 结果存储路径
+        self.offset = 0  # 结果存储中已读取到的字节偏移
+
+    def __len__(self) -> int:
+        return len(self.games)
+
+    def _intern_player(self, name: str) -> int:
+        if name not in self._player_index:
+            self._player_index[name] = len(self.player_names)
+            self.player_names.append(name)
+        return self._player_index[name]
+
+    def _intern_word_pair(self, words: Dict) -> int:
+        if not words:
+            return -1
+        key = f"{words['civilian']}/{words['undercover']}"
+        if key not in self._word_pair_index:
+            self._word_pair_index[key] = len(self.word_pairs)
+            self.word_pairs.append(key)
+        return self._word_pair_index[key]
+
+    def add_result(self, result: Dict):
+        """追加一局结果；旧版本的结果没有玩家角色和投票记录，只统计胜负"""
+        game = len(self.games)
+        winner_role = ROLE_CODES.get(result.get("role"), ROLE_NONE)
+        winners = set(result.get("winners") or [])
+        rounds = result.get("rounds", 0)
+        eliminations = result.get("eliminations", [])
+        eliminated_round = {item["player"]: item["round"] for item in eliminations}
+        pk_counts: Dict[str, int] = {}
+        for item in eliminations:
+            for name in item.get("pk_candidates", []):
+                pk_counts[name] = pk_counts.get(name, 0) + 1
+
+        roles = {info["name"]: info["role"] for info in result.get("players", []) if "role" in info}
+        reflection = {info["name"]: REFLECTION_CODES.get(info.get("reflection"), -1)
+                      for info in result.get("players", [])}
+        if not roles:
+            roles = {name: result.get("role") for name in winners}
+        votes_cast: Dict[str, int] = {}
+        correct_votes: Dict[str, int] = {}
+        ballots: Dict[str, int] = {}
+        penalty_votes: Dict[str, int] = {}
+        for vote in result.get("votes", []):
+            penalty = vote.get("penalty", False)
+            if vote["target"] is not None or penalty:
+                # PK轮中不是候选人的投票者的惩罚票不计入候选人得票，target为None
+                ballots[vote["voter"]] = ballots.get(vote["voter"], 0) + 1
+            if penalty:
+                penalty_votes[vote["voter"]] = penalty_votes.get(vote["voter"], 0) + 1
+            if vote["target"] is None:
+                continue
+            votes_cast[vote["voter"]] = votes_cast.get(vote["voter"], 0) + 1
+            if roles.get(vote["target"]) == "卧底":
+                correct_votes[vote["voter"]] = correct_votes.get(vote["voter"], 0) + 1
+
+        undercover_rounds = [eliminated_round.get(name, rounds) for name, role in roles.items() if role == "卧底"]
+        self.games.append([(
+            winner_role, rounds, min(undercover_rounds) if undercover_rounds else rounds,
+            self._intern_word_pair(result.get("words")), sum(1 for item in eliminations if item.get("pk"))
+        )])
+        self.players.append([
+            (game, self._intern_player(name), ROLE_CODES.get(role, ROLE_NONE), name in winners,
+             eliminated_round.get(name, rounds), votes_cast.get(name, 0), correct_votes.get(name, 0),
+             ballots.get(name, 0), penalty_votes.get(name, 0), pk_counts.get(name, 0), reflection.get(name, -1))
+            for name, role in roles.items()
+        ])
+
+    def refresh(self, path: str) -> int:
+        """读取结果存储中新追加的对局，返回新增局数；结果存储换了文件或被截断时从头重建"""
+        if self.source != path or (os.path.exists(path) and os.path.getsize(path) < self.offset):
+            self.__init__()
+            self.source = path
+        count = 0
+        for result, offset in iter_new_results(path, self.offset):
+            self.add_result(result)
+            self.offset = offset
+            count += 1
+        return count
+
+    def save(self, path: str):
+        """保存为npz快照"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        meta = {"player_names": self.player_names, "word_pairs": self.word_pairs,
+                "source": self.source, "offset": self.offset}
+        with open(path, "wb") as f:
+            np.savez(f, games=self.games.data, players=self.players.data,
+                     meta=np.array(json.dumps(meta, ensure_ascii=False)))
+
+    @classmethod
+    def load(cls, path: str) -> "GameAnalytics":
+        """读取npz快照，文件不存在或格式不兼容时返回空的统计"""
+        analytics = cls()
+        if not os.path.exists(path):
+            return analytics
+        with np.load(path) as data:
+            if data["games"].dtype != GAME_DTYPE or data["players"].dtype != PLAYER_DTYPE:
+                return analytics
+            meta = json.loads(str(data["meta"]))
+            analytics.games = _Table.from_array(data["games"])
+            analytics.players = _Table.from_array(data["players"])
+        analytics.player_names = meta["player_names"]
+        analytics.word_pairs = meta["word_pairs"]
+        analytics._player_index = {name: i for i, name in enumerate(analytics.player_names)}
+        analytics._word_pair_index = {pair: i for i, pair in enumerate(analytics.word_pairs)}
+        analytics.source = meta["source"]
+        analytics.offset = meta["offset"]
+        return analytics
+
+    def _count_by_player(self, mask: np.ndarray, weights: Optional[np.ndarray] = None) -> np.ndarray:
+        players = self.players.data
+        return np.bincount(players["player"][mask], weights=None if weights is None else weights[mask],
+                           minlength=len(self.player_names))
+
+    def win_stats(self) -> Dict[str, Dict[str, int]]:
+        """每个玩家作为各角色的胜出次数，按总数、卧底、平民降序排列"""
+        players = self.players.data
+        undercover = self._count_by_player(players["won"] & (players["role"] == ROLE_UNDERCOVER)).astype(int)
+        civilian = self._count_by_player(players["won"] & (players["role"] == ROLE_CIVILIAN)).astype(int)
+        total = undercover + civilian
+        order = np.lexsort((-civilian, -undercover, -total))
+        return {
+            self.player_names[i]: {"总数": int(total[i]), "卧底": int(undercover[i]), "平民": int(civilian[i])}
+            for i in order
+        }
+
+    def player_stats(self) -> Dict[str, Dict]:
+        """每个玩家的参与局数、投票准确率、惩罚票率、PK率和作为卧底的平均存活回合
+
+        投票准确率只统计作为平民时投出的票（投给卧底即为正确）；惩罚票率为惩罚票占投出的全部票（不含弃权）的比例；
+        PK率为进入PK的次数除以存活回合数。
+        """
+        players = self.players.data
+        civilian = players["role"] == ROLE_CIVILIAN
+        undercover = players["role"] == ROLE_UNDERCOVER
+        everyone = np.ones(len(players), dtype=bool)
+        games = self._count_by_player(everyone)
+        undercover_games = self._count_by_player(undercover)
+        votes = self._count_by_player(civilian, players["votes_cast"].astype(float))
+        correct = self._count_by_player(civilian, players["correct_votes"].astype(float))
+        ballots = self._count_by_player(everyone, players["ballots"].astype(float))
+        penalties = self._count_by_player(everyone, players["penalty_votes"].astype(float))
+        rounds_alive = self._count_by_player(everyone, players["rounds_alive"].astype(float))
+        pk_rounds = self._count_by_player(everyone, players["pk_rounds"].astype(float))
+        survival = self._count_by_player(undercover, players["rounds_alive"].astype(float))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            accuracy = correct / votes
+            penalty_rate = penalties / ballots
+            pk_rate = pk_rounds / rounds_alive
+            avg_survival = survival / undercover_games
+        return {
+            name: {
+                "games": int(games[i]),
+                "undercover_games": int(undercover_games[i]),
+                "vote_accuracy": _nan_to_none(accuracy[i]),
+                "penalty_rate": _nan_to_none(penalty_rate[i]),
+                "pk_rate": _nan_to_none(pk_rate[i]),
+                "undercover_survival": _nan_to_none(avg_survival[i])
+            }
+            for i, name in enumerate(self.player_names)
+        }
+
+    def reflection_stats(self) -> Dict[str, Dict]:
+        """按反思方式比较玩家表现：参与次数、作为平民的投票准确率、胜率和作为卧底的平均存活回合"""
+        players = self.players.data
+        stats = {}
+        for mode, code in REFLECTION_CODES.items():
+            rows = players[players["reflection"] == code]
+            if not len(rows):
+                continue
+            civilian = rows[rows["role"] == ROLE_CIVILIAN]
+            undercover = rows[rows["role"] == ROLE_UNDERCOVER]
+            votes = int(civilian["votes_cast"].sum())
+            stats[mode] = {
+                "games": len(rows),
+                "vote_accuracy": float(civilian["correct_votes"].sum() / votes) if votes else None,
+                "win_rate": float(rows["won"].mean()),
+                "undercover_survival": float(undercover["rounds_alive"].mean()) if len(undercover) else None
+            }
+        return stats
+
+    def word_pair_stats(self) -> Dict[str, Dict]:
+        """每组词语的局数、平民胜率和平均回合数，按局数降序排列"""
+        games = self.games.data
+        recorded = games["word_pair"] >= 0
+        pairs = games["word_pair"][recorded]
+        counts = np.bincount(pairs, minlength=len(self.word_pairs))
+        civilian_wins = np.bincount(pairs, weights=games["winner_role"][recorded] == ROLE_CIVILIAN,
+                                    minlength=len(self.word_pairs))
+        rounds = np.bincount(pairs, weights=games["rounds"][recorded], minlength=len(self.word_pairs))
+        return {
+            self.word_pairs[i]: {
+                "games": int(counts[i]),
+                "civilian_win_rate": float(civilian_wins[i] / counts[i]),
+                "avg_rounds": float(rounds[i] / counts[i])
+            }
+            for i in np.argsort(-counts, kind="stable") if counts[i]
+        }
+
+    def summary(self) -> Dict:
+        """全部对局的总体统计"""
+        games = self.games.data
+        if not len(games):
+            return {"games": 0}
+        return {
+            "games": len(games),
+            "civilian_win_rate": float(np.mean(games["winner_role"] == ROLE_CIVILIAN)),
+            "undercover_win_rate": float(np.mean(games["winner_role"] == ROLE_UNDERCOVER)),
+            "avg_rounds": float(np.mean(games["rounds"])),
+            "avg_undercover_survival": float(np.mean(games["undercover_survival"])),
+            "pk_round_rate": float(games["pk_rounds"].sum() / max(1, games["rounds"].sum()))
+        }
+
+
+def _nan_to_none(value: float) -> Optional[float]:
+    return None if np.isnan(value) else float(value)
@@ -0,0 +1,164 @@
+import argparse
+import json
+import math
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from game import UndercoverGame, create_players
+from multi_run_games import multi_run_games
+import player_configs
+from scheduler import LLMScheduler, ModelResidency
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """最近秩法计算分位数，values为空时返回None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _mock_players(num_players: int, num_models: int = 1):
+    """模拟玩家，num_models大于1时玩家轮流使用不同名字的模拟模型"""
+    return create_players([
+        {"name": f"玩家{i}", "model": "mock" if num_models <= 1 else f"mock-{i % num_models}", "local": True}
+        for i in range(num_players)
+    ])
+
+
+def measure_game_memory(num_players: int) -> Dict:
+    """用tracemalloc测量一局的内存峰值和结果大小（单独运行，避免影响吞吐测量）"""
+    player_map = _mock_players(num_players)
+    tracemalloc.start()
+    game = UndercoverGame(player_map=player_map, verbose=False)
+    game.start_game(save=False)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result_bytes = len(json.dumps(game.full_result(), ensure_ascii=False).encode("utf-8"))
+    return {"peak_kb": round(peak / 1024, 1), "result_kb": round(result_bytes / 1024, 1)}
+
+
+def run_benchmark(num_players: int, concurrency: int, num_games: int, description_mode: str = "sequential",
+                  num_models: int = 1, max_resident: int = 0) -> Dict:
+    """用模拟后端连续运行num_games局，返回吞吐和各阶段耗时分位数
+
+    Args:
+        num_players: 每局玩家数
+        concurrency: 调度器的最大在途请求数，0表示串行
+        num_games: 局数（同一批玩家连续对局，与multi_run_games一致）
+        description_mode: 描述阶段的方式，parallel在串行（无调度器）时等同于sequential
+        num_models: 玩家使用的模拟模型数
+        max_resident: 调度器的模型驻留上限，0表示不管理模型驻留
+    """
+    scheduler = None
+    if concurrency:
+        residency = {"mock": ModelResidency(max_resident)} if max_resident else None
+        scheduler = LLMScheduler(max_inflight=concurrency, backend_limits={"mock": concurrency}, residency=residency)
+    try:
+        start = time.perf_counter()
+        _, game_results = multi_run_games(num_games, scheduler, parallel_votes=scheduler is not None,
+                                          player_map=_mock_players(num_players, num_models), save=False,
+                                          verbose=False,
+                                          description_mode=description_mode)
+        elapsed = time.perf_counter() - start
+    finally:
+        if scheduler:
+            scheduler.shutdown()
+
+    calls = sum(summary["calls"] for result in game_results for summary in result["llm_metrics"].values())
+    load_ms = sum(summary["load_ms"] for result in game_results for summary in result["llm_metrics"].values())
+    phase_seconds: Dict[str, List[float]] = {}
+    for result in game_results:
+        for phase, durations in result["phase_seconds"].items():
+            phase_seconds.setdefault(phase, []).extend(durations)
+    return {
+        "players": num_players,
+        "concurrency": concurrency,
+        "games": num_games,
+        "seconds": round(elapsed, 3),
+        "games_per_sec": round(num_games / elapsed, 2),
+        "calls_per_sec": round(calls / elapsed, 1),
+        "load_seconds": round(load_ms / 1000, 2),
+        "phase_ms": {
+            phase: {"p50": round(percentile(durations, 50) * 1000, 1),
+                    "p99": round(percentile(durations, 99) * 1000, 1)}
+            for phase, durations in phase_seconds.items()
+        },
+        **measure_game_memory(num_players)
+    }
+
+
+def print_benchmark_table(rows: List[Dict]):
+    print("\n-- 基准测试结果 --")
+    phases = sorted({phase for row in rows for phase in row["phase_ms"]})
+    header = "{:<6}{:<6}{:>10}{:>10}".format("玩家", "并发", "局/秒", "调用/秒")
+    header += "".join("{:>22}".format(f"{phase} p50/p99(ms)") for phase in phases)
+    header += "{:>12}{:>12}{:>12}".format("加载耗时s", "内存峰值KB", "结果KB")
+    print(header)
+    for row in rows:
+        line = "{:<8}{:<8}{:>12}{:>12}".format(row["players"], row["concurrency"] or "串行",
+                                               row["games_per_sec"], row["calls_per_sec"])
+        for phase in phases:
+            latency = row["phase_ms"].get(phase)
+            line += "{:>24}".format(f"{latency['p50']}/{latency['p99']}" if latency else "-")
+        line += "{:>14}{:>14}{:>14}".format(row["load_seconds"], row["peak_kb"], row["result_kb"])
+        print(line)
+
+
+def _int_list(text: str) -> List[int]:
+    return [int(item) for item in text.split(",") if item.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="使用模拟LLM后端对游戏引擎、调度器和结果处理做离线基准测试")
+    parser.add_argument("--players", type=_int_list, default=[4, 7, 10], help="玩家数，逗号分隔")
+    parser.add_argument("--concurrency", type=_int_list, default=[0, 4, 16], help="最大在途请求数，0为串行，逗号分隔")
+    parser.add_argument("--games", type=int, default=5, help="每个组合运行的局数")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟调用的平均延迟秒数")
+    parser.add_argument("--distribution", default="lognormal", help="延迟分布：fixed、uniform或lognormal")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="模拟调用失败的概率")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="模拟输出畸形JSON的概率")
+    parser.add_argument("--seed", type=int, default=None, help="模拟后端的随机种子")
+    parser.add_argument("--description-mode", default="sequential",
+                        help="描述阶段的方式：sequential、parallel或sequential_aware")
+    parser.add_argument("--models", type=int, default=1, help="玩家使用的模拟模型数")
+    parser.add_argument("--max-loaded", type=int, default=0, help="模拟后端同时加载的模型数，0表示不模拟模型加载")
+    parser.add_argument("--load-latency", type=float, default=1.0, help="模拟加载一个模型的秒数")
+    parser.add_argument("--max-resident", type=int, default=0,
+                        help="调度器的模型驻留上限（一般与--max-loaded相同），0表示不管理模型驻留")
+    parser.add_argument("--capacity", type=int, default=0, help="模拟后端同时处理的请求数，0表示不限制")
+    parser.add_argument("--batch-window", type=float, default=0.0,
+                        help="请求合并的时间窗口毫秒数，0表示不合并（模拟后端的一批只占一个处理位置）")
+    parser.add_argument("--max-batch-size", type=int, default=16, help="请求合并的最大批量")
+    parser.add_argument("--output", default=None, help="把结果写入JSON文件")
+    args = parser.parse_args()
+
+    # 本进程内所有玩家都使用模拟后端
+    player_configs.llm_config["mock"] = {
+        "enabled": True,
+        "latency_mean": args.latency,
+        "latency_distribution": args.distribution,
+        "failure_rate": args.failure_rate,
+        "malformed_rate": args.malformed_rate,
+        "seed": args.seed,
+        "max_loaded": args.max_loaded,
+        "load_latency": args.load_latency,
+        "capacity": args.capacity
+    }
+    player_configs.llm_config["batch"] = {
+        "enabled": args.batch_window > 0,
+        "window_ms": args.batch_window,
+        "max_batch_size": args.max_batch_size
+    }
+    rows = []
+    for num_players in args.players:
+        for concurrency in args.concurrency:
+            print(f"运行: {num_players} 名玩家, 并发 {concurrency or '串行'}, {args.games} 局")
+            rows.append(run_benchmark(num_players, concurrency, args.games, args.description_mode,
+                                      args.models, args.max_resident))
+    print_benchmark_table(rows)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=4)
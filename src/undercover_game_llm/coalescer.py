@@ -0,0 +1,170 @@
+import json
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+from llm_client import LLMCallError, LLMClient, llm_logger
+from metrics import note
+
+# 服务端不支持批量补全接口时的状态码
+_UNSUPPORTED_STATUS = (400, 404, 405, 501)
+# 批量调用不可用时通知各调用方自行调用
+_FALLBACK = object()
+
+
+class _Batch:
+    """同一模型、同一Schema和结束条件在一个时间窗口内收集到的请求"""
+
+    def __init__(self):
+        self.messages: List[List[Dict]] = []
+        self.futures: List[Future] = []
+        self.closed = threading.Event()  # 达到批量上限时通知发起者立即发送
+
+
+class CoalescingClient(LLMClient):
+    """把并发的同模型请求合并为批量调用的客户端（微批处理）
+
+    某个模型、某个Schema（和结束条件）的请求到达时如果没有其它同类请求在途（如串行调用），直接发送而不等待；
+    否则第一个请求打开一批并等待window_ms毫秒，期间到达的同类请求加入该批，满max_batch_size个时立即发送；
+    由打开该批的调用方线程通过batch_chat一次发出，结果按顺序交回各调用方。
+    窗口内只有一个请求时按普通chat发送。各调用方在自己的线程中记录计量，附带batch_size。
+    服务端不支持批量补全接口时记住该模型，之后该模型的请求不再合并。
+
+    位于重试熔断层之下：批量调用失败时每个调用方各自收到错误并各自重试，重试的请求会重新参与合并。
+    """
+
+    def __init__(self, client: LLMClient, window_ms: float = 10.0, max_batch_size: int = 16,
+                 templates: Optional[Dict[str, str]] = None, default_template: str = "chatml",
+                 max_tokens: int = 2048, guided_json: bool = False):
+        """初始化
+
+        Args:
+            client: 支持batch_chat的底层客户端
+            window_ms: 收集一批请求的时间窗口（毫秒）
+            max_batch_size: 一批的最大请求数
+            templates: {模型: 对话模板名}，批量补全时按模型渲染提示词
+            default_template: 未在templates中的模型使用的对话模板
+            max_tokens: 批量补全的最大生成token数
+            guided_json: 是否把Schema作为vLLM的guided_json参数约束输出
+        """
+        self.client = client
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.templates = dict(templates or {})
+        self.default_template = default_template
+        self.max_tokens = max_tokens
+        self.guided_json = guided_json
+        self.logger = llm_logger
+        self._open: Dict[tuple, _Batch] = {}
+        self._inflight: Dict[tuple, int] = {}  # {合并键: 在途的调用数}，用于判断是否值得等待窗口
+        self._unbatchable = set()  # 服务端不支持批量调用的模型
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        return self.client.backend
+
+    def warm_up(self, model):
+        self.client.warm_up(model)
+
+    def loaded_models(self):
+        return self.client.loaded_models()
+
+    def chat(self, messages, model, schema=None, stop_on=None):
+        if model in self._unbatchable:
+            return self.client.chat(messages, model, schema=schema, stop_on=stop_on)
+        key = (model, json.dumps(schema, sort_keys=True) if schema is not None else None, stop_on)
+        future: Future = Future()
+        with self._lock:
+            busy = self._inflight.get(key, 0)
+            self._inflight[key] = busy + 1
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader and busy == 0:
+                # 没有其它同类请求在途（如串行调用），不会有请求来合并，直接发送而不等待窗口
+                batch = None
+            else:
+                if leader:
+                    batch = self._open[key] = _Batch()
+                batch.messages.append(messages)
+                batch.futures.append(future)
+                if len(batch.messages) >= self.max_batch_size:
+                    del self._open[key]
+                    batch.closed.set()
+        try:
+            if batch is None:
+                return self.client.chat(messages, model, schema=schema, stop_on=stop_on)
+            if leader:
+                batch.closed.wait(self.window)
+                with self._lock:
+                    if self._open.get(key) is batch:
+                        del self._open[key]
+                if len(batch.messages) == 1:
+                    return self.client.chat(messages, model, schema=schema, stop_on=stop_on)
+                self._send(batch, model, schema, stop_on)
+
+            result = future.result()
+            if result is _FALLBACK:
+                return self.client.chat(messages, model, schema=schema, stop_on=stop_on)
+            content, reasoning_content, stats = result
+            note(**stats, batch_size=len(batch.messages))
+            return content, reasoning_content
+        finally:
+            with self._lock:
+                self._inflight[key] -= 1
+                if not self._inflight[key]:
+                    del self._inflight[key]
+
+    def _send(self, batch: _Batch, model: str, schema: Optional[Dict], stop_on: Optional[str]):
+        """发送一批请求，把结果或错误交给每个调用方"""
+        try:
+            results = self.client.batch_chat(
+                batch.messages, model, schema=schema, stop_on=stop_on,
+                template=self.templates.get(model, self.default_template), max_tokens=self.max_tokens,
+                guided_json=self.guided_json
+            )
+        except LLMCallError as e:
+            if not e.retryable and e.status_code in _UNSUPPORTED_STATUS:
+                self.logger.warning(f"{model} 不支持批量调用，之后逐个发送: {str(e)}")
+                self._unbatchable.add(model)
+                results = [_FALLBACK] * len(batch.futures)
+            else:
+                for future in batch.futures:
+                    future.set_exception(e)
+                return
+        except Exception as e:
+            for future in batch.futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(batch.futures, results):
+            future.set_result(result)
+
+
+_coalescing_clients: Dict[int, CoalescingClient] = {}
+_coalescing_lock = threading.Lock()
+_unbatchable_clients = set()  # 已提示过不支持批量调用的客户端
+
+
+def wrap_with_batching(client: LLMClient, config: Dict) -> LLMClient:
+    """根据 [llm.batch] 配置为支持批量调用的客户端加上请求合并，同一个底层客户端只包装一次以便跨玩家、跨对局合并"""
+    if not config.get("enabled", False):
+        return client
+    with _coalescing_lock:
+        if not client.supports_batch:
+            if id(client) not in _unbatchable_clients:
+                _unbatchable_clients.add(id(client))
+                llm_logger.warning(f"{client.backend} 客户端不支持批量调用，[llm.batch] 对其不生效")
+            return client
+        wrapped = _coalescing_clients.get(id(client))
+        if wrapped is None:
+            wrapped = CoalescingClient(
+                client,
+                window_ms=config.get("window_ms", 10.0),
+                max_batch_size=config.get("max_batch_size", 16),
+                templates=config.get("templates"),
+                default_template=config.get("default_template", "chatml"),
+                max_tokens=config.get("max_tokens", 2048),
+                guided_json=config.get("guided_json", False)
+            )
+            _coalescing_clients[id(client)] = wrapped
+        return wrapped
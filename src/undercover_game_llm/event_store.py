@@ -0,0 +1,113 @@
+import json
+import tempfile
+from typing import Dict, Iterator, List, Tuple
+
+
+class GameEvent:
+    """一条游戏事件"""
+
+    __slots__ = ("round", "event", "private")
+
+    def __init__(self, round_no: int, event: str, private: bool = False):
+        self.round = round_no
+        self.event = event
+        self.private = private
+
+    def to_dict(self) -> Dict:
+        return {"round": self.round, "event": self.event, "private": self.private}
+
+
+class EventStore:
+    """按回合索引的游戏事件存储
+
+    回合号只增不减，每个回合的事件是连续的一段。新回合的第一条事件写入时，之前回合的事件被序列化到
+    临时文件（spill）并从内存中移除，内存中只保留当前回合；记录每个回合在文件中的偏移，
+    取某一回合的事件只需读取该回合的那一段。
+    """
+
+    def __init__(self, spill: bool = True):
+        """初始化
+
+        Args:
+            spill: 是否把已结束回合的事件转存到临时文件，为False时全部保留在内存中
+        """
+        self._events: List[GameEvent] = []  # 尚未转存的事件
+        self._round_start: Dict[int, int] = {}  # {回合: 该回合在_events中的起始下标}，只含内存中的回合
+        self._spilled: Dict[int, Tuple[int, int]] = {}  # {回合: (文件偏移, 字节数)}
+        self._spool = tempfile.TemporaryFile("w+b") if spill else None
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, round_no: int, event: str, private: bool = False):
+        if round_no not in self._round_start:
+            self._spill_before(round_no)
+            self._round_start[round_no] = len(self._events)
+        self._events.append(GameEvent(round_no, event, private))
+        self._count += 1
+
+    def round_events(self, round_no: int) -> List[GameEvent]:
+        """取出某一回合的全部事件"""
+        if round_no in self._spilled:
+            if self._spool is None:
+                raise ValueError("事件存储已关闭，已转存的事件不能再读取")
+            offset, size = self._spilled[round_no]
+            self._spool.seek(offset)
+            return [_decode(line) for line in self._spool.read(size).splitlines()]
+        start = self._round_start.get(round_no)
+        if start is None:
+            return []
+        later = [index for r, index in self._round_start.items() if r > round_no]
+        return self._events[start:min(later) if later else len(self._events)]
+
+    def round_summary(self, round_no: int, ignore_private: bool) -> str:
+        """某一回合事件的文字摘要，每行一条"""
+        return "\n".join(
+            f"- {event.event}" for event in self.round_events(round_no) if not ignore_private or not event.private
+        )
+
+    def __iter__(self) -> Iterator[GameEvent]:
+        """按顺序遍历全部事件，已转存的部分从临时文件中逐段读取"""
+        for round_no in sorted(self._spilled):
+            yield from self.round_events(round_no)
+        yield from list(self._events)
+
+    def to_dicts(self) -> List[Dict]:
+        return [event.to_dict() for event in self]
+
+    def __enter__(self) -> "EventStore":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """释放临时文件（可重复调用）；之后已转存的事件不能再读取"""
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def _spill_before(self, round_no: int):
+        """把round_no之前所有回合的事件转存到临时文件"""
+        if self._spool is None or not self._events:
+            return
+        self._spool.seek(0, 2)
+        for r, start in sorted(self._round_start.items(), key=lambda item: item[1]):
+            later = [index for other, index in self._round_start.items() if index > start]
+            end = min(later) if later else len(self._events)
+            data = b"".join(_encode(event) for event in self._events[start:end])
+            self._spilled[r] = (self._spool.tell(), len(data))
+            self._spool.write(data)
+        self._events = []
+        self._round_start = {}
+
+
+def _encode(event: GameEvent) -> bytes:
+    return (json.dumps([event.round, event.event, event.private], ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _decode(line: bytes) -> GameEvent:
+    round_no, event, private = json.loads(line)
+    return GameEvent(round_no, event, private)
+
@@ -1,22 +1,85 @@
-import json
 import random
-from datetime import datetime
+import time
+from collections import Counter
+from contextlib import contextmanager
 from typing import List, Dict, Optional, Tuple
-from player import AIPlayer
+from player import AIPlayer, warm_up_models
+from event_store import EventStore
+from memory import token_counter
+from metrics import export_metrics, metrics_recorder, summarize_metrics, tag_calls
+from prompt_builder import summarize_prefix_stats
+from result_store import ResultStore, get_result_store, new_game_uid
+from runtime import project_path
+from scheduler import LLMScheduler
+from word_bank import WordSampler, get_word_sampler, pair_id
 
 
-# 导入玩家配置
-from player_configs import player_configs
+# 玩家配置，各配置项在使用时才读取（见player_configs）
+import player_configs
+
+# 描述阶段的方式
+DESCRIPTION_SEQUENTIAL = "sequential"  # 按发言顺序逐个调用
+DESCRIPTION_PARALLEL = "parallel"  # 描述互不依赖，同时发出全部请求（需调度器），按发言顺序记录
+DESCRIPTION_SEQUENTIAL_AWARE = "sequential_aware"  # 逐个调用，后发言的玩家能看到本轮之前的描述
+DESCRIPTION_MODES = (DESCRIPTION_SEQUENTIAL, DESCRIPTION_PARALLEL, DESCRIPTION_SEQUENTIAL_AWARE)
+
+
+def create_players(configs: List[Dict]) -> Dict[int, AIPlayer]:
+    """根据玩家配置创建玩家，并初始化彼此的印象"""
+    player_map: Dict[int, AIPlayer] = {}
+    for i, config in enumerate(configs):
+        pid = i
+        player = AIPlayer(
+            player_id=pid,
+            name=config["name"],
+            word="",
+            role="平民",  # 初始角色为平民，后续会重新分配
+            model=config["model"],
+            local=config["local"]
+        )
+        player_map[pid] = player
+
+    # 初始化印象
+    for player in player_map.values():
+        player.player_map = player_map
+        player.impressions = {
+            other_pid: f"新玩家，尚无足够信息"
+            for other_pid in range(len(player_map))
+            if other_pid != player.player_id
+        }
+    return player_map
+
 
 class UndercoverGame:
-    def __init__(self, player_map: Optional[Dict[int, AIPlayer]] = None, game_id: Optional[int] = 1):
+    def __init__(self, player_map: Optional[Dict[int, AIPlayer]] = None, game_id: Optional[int] = 1,
+                 scheduler: Optional[LLMScheduler] = None, parallel_votes: bool = False,
+                 seed: Optional[int] = None, verbose: bool = True, word_sampler: Optional[WordSampler] = None,
+                 description_mode: str = DESCRIPTION_SEQUENTIAL):
         self.game_id = game_id
+        self.game_uid = new_game_uid()  # 全局唯一的对局ID，作为结果存储中的主键
+        # 本局所有随机选择（词语、卧底、发言顺序、PK平票）都来自这个随机数生成器，相同的种子得到相同的对局
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.rng = random.Random(self.seed)
+        self.verbose = verbose  # 为False时不打印对局过程（回放、性能测试）
+        self.scheduler = scheduler  # 为None时所有LLM调用按顺序串行执行
+        self.parallel_votes = parallel_votes and scheduler is not None  # 并行投票需要调度器
+        if description_mode not in DESCRIPTION_MODES:
+            raise ValueError(f"未知的描述方式: {description_mode}")
+        if description_mode == DESCRIPTION_PARALLEL and scheduler is None:
+            description_mode = DESCRIPTION_SEQUENTIAL  # 并行描述需要调度器，结果与逐个调用相同
+        self.description_mode = description_mode
+        self.word_sampler = word_sampler or get_word_sampler(player_configs.words_config)
+        self.word_index = -1
         self.civilian_word = ""
         self.undercover_word = ""
-        self.game_history: List[Dict] = []
+        self.events = EventStore()  # 已结束回合的事件转存到临时文件，保存结果时流式写出
         self.current_descriptions: Dict[int, str] = {}
         self.current_round = 1
         self.find_undercover = False
+        self.call_metrics: List[Dict] = []  # 本局每次LLM调用的计量记录
+        self.phase_seconds: Dict[str, List[float]] = {}  # {阶段: 每轮该阶段的耗时秒数}
+        self.votes: List[Dict] = []  # 每张选票 {round, voter, target, pk, penalty}，弃权时target为None
+        self.eliminations: List[Dict] = []  # 每轮被淘汰的玩家 {round, player, role, pk, pk_candidates, abstained}
         if player_map:
             self.player_map = player_map
             self._reassign_players()
@@ -24,6 +87,23 @@ class UndercoverGame:
             self.player_map: Dict[int, AIPlayer] = {}
             self._initialize_players()
             self._reassign_players()
+        for player in self.player_map.values():
+            player.reset_stats()  # 前缀命中率、JSON修复次数等按局统计
+        # 开局时的玩家记忆，回放链式对局中的某一局时需要从这里恢复
+        self.initial_memory = {str(pid): player.export_memory() for pid, player in self.player_map.items()}
+        # 本局使用的token计数校准系数，记忆压缩的决策依赖它，回放时需要恢复
+        self.token_scale = dict(token_counter.scale)
+        # 本局玩家记忆的token预算（所有玩家按同一份 [memory] 配置创建），回放时需要恢复
+        self.memory_config = next(iter(self.player_map.values())).memory.settings()
+
+    @property
+    def game_history(self) -> List[Dict]:
+        """全部事件的列表（会把已转存的事件读回内存）"""
+        return self.events.to_dicts()
+
+    def full_result(self) -> Dict:
+        """包含完整事件列表的对局结果，与保存到文件的内容一致"""
+        return {**self.game_result, "game_history": self.game_history}
 
     @property
     def undercover_names(self):
@@ -32,13 +112,11 @@ class UndercoverGame:
 
     def _reassign_players(self):
         """重新分配玩家角色和词语"""
-        # 从gamewords.json随机选择一组词语
-        with open("conf/gamewords.json", "r", encoding="utf-8") as f:
-            all_word_pairs = json.load(f)
-        word_pair = random.choice(all_word_pairs)
-        self.civilian_word = word_pair[0]
-        self.undercover_word = word_pair[1]
-        self.undercover_id = random.choice(list(self.player_map.keys()))
+        # 按配置的抽样策略选择一组词语，无论哪种策略都恰好消耗一次随机数，保证相同种子的后续随机序列一致
+        bank = self.word_sampler.bank
+        self.word_index = self.word_sampler.sample(self.rng.randrange(len(bank)), self.game_id or 1)
+        self.civilian_word, self.undercover_word = bank[self.word_index]
+        self.undercover_id = self.rng.choice(list(self.player_map.keys()))
         for player in self.player_map.values():
             role = "卧底" if player.player_id == self.undercover_id else "平民"
             word = self.undercover_word if role == "卧底" else self.civilian_word
@@ -48,32 +126,23 @@ class UndercoverGame:
 
     def _initialize_players(self):
         """初始化玩家并分配角色"""
-        for i, config in enumerate(player_configs):
-            pid = i
-            player = AIPlayer(
-                player_id=pid,
-                name=config["name"],
-                word="",
-                role="平民",  # 初始角色为平民，后续会重新分配
-                model=config["model"],
-                local=config["local"]
-            )
-            self.player_map[pid] = player
-        
-        # 初始化印象
-        for player in self.player_map.values():
-            player.player_map = self.player_map
-            player.impressions = {
-                other_pid: f"新玩家，尚无足够信息" 
-                for other_pid in range(len(self.player_map))
-                if other_pid != player.player_id
-            }
-        
+        self.player_map = create_players(player_configs.player_configs)
 
     def _record_event(self, event: str, private: bool = False):
         """记录游戏事件"""
-        self.game_history.append({"round": self.current_round, "event": event, "private": private})
-        print(f"[第 {self.game_id} 局][回合 {self.current_round}] {event}")
+        self.events.append(self.current_round, event, private)
+        if self.verbose:
+            print(f"[第 {self.game_id} 局][回合 {self.current_round}] {event}")
+
+    def _record_vote(self, voter: AIPlayer, vote_id: Optional[int], pk: bool, penalty: bool):
+        """记录一张选票，供结果分析统计投票准确率和惩罚票率"""
+        self.votes.append({
+            "round": self.current_round,
+            "voter": voter.name,
+            "target": None if vote_id is None else self.player_map[vote_id].name,
+            "pk": pk,
+            "penalty": penalty
+        })
 
     def _get_alive_players(self) -> List[AIPlayer]:
         """获取当前存活的玩家列表"""
@@ -81,32 +150,68 @@ class UndercoverGame:
     
     def _get_round_history_summary(self, ignore_private: bool) -> str:
         """获取当前回合历史记录的摘要"""
-        return "\n".join(f"- {event['event']}" for event in self.game_history if event['round'] == self.current_round and (not ignore_private or not event['private']))
+        return self.events.round_summary(self.current_round, ignore_private)
 
     def description_phase(self):
         """进行描述阶段，生成玩家描述"""
         self.current_descriptions = {}
         alive_players = self._get_alive_players()
-        random.shuffle(alive_players)
-        
-        for player in alive_players:
-            behavior, reason = player.generate_description()
+        self.rng.shuffle(alive_players)
+
+        if self.description_mode == DESCRIPTION_PARALLEL:
+            # 描述提示词不包含本轮其他人的描述，全部请求同时发出，完成后按发言顺序记录
+            futures = [
+                self.scheduler.submit(player.generate_description, backend=player.llm_client.backend,
+                                      model=player.model)
+                for player in alive_players
+            ]
+            descriptions = [future.result() for future in futures]
+        else:
+            descriptions = None
+
+        for index, player in enumerate(alive_players):
+            if descriptions is not None:
+                behavior, reason = descriptions[index]
+            elif self.description_mode == DESCRIPTION_SEQUENTIAL_AWARE:
+                behavior, reason = player.generate_description(earlier_descriptions=self.current_descriptions)
+            else:
+                behavior, reason = player.generate_description()
             self.current_descriptions[player.player_id] = behavior
             self._record_event(f"{player.name} 描述: {behavior}")
             self._record_event(f"理由: {reason}", private=True)
-    
+
+    def _collect_votes(self, voters: List[AIPlayer], candidates_of) -> List[Tuple[Optional[int], str, bool]]:
+        """收集所有投票者的投票，结果顺序与voters一致
+
+        所有投票者看到的是同一份描述和状态，开启并行投票时同时发出全部请求，否则逐个调用。
+        """
+        if self.parallel_votes:
+            futures = [
+                self.scheduler.submit(voter.vote, candidates_of(voter), self.current_descriptions,
+                                      backend=voter.llm_client.backend, model=voter.model)
+                for voter in voters
+            ]
+            return [future.result() for future in futures]
+        return [voter.vote(candidates_of(voter), self.current_descriptions) for voter in voters]
+
     def voting_phase(self) -> Tuple[Optional[int], Optional[List[int]]]:
-        """进行投票阶段，返回被淘汰的玩家ID, 以及可能平票的候选列表"""
+        """进行投票阶段，返回被淘汰的玩家ID, 以及可能平票的候选列表；所有人都弃权时两者都为None"""
         alive_players = self._get_alive_players()
         votes: Dict[int, int] = {}
         reasons: Dict[int, str] = {}
         
-        for voter in alive_players:
-            candidates = [p.player_id for p in alive_players if p != voter]
-            vote_id, reason = voter.vote(candidates, self.current_descriptions)
-            
-            votes[vote_id] = votes.get(vote_id, 0) + 1
-            reasons[voter.player_id] = f"{voter.name}投了{self.player_map[vote_id].name}， 理由: {reason}"
+        ballots = self._collect_votes(
+            alive_players, lambda voter: [p.player_id for p in alive_players if p != voter]
+        )
+        # 按投票者顺序记录事件，保证结果文件可比
+        for voter, (vote_id, reason, penalty) in zip(alive_players, ballots):
+            self._record_vote(voter, vote_id, pk=False, penalty=penalty)
+            if vote_id is None:
+                # 模型调用失败，弃权票不计入
+                reasons[voter.player_id] = f"{voter.name}弃权（{reason}）"
+            else:
+                votes[vote_id] = votes.get(vote_id, 0) + 1
+                reasons[voter.player_id] = f"{voter.name}投了{self.player_map[vote_id].name}， 理由: {reason}"
             self._record_event(reasons[voter.player_id])
         
         if not votes:
@@ -132,9 +237,12 @@ class UndercoverGame:
         alive_players = self._get_alive_players()
         votes: Dict[int, int] = {pid: 0 for pid in candidates}
         
-        for voter in alive_players:
-            vote_id, reason = voter.vote(candidates, self.current_descriptions)
-            if vote_id in candidates:
+        ballots = self._collect_votes(alive_players, lambda voter: candidates)
+        for voter, (vote_id, reason, penalty) in zip(alive_players, ballots):
+            self._record_vote(voter, vote_id if vote_id in candidates else None, pk=True, penalty=penalty)
+            if vote_id is None:
+                self._record_event(f"{voter.name}弃权（{reason}）")
+            elif vote_id in candidates:
                 votes[vote_id] += 1
                 self._record_event(f"{voter.name}投了{self.player_map[vote_id].name}， 理由: {reason}")
         
@@ -142,7 +250,7 @@ class UndercoverGame:
         max_candidates = [pid for pid, count in votes.items() if count == max_votes]
         
         if len(max_candidates) > 1:
-            eliminated = random.choice(max_candidates)
+            eliminated = self.rng.choice(max_candidates)
             self._record_event(f"再次平票！随机淘汰 {self.player_map[eliminated].name}")
             return eliminated
         
@@ -153,14 +261,31 @@ class UndercoverGame:
     def update_impressions(self):
         history_summary = self._get_round_history_summary(True)
         self._record_event("===== 更新印象阶段开始 =====")
+        if self.scheduler:
+            # 所有玩家的印象更新并发进行，全部完成后再按玩家顺序记录，保证日志顺序确定
+            futures = [
+                player.update_impressions_async(history_summary, self.scheduler)
+                for player in self.player_map.values()
+            ]
+            for future in futures:
+                future.result()
         for player in self.player_map.values():
-            player.update_impressions(history_summary)
+            if not self.scheduler:
+                player.update_impressions(history_summary)
             formatted_impressions = "\n".join(
                 f"{self.player_map[key].name}: {msg}" for key, msg in player.impressions.items()
             )
             self._record_event(f"{player.name} 更新印象: \n{formatted_impressions}")
             self._record_event(f"{player.name} 更新规则理解: \n{player.player_rules}")
     
+    @contextmanager
+    def _timed_phase(self, phase: str):
+        """标记阶段内的LLM调用，并记录阶段耗时"""
+        start = time.perf_counter()
+        with tag_calls(phase=phase):
+            yield
+        self.phase_seconds.setdefault(phase, []).append(round(time.perf_counter() - start, 4))
+
     def play_round(self):
         """进行一轮游戏"""
         self._record_event(f"===== 第 {self.current_round} 轮开始 =====")
@@ -168,15 +293,34 @@ class UndercoverGame:
         self._record_event(f"当前存活玩家: {', '.join(player.name for player in self._get_alive_players())}")
         self._record_event(f"卧底玩家: {', '.join(self.undercover_names)}", private=True)
         self._record_event("===== 描述阶段开始 =====")
-        self.description_phase()
+        with self._timed_phase("description"):
+            self.description_phase()
         
         self._record_event("===== 投票阶段开始 =====")
-        eliminated, max_candidates = self.voting_phase()
+        with self._timed_phase("vote"):
+            eliminated, max_candidates = self.voting_phase()
         
-        if eliminated is None:
-            eliminated = self.pk_voting_phase(max_candidates)
+        abstained = eliminated is None and max_candidates is None
+        if abstained:
+            # 所有人都弃权（模型调用失败或熔断）：随机淘汰一名存活玩家，保证对局能继续推进
+            eliminated = self.rng.choice([player.player_id for player in self._get_alive_players()])
+            self._record_event(f"全员弃权！随机淘汰 {self.player_map[eliminated].name}"
+                               f"（{self.player_map[eliminated].role}）")
+
+        pk = eliminated is None
+        if pk:
+            with self._timed_phase("pk"):
+                eliminated = self.pk_voting_phase(max_candidates)
         
         self.player_map[eliminated].is_alive = False
+        self.eliminations.append({
+            "round": self.current_round,
+            "player": self.player_map[eliminated].name,
+            "role": self.player_map[eliminated].role,
+            "pk": pk,
+            "pk_candidates": [self.player_map[pid].name for pid in max_candidates] if pk else [],
+            "abstained": abstained
+        })
 
         if self.player_map[eliminated].role == "卧底":
             self.find_undercover = True
@@ -191,19 +335,18 @@ class UndercoverGame:
                 self._record_event(winners_log)
                 self.game_result = {
                     "winners": winner_names,
-                    "role": role,
-                    "game_history": self.game_history
+                    "role": role
                 }
             else:
                 winners_log = "游戏结束！无人获胜"
                 self._record_event(winners_log)
-                self.game_result = {    
+                self.game_result = {
                     "winners": [],
-                    "role": "",
-                    "game_history": self.game_history
+                    "role": ""
                 }
 
-        self.update_impressions()
+        with self._timed_phase("reflect"):
+            self.update_impressions()
         self.current_round += 1
     
     def check_game_end(self) -> bool:
@@ -211,23 +354,119 @@ class UndercoverGame:
         # 游戏结束条件：存活玩家少于等于2人（少于2人代表卧底活到最后2人没找到，最后互相指正无意义），或者找到卧底
         return len(self._get_alive_players()) <= 2 or self.find_undercover
     
-    def start_game(self):
+    def start_game(self, save: bool = True):
         """开始游戏"""
+        residency_before = self.scheduler.residency_stats() if self.scheduler else None
         while not self.check_game_end():
-            self.play_round()
+            with tag_calls(game_id=self.game_id, round=self.current_round):
+                self.play_round()
+
+        self.game_result["game_uid"] = self.game_uid
+        self.game_result["game_id"] = self.game_id
+        self.game_result["description_mode"] = self.description_mode
+        self.game_result["seed"] = self.seed
+        self.game_result["words"] = {
+            "civilian": self.civilian_word,
+            "undercover": self.undercover_word,
+            "pair_id": pair_id(self.civilian_word, self.undercover_word),
+            "category": self.word_sampler.bank.category(self.word_index) if self.word_index >= 0 else None,
+            "sampler": self.word_sampler.name
+        }
+        self.game_result["players"] = [
+            {"player_id": pid, "name": player.name, "model": player.model, "local": player.local, "role": player.role,
+             "reflection": player.reflection_mode}
+            for pid, player in self.player_map.items()
+        ]
+        self.game_result["rounds"] = self.current_round - 1
+        self.game_result["votes"] = self.votes
+        self.game_result["eliminations"] = self.eliminations
+        self.game_result["initial_memory"] = self.initial_memory
+        json_repair = Counter()
+        for player in self.player_map.values():
+            json_repair.update(player.json_repair_stats)
+        self.game_result["json_repair"] = dict(json_repair)
+        self.game_result["reflection"] = {
+            player.name: dict(player.reflection_stats) for player in self.player_map.values() if player.reflection_stats
+        }
+        self.call_metrics = metrics_recorder.drain(game_id=self.game_id)
+        # 前缀命中：构建时的估计，以及后端在usage中报告的缓存命中token数
+        self.game_result["prompt_prefix"] = summarize_prefix_stats(
+            [player.prompt_builder.stats for player in self.player_map.values()], self.call_metrics
+        )
+        token_counter.calibrate(self.call_metrics)  # 用后端返回的prompt_tokens校准之后各局的token估算
+        self.game_result["token_scale"] = self.token_scale
+        self.game_result["memory_config"] = self.memory_config
+        self.game_result["memory_tokens"] = {
+            player.name: {**player.memory.breakdown(player.model), "compressions": player.memory.compressions}
+            for player in self.player_map.values()
+        }
+        self.game_result["llm_metrics"] = summarize_metrics(self.call_metrics)
+        if self.scheduler and self.scheduler.residency:
+            # 本局中本地后端的模型载入和切换次数
+            residency_after = self.scheduler.residency_stats()
+            self.game_result["model_residency"] = {
+                key: residency_after[key] - residency_before[key] for key in residency_after
+            }
+        self.game_result["phase_seconds"] = self.phase_seconds
+        self.game_result["llm_failures"] = [
+            failure for player in self.player_map.values() for failure in player.llm_failures
+        ]
+        if any(player.recorded_calls for player in self.player_map.values()):
+            # 每个玩家按调用顺序记录的模型输出，用于不访问后端的回放
+            self.game_result["llm_calls"] = {
+                player.name: player.recorded_calls for player in self.player_map.values()
+            }
+        if self.verbose:
+            self._print_summary()
         
-        self.save_results()
-
-    def save_results(self):
-        """保存游戏结果到文件"""
-        import os
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        os.makedirs("../../results", exist_ok=True)
-        filename = f"results/result_{timestamp}.json"
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(self.game_result, f, ensure_ascii=False, indent=4)
-        print(f"结果已保存到 {filename}")
-            
+        if save:
+            self.save_results()
+            self.export_metrics()
+
+    def _print_summary(self):
+        """打印本局的前缀命中率、JSON修复、LLM调用开销和失败统计"""
+        prompt_prefix = self.game_result["prompt_prefix"]
+        if prompt_prefix["cached_token_ratio"] is not None:
+            print(f"[第 {self.game_id} 局] 后端提示词缓存命中率（按token）: {prompt_prefix['cached_token_ratio']:.1%}")
+        print(f"[第 {self.game_id} 局] 系统前缀命中率（构建时估计）: {prompt_prefix['estimated_prefix_hit_ratio']:.1%}")
+        print(f"[第 {self.game_id} 局] JSON修复层级统计: {self.game_result['json_repair']}")
+        for phase, summary in self.game_result["llm_metrics"].items():
+            print(f"[第 {self.game_id} 局] {phase}: 调用 {summary['calls']} 次, 耗时 {summary['wall_ms'] / 1000:.1f}s, "
+                  f"token {summary['prompt_tokens']}/{summary['completion_tokens']}")
+        residency = self.game_result.get("model_residency")
+        if residency:
+            print(f"[第 {self.game_id} 局] 模型载入 {residency['loads']} 次, 切换 {residency['swaps']} 次")
+        llm_failures = self.game_result["llm_failures"]
+        if llm_failures:
+            print(f"[第 {self.game_id} 局] LLM调用失败 {len(llm_failures)} 次: "
+                  f"{dict(Counter(failure['error_type'] for failure in llm_failures))}")
+
+    def export_metrics(self, path: Optional[str] = None):
+        """把本局每次LLM调用的计量记录追加到JSONL文件"""
+        path = path or player_configs.metrics_config.get("path", project_path("results", "metrics.jsonl"))
+        export_metrics(self.call_metrics, path)
+
+    def save_results(self, store: Optional[ResultStore] = None) -> str:
+        """把游戏结果追加到结果存储，返回对局ID
+
+        保存后（无论是否成功）释放事件的临时文件，之后不能再读取game_history。
+        """
+        store = store or get_result_store(
+            player_configs.results_config.get("path", project_path("results", "games.jsonl")))
+        try:
+            store.append(self.game_result, self.events)
+        finally:
+            self.events.close()
+        print(f"结果已保存到 {store.path}（对局ID: {self.game_uid}）")
+        return self.game_uid
+
 if __name__ == "__main__":
-    game = UndercoverGame()
+    scheduler_config = player_configs.scheduler_config
+    scheduler = LLMScheduler.from_config(scheduler_config)
+    game = UndercoverGame(scheduler=scheduler, parallel_votes=scheduler_config.get("parallel_votes", False),
+                          description_mode=scheduler_config.get("description_mode", DESCRIPTION_SEQUENTIAL))
+    if player_configs.llm_config.get("warm_up", False):
+        warm_up_models(game.player_map.values())
     game.start_game()
+    if scheduler:
+        scheduler.shutdown()
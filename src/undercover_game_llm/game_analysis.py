@@ -1,8 +1,12 @@
 import json
 import os
-from typing import Dict
+from typing import Dict, Iterator, List, Optional
 
-from player import AIPlayer
+from analytics import GameAnalytics
+from metrics import load_metrics, summarize_metrics
+import player_configs
+from result_store import iter_results
+from runtime import project_path
 
 
 def read_json_from_file(file_name):
@@ -18,21 +22,22 @@ def read_json_from_file(file_name):
         print(f"警告: 无法读取文件 {file_name}，错误: {e}")
         return None
     
-def batch_get_game_results():
+def iter_game_results(path: Optional[str] = None) -> Iterator[Dict]:
+    """逐局读取结果存储中的游戏结果"""
+    path = path or player_configs.results_config.get("path", project_path("results", "games.jsonl"))
+    if not os.path.exists(path):
+        print(f"警告: 结果存储 {path} 不存在")
+        result_dir = os.path.dirname(path) or "."
+        if os.path.isdir(result_dir) and any(
+                name.startswith("result_") and name.endswith(".json") for name in os.listdir(result_dir)):
+            print("提示: 发现旧版本的 result_*.json 结果文件，可用 python result_store.py import 导入")
+        return iter(())
+    return iter_results(path)
+
+
+def batch_get_game_results(path: Optional[str] = None) -> List[Dict]:
     """批量获取游戏结果"""
-    game_results = []
-    # 游戏结果存在results/result_*.json文件中，读取所有符合条件的文件
-    result_dir = "results"
-    if not os.path.exists(result_dir):
-        print(f"警告: 结果目录 {result_dir} 不存在")
-        return game_results
-    for file_name in os.listdir(result_dir):
-        if file_name.startswith("result_") and file_name.endswith(".json"):
-            file_path = os.path.join(result_dir, file_name)
-            result = read_json_from_file(file_path)
-            if result:
-                game_results.append(result)
-    return game_results
+    return list(iter_game_results(path))
 
 def print_game_winners_table(game_results):
     print("\n-- 游戏胜利者表 --")
@@ -47,65 +52,117 @@ def print_game_winners_table(game_results):
         print("{:<8} {:<40} {:<4}".format(idx, winner_str, role))
 
 
-def print_player_win_stats(player_map, game_results):
-    # 统计每个玩家作为每个角色的胜出次数
-    stats = {}
-    for player in player_map.values():
-        stats[player.name] = {"卧底": 0, "平民": 0}  # 初始化每个玩家的统计信息
-    for result in game_results:
-        winner = result.get("winners")
-        role = result.get("role")
-        if winner is None or role is None:
-            continue
-        for w in winner:
-            if w not in stats:
-                stats[w] = {"卧底": 0, "平民": 0}  # 初始化玩家统计信息
-            stats[w][role] = stats[w].get(role, 0) + 1
-    # 统计每个玩家的总数
-    for player, role_counts in stats.items():
-        role_counts["总数"] = sum(role_counts.values())  # 计算总数
-    # stats根据总数、卧底和平民的数量进行降序排序
-    sorting_keys = [(player, role_counts["总数"], role_counts["卧底"], role_counts["平民"]) for player, role_counts in stats.items()]
-    sorting_keys.sort(key=lambda item: (item[1], item[2], item[3]), reverse=True)
-    stats = {item[0]: stats[item[0]] for item in sorting_keys}
-    # 打印表格
+def print_player_win_stats(analytics: GameAnalytics):
+    """打印每个玩家作为各角色的胜出次数"""
     print("\n-- 玩家胜利统计 --")
-    roles = sorted({key for player_roles in stats.values() for key in player_roles.keys()})
     header = "{:<13}{:<4}{:<4}{:<4}".format("玩家", "总数", "卧底", "平民")
     print(header)
-    for player, role_counts in stats.items():
+    for player, role_counts in analytics.win_stats().items():
         row = "{:<15}".format(player)
-        row += "{:<6}".format(role_counts.get("总数", 0))
-        row += "{:<6}".format(role_counts.get("卧底", 0))
-        row += "{:<6}".format(role_counts.get("平民", 0))
+        row += "{:<6}".format(role_counts["总数"])
+        row += "{:<6}".format(role_counts["卧底"])
+        row += "{:<6}".format(role_counts["平民"])
+        print(row)
+
+
+def _format_rate(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1%}"
+
+
+def print_player_stats(analytics: GameAnalytics):
+    """打印每个玩家的投票准确率、惩罚票率、PK率和作为卧底的平均存活回合"""
+    print("\n-- 玩家表现统计 --")
+    print("{:<13}{:>6}{:>8}{:>10}{:>10}{:>8}{:>12}".format(
+        "玩家", "局数", "卧底局", "投票准确率", "惩罚票率", "PK率", "卧底存活回合"))
+    for player, stats in analytics.player_stats().items():
+        survival = stats["undercover_survival"]
+        print("{:<15}{:>8}{:>10}{:>14}{:>14}{:>10}{:>16}".format(
+            player, stats["games"], stats["undercover_games"], _format_rate(stats["vote_accuracy"]),
+            _format_rate(stats["penalty_rate"]), _format_rate(stats["pk_rate"]),
+            "-" if survival is None else f"{survival:.2f}"))
+
+
+def print_reflection_comparison(analytics: GameAnalytics):
+    """比较逐个反思和批量反思两种方式下玩家的投票准确率和胜率"""
+    stats = analytics.reflection_stats()
+    if not stats:
+        return
+    print("\n-- 反思方式对比 --")
+    print("{:<13}{:>8}{:>10}{:>8}{:>12}".format("反思方式", "参与次数", "投票准确率", "胜率", "卧底存活回合"))
+    for mode, mode_stats in stats.items():
+        survival = mode_stats["undercover_survival"]
+        print("{:<17}{:>10}{:>14}{:>10}{:>16}".format(
+            mode, mode_stats["games"], _format_rate(mode_stats["vote_accuracy"]), _format_rate(mode_stats["win_rate"]),
+            "-" if survival is None else f"{survival:.2f}"))
+
+
+def print_word_pair_stats(analytics: GameAnalytics, limit: int = 20):
+    """打印局数最多的若干组词语的平民胜率"""
+    print("\n-- 词语胜率统计 --")
+    print("{:<24}{:>6}{:>10}{:>10}".format("词语（平民/卧底）", "局数", "平民胜率", "平均回合"))
+    for pair, stats in list(analytics.word_pair_stats().items())[:limit]:
+        print("{:<26}{:>8}{:>14}{:>12.2f}".format(
+            pair, stats["games"], _format_rate(stats["civilian_win_rate"]), stats["avg_rounds"]))
+
+def print_cost_report(records, keys=("phase", "model")):
+    """按阶段、模型分别统计LLM调用的耗时和token开销，按总耗时降序排列"""
+    total_ms = sum(record.get("wall_ms", 0.0) for record in records) or 1.0
+    for key in keys:
+        summary = summarize_metrics(records, key=key)
+        print(f"\n-- LLM调用开销（按{key}） --")
+        print("{:<20}{:>7}{:>11}{:>8}{:>10}{:>11}{:>11}{:>11}{:>7}".format(
+            key, "调用", "总耗时(s)", "占比", "平均(ms)", "首token(ms)", "输入token", "输出token", "失败"))
+        ranked = sorted(summary.items(), key=lambda item: item[1]["wall_ms"], reverse=True)
+        for name, group in ranked:
+            ttft = group["avg_ttft_ms"]
+            print("{:<20}{:>9}{:>14.1f}{:>9.1%}{:>12.0f}{:>13}{:>13}{:>13}{:>9}".format(
+                name, group["calls"], group["wall_ms"] / 1000, group["wall_ms"] / total_ms,
+                group["wall_ms"] / group["calls"], "-" if ttft is None else f"{ttft:.0f}",
+                group["prompt_tokens"], group["completion_tokens"], group["errors"]))
+
+
+def print_prompt_breakdown(records, key="phase"):
+    """按阶段统计提示词中系统前缀、印象、规则和其余部分的平均token数"""
+    groups = {}
+    for record in records:
+        sections = record.get("prompt_sections")
+        if sections:
+            groups.setdefault(record.get(key, "unknown"), []).append(sections)
+    if not groups:
+        return
+    names = ["system", "impressions", "rules", "other", "total"]
+    print(f"\n-- 提示词构成（按{key}，平均token） --")
+    print("{:<20}{:>7}".format(key, "调用") + "".join("{:>13}".format(name) for name in names))
+    for group, sections_list in sorted(groups.items()):
+        row = "{:<20}{:>9}".format(group, len(sections_list))
+        for name in names:
+            values = [sections[name] for sections in sections_list if name in sections]
+            row += "{:>13}".format(f"{sum(values) / len(values):.0f}" if values else "-")
         print(row)
 
-def get_player_map_from_results(game_results):
-    """从游戏结果中提取玩家映射"""
-    player_map: Dict[int, AIPlayer] = {}
-    player_id = 0
-    for result in game_results:
-        for player in result.get("winners", []):
-            if player_id is not None and player_id not in player_map:
-                # 创建AIPlayer实例
-                player_map[player_id] = AIPlayer(
-                    player_id=player_id,
-                    name=player,
-                    word="",
-                    role="平民",
-                    model="default_model",
-                    local=True
-                )
-                player_id += 1
-    return player_map
 
 if __name__ == "__main__":
-    # 示例用法
-    game_results = batch_get_game_results()
-    player_map = get_player_map_from_results(game_results)
-    
-    if game_results and player_map:
-        print_game_winners_table(game_results)
-        print_player_win_stats(player_map, game_results)
+    # 从上次的统计快照继续，只读取结果存储中新追加的对局
+    store_path = player_configs.results_config.get("path", project_path("results", "games.jsonl"))
+    snapshot_path = player_configs.results_config.get("analytics_path", project_path("results", "analytics.npz"))
+    if not os.path.exists(store_path):
+        list(iter_game_results(store_path))  # 打印结果存储不存在和导入旧结果文件的提示
+    analytics = GameAnalytics.load(snapshot_path)
+    new_games = analytics.refresh(store_path)
+    if new_games:
+        analytics.save(snapshot_path)
+
+    if len(analytics):
+        print(f"共 {len(analytics)} 局（新增 {new_games} 局）")
+        print_player_win_stats(analytics)
+        print_player_stats(analytics)
+        print_reflection_comparison(analytics)
+        print_word_pair_stats(analytics)
     else:
         print("无法打印游戏结果或玩家统计信息，请检查文件是否存在或格式是否正确。")
+
+    metrics_path = player_configs.metrics_config.get("path", project_path("results", "metrics.jsonl"))
+    metrics_records = load_metrics(metrics_path)
+    if metrics_records:
+        print_cost_report(metrics_records, keys=("phase", "model", "reflection"))
+        print_prompt_breakdown(metrics_records)
@@ -0,0 +1,166 @@
+import json
+import re
+from typing import Dict, Optional, Tuple
+
+# 修复层级，按代价从低到高排列
+TIER_DIRECT = "direct"  # 原文即为合法JSON
+TIER_EXTRACTED = "extracted"  # 从代码块或前后说明文字中截取出合法JSON
+TIER_REPAIRED = "repaired"  # 经本地修复后可解析
+TIER_LLM = "llm"  # 本地修复失败，经LLM纠正后可解析
+TIER_FAILED = "failed"  # 所有手段均失败
+REPAIR_TIERS = (TIER_DIRECT, TIER_EXTRACTED, TIER_REPAIRED, TIER_LLM, TIER_FAILED)
+
+_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*([\s\S]*?)(?:```|$)")
+# 字符串的开引号 -> 可接受的闭引号
+_OPEN_QUOTES = {'"': '"', "'": "'", "“": "”", "‘": "’"}
+_CLOSE_FOLLOWERS = set(",:}]")
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+_MAX_START_CANDIDATES = 8  # 最多尝试多少个 { 作为JSON起点
+
+
+def _strip_code_fence(text: str) -> str:
+    """去掉markdown代码块标记，没有代码块时原样返回"""
+    match = _FENCE_PATTERN.search(text)
+    return match.group(1) if match else text
+
+
+def _loads_object(text: str) -> Optional[Dict]:
+    """解析JSON，只接受对象"""
+    try:
+        result = json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    return result if isinstance(result, dict) else None
+
+
+def _closes_string(text: str, index: int) -> bool:
+    """判断index处的引号是否是字符串的结束：其后第一个非空白字符必须是分隔符或文本结尾"""
+    for ch in text[index + 1:]:
+        if not ch.isspace():
+            return ch in _CLOSE_FOLLOWERS
+    return True
+
+
+def _start_candidates(text: str):
+    """依次给出可能作为JSON起点的 { 的位置"""
+    start = text.find("{")
+    for _ in range(_MAX_START_CANDIDATES):
+        if start < 0:
+            return
+        yield start
+        start = text.find("{", start + 1)
+
+
+def _balanced_object(text: str, start: int) -> Optional[str]:
+    """截取从start处的 { 开始、括号配平的JSON片段（感知字符串），不配平时返回None"""
+    depth = 0
+    in_str = False
+    escape = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_str:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+
+def repair_json(text: str, start: int = 0) -> str:
+    """逐字符修复常见的JSON格式错误，返回修复后的文本
+
+    处理：中文/单引号作为字符串定界符、字符串内未转义的引号和换行、多余的尾随逗号、
+    未闭合的字符串和括号。只修复从start处的 { 开始的部分，括号闭合后的内容被忽略。
+    """
+    out = []
+    stack = []
+    closing_quote = None  # 不为None时表示处于字符串内
+    escape = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if closing_quote is not None:
+            if escape:
+                out.append(ch)
+                escape = False
+            elif ch == "\\":
+                out.append(ch)
+                escape = True
+            elif (ch == closing_quote or ch == '"') and _closes_string(text, i):
+                out.append('"')
+                closing_quote = None
+            elif ch == '"':
+                out.append('\\"')
+            elif ch in _CONTROL_ESCAPES:
+                out.append(_CONTROL_ESCAPES[ch])
+            else:
+                out.append(ch)
+            continue
+
+        if ch in _OPEN_QUOTES:
+            out.append('"')
+            closing_quote = _OPEN_QUOTES[ch]
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            out.append(ch)
+        elif ch in "}]":
+            _drop_trailing_comma(out)
+            if stack:
+                out.append(stack.pop())
+            if not stack:
+                break
+        else:
+            out.append(ch)
+
+    if closing_quote is not None:
+        out.append('"')
+    while stack:
+        _drop_trailing_comma(out)
+        out.append(stack.pop())
+    return "".join(out)
+
+
+def _drop_trailing_comma(out):
+    """去掉闭合括号前多余的逗号"""
+    i = len(out) - 1
+    while i >= 0 and out[i].isspace():
+        i -= 1
+    if i >= 0 and out[i] == ",":
+        del out[i]
+
+
+def extract_json(text: str) -> Tuple[Optional[Dict], str]:
+    """在本地尽力从模型输出中提取JSON对象
+
+    Returns:
+        tuple: (解析出的字典或None, 命中的修复层级)
+    """
+    if not text:
+        return None, TIER_FAILED
+    result = _loads_object(text.strip())
+    if result is not None:
+        return result, TIER_DIRECT
+
+    body = _strip_code_fence(text)
+    starts = list(_start_candidates(body))
+    for start in starts:
+        fragment = _balanced_object(body, start)
+        if fragment is not None:
+            result = _loads_object(fragment)
+            if result is not None:
+                return result, TIER_EXTRACTED
+
+    for start in starts:
+        result = _loads_object(repair_json(body, start))
+        if result is not None:
+            return result, TIER_REPAIRED
+    return None, TIER_FAILED
@@ -0,0 +1,253 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from llm_client import LLMCallError, LLMClient
+from metrics import note
+from runtime import project_path
+
+# 缓存模式
+READ_THROUGH = "read_through"  # 命中则直接返回，未命中则调用后端并写入缓存
+WRITE_ONLY = "write_only"  # 总是调用后端，只负责把结果写入缓存
+REPLAY_ONLY = "replay_only"  # 只从缓存读取，未命中时报错，不会访问后端
+CACHE_MODES = (READ_THROUGH, WRITE_ONLY, REPLAY_ONLY)
+
+
+class CacheMissError(LLMCallError):
+    """replay_only模式下缓存未命中（或回放记录中没有该请求）
+
+    作为不可重试的调用失败抛出，玩家按其它调用失败一样降级处理，单次未命中不会中断整局或整个比赛进程。
+    """
+
+    def __init__(self, message, model="", backend=""):
+        super().__init__(message, model=model, backend=backend, retryable=False)
+
+
+def make_cache_key(model: str, messages, options: Optional[Dict] = None) -> str:
+    """根据模型、消息列表和采样参数计算内容寻址的缓存键"""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "options": options or {}},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """基于SQLite的LLM响应缓存，按总大小做LRU淘汰
+
+    使用WAL模式，多个进程可以共享同一个缓存文件。
+    """
+
+    def __init__(self, path: str, max_bytes: Optional[int] = None, evict_check_interval: int = 100):
+        """初始化缓存
+
+        Args:
+            path: SQLite文件路径
+            max_bytes: 缓存内容的最大总字节数，None表示不限制
+            evict_check_interval: 每写入多少条记录检查一次总大小
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evict_check_interval = evict_check_interval
+        self._lock = threading.Lock()
+        self._puts_since_check = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, content TEXT, reasoning TEXT, "
+            "size INTEGER, created REAL, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        """读取缓存，返回 (content, reasoning_content)，未命中返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, reasoning FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return row[0], row[1]
+
+    def put(self, key: str, model: str, content: str, reasoning_content: str):
+        """写入缓存"""
+        size = len(content.encode("utf-8")) + len(reasoning_content.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, content, reasoning_content, size, now, now)
+            )
+            self._conn.commit()
+            self._puts_since_check += 1
+            if self.max_bytes is not None and self._puts_since_check >= self.evict_check_interval:
+                self._puts_since_check = 0
+                self._evict()
+
+    def total_size(self) -> int:
+        """缓存内容的总字节数"""
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _evict(self):
+        """按最近访问时间淘汰，直到总大小不超过max_bytes（调用方需持有锁）"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        evicted = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            evicted.append((key,))
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedLLMClient(LLMClient):
+    """为任意LLMClient增加持久化响应缓存的包装"""
+
+    def __init__(self, client: LLMClient, cache: ResponseCache, mode: str = READ_THROUGH):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"未知的缓存模式: {mode}")
+        self.client = client
+        self.cache = cache
+        self.mode = mode
+
+    @property
+    def backend(self):
+        return self.client.backend
+
+    def warm_up(self, model):
+        if self.mode != REPLAY_ONLY:
+            self.client.warm_up(model)
+
+    def chat(self, messages, model, **options):
+        key = make_cache_key(model, messages, options)
+        if self.mode != WRITE_ONLY:
+            cached = self.cache.get(key)
+            if cached is not None:
+                note(cache_hit=True)
+                return cached
+            if self.mode == REPLAY_ONLY:
+                raise CacheMissError(f"缓存中没有 {model} 对该请求的响应", model=model, backend=self.backend)
+
+        content, reasoning_content = self.client.chat(messages, model, **options)
+        # 空内容（如推理超限被截断）不写入缓存，以免回放时重现失败
+        if content:
+            self.cache.put(key, model, content, reasoning_content)
+        return content, reasoning_content
+
+
+_caches: Dict[str, ResponseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(path: str, max_bytes: Optional[int] = None) -> ResponseCache:
+    """获取进程内共享的缓存实例，同一路径只打开一次"""
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = ResponseCache(path, max_bytes=max_bytes)
+        return _caches[path]
+
+
+def wrap_with_cache(client: LLMClient, config: Dict) -> LLMClient:
+    """根据配置为客户端加上缓存，未启用时原样返回"""
+    if not config.get("enabled", False):
+        return client
+    max_size_mb = config.get("max_size_mb")
+    cache = get_response_cache(
+        config.get("path", project_path("cache", "llm_cache.sqlite")),
+        max_bytes=int(max_size_mb * 1024 * 1024) if max_size_mb else None
+    )
+    return CachedLLMClient(client, cache, mode=config.get("mode", READ_THROUGH))
+
+
+class RecordingClient(LLMClient):
+    """按调用顺序记录每次chat的输出（以缓存键标识请求），记录随对局结果保存，供ReplayClient回放"""
+
+    def __init__(self, client: LLMClient, sink: List[Dict]):
+        self.client = client
+        self.sink = sink
+
+    @property
+    def backend(self):
+        return self.client.backend
+
+    def warm_up(self, model):
+        self.client.warm_up(model)
+
+    def chat(self, messages, model, **options):
+        key = make_cache_key(model, messages, options)
+        try:
+            content, reasoning_content = self.client.chat(messages, model, **options)
+        except LLMCallError as e:
+            # 失败也要记录，回放时在同一位置重现
+            self.sink.append({"key": key, "error": type(e).__name__, "message": str(e)[:200]})
+            raise
+        self.sink.append({"key": key, "content": content, "reasoning": reasoning_content})
+        return content, reasoning_content
+
+
+class ReplayClient(LLMClient):
+    """从RecordingClient的记录中返回输出，不访问任何后端
+
+    strict为True时只按缓存键匹配，提示词有任何变化都会报CacheMissError；
+    为False时找不到相同请求就按顺序取下一条尚未使用的记录，用于提示词改动后仍需回放的场景，mismatches记录这类调用次数。
+    """
+
+    backend = "replay"
+
+    def __init__(self, records: List[Dict], strict: bool = True):
+        self.records = records
+        self.strict = strict
+        self.mismatches = 0
+        self._by_key: Dict[str, deque] = {}
+        for index, record in enumerate(records):
+            self._by_key.setdefault(record["key"], deque()).append(index)
+        self._used = [False] * len(records)
+        self._next = 0  # 顺序回放的游标
+        self._lock = threading.Lock()
+
+    def chat(self, messages, model, **options):
+        key = make_cache_key(model, messages, options)
+        with self._lock:
+            index = self._take(key)
+        record = self.records[index]
+        if "error" in record:
+            raise LLMCallError(record.get("message", ""), model=model, backend=self.backend, retryable=False)
+        return record["content"], record["reasoning"]
+
+    def _take(self, key: str) -> int:
+        indices = self._by_key.get(key)
+        while indices:
+            index = indices.popleft()
+            if not self._used[index]:
+                self._used[index] = True
+                return index
+        if self.strict:
+            raise CacheMissError(f"回放记录中没有该请求: {key}", backend=self.backend)
+        while self._next < len(self.records) and self._used[self._next]:
+            self._next += 1
+        if self._next >= len(self.records):
+            raise CacheMissError("回放记录已用完", backend=self.backend)
+        self._used[self._next] = True
+        self.mismatches += 1
+        return self._next
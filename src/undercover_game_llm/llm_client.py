@@ -1,140 +1,681 @@
+import atexit
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
 
-from dotenv import load_dotenv
-from openai import OpenAI
-import ollama 
 import re
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
+import queue
+import threading
+import time
+from importlib.util import find_spec
 
-os.makedirs("log", exist_ok=True)
+from metrics import current_tags, finish_call, metrics_recorder, note, note_first_token, start_call
+from runtime import LazyModule, env, project_path
+from stream_parser import StreamAccumulator
 
-log_handler = RotatingFileHandler("log/llm.log", maxBytes=50 * 1024 * 1024, backupCount=5, encoding="utf-8")
-log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+# 后端SDK导入较慢，只在实际创建对应的客户端时才导入
+httpx = LazyModule("httpx")
+openai = LazyModule("openai")
+ollama = LazyModule("ollama")
+
+
+def __getattr__(name: str):
+    # API地址和密钥在第一次使用时才从.env读取
+    if name in ("API_BASE_URL", "API_KEY"):
+        return env(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class _LazyQueueHandler(QueueHandler):
+    """第一次写日志时才创建日志目录、打开日志文件并启动后台写入线程"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.listener = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        os.makedirs(project_path("log"), exist_ok=True)
+        handler = RotatingFileHandler(project_path("log", "llm.log"), maxBytes=50 * 1024 * 1024, backupCount=5,
+                                      encoding="utf-8")
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+        listener = QueueListener(self.queue, handler)
+        listener.start()
+        atexit.register(listener.stop)
+        self.listener = listener
+
+    def enqueue(self, record):
+        if self.listener is None:
+            with self._start_lock:
+                if self.listener is None:
+                    self._start()
+        super().enqueue(record)
+
+
+# 所有客户端共用同一个logger，只在模块加载时配置一次handler
+# 日志先进入队列，由后台线程写入文件，请求线程不等待磁盘
+llm_logger = logging.getLogger("llm")
+llm_logger.handlers = []  # 移除已有的handler，防止重复
+llm_logger.addHandler(_LazyQueueHandler(queue.SimpleQueue()))
+llm_logger.propagate = False  # 不向上冒泡到root logger
+llm_logger.setLevel(logging.INFO)
+
+HTTP2_AVAILABLE = find_spec("h2") is not None  # httpx的HTTP/2支持依赖h2包
+
+# 调用结束后模型在本地后端中保留的时长（如"30m"，0表示调用后立即卸载），由调度器按模型驻留情况设置
+_keep_alive: ContextVar = ContextVar("llm_keep_alive", default=None)
+
+
+@contextmanager
+def keep_alive_hint(value):
+    """with块内发出的调用带上keep_alive提示，None表示使用后端的默认值"""
+    token = _keep_alive.set(value)
+    try:
+        yield
+    finally:
+        _keep_alive.reset(token)
+
+
+def current_keep_alive():
+    """当前上下文中的keep_alive提示"""
+    return _keep_alive.get()
+
+
+# 批量补全时把对话渲染为纯文本提示词的模板：/v1/completions不会套用服务端的对话模板，需按模型选择
+CHAT_TEMPLATES = {
+    "chatml": {
+        "prefix": "",
+        "message": "<|im_start|>{role}\n{content}<|im_end|>\n",
+        "generation": "<|im_start|>assistant\n",
+        "stop": ["<|im_end|>"]
+    },
+    "llama3": {
+        "prefix": "<|begin_of_text|>",
+        "message": "<|start_header_id|>{role}<|end_header_id|>\n\n{content}<|eot_id|>",
+        "generation": "<|start_header_id|>assistant<|end_header_id|>\n\n",
+        "stop": ["<|eot_id|>"]
+    }
+}
+
+
+def render_chat(messages, template="chatml") -> str:
+    """按对话模板把消息列表渲染为补全接口的提示词"""
+    chat_template = CHAT_TEMPLATES[template]
+    body = "".join(chat_template["message"].format(role=m["role"], content=m["content"]) for m in messages)
+    return chat_template["prefix"] + body + chat_template["generation"]
+
+
+def _split_reasoning(text):
+    """把<think></think>中的推理内容从回复中分离出来，返回 (content, reasoning_content)"""
+    reasoning_content = "\n".join(re.findall(r'<think>(.*?)</think>', text, re.DOTALL))
+    content = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL).strip()
+    return content, reasoning_content
+
+
+def build_http_options(max_connections=32, max_keepalive_connections=16, keepalive_expiry=300.0,
+                       timeout=300.0, http2=True):
+    """构造连接池参数，供OpenAI和Ollama底层的httpx客户端使用"""
+    return {
+        "limits": httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        ),
+        "timeout": httpx.Timeout(timeout),
+        "http2": http2 and HTTP2_AVAILABLE
+    }
+
+def _prepend(first, iterator):
+    """把预取的第一个元素放回迭代器前面"""
+    if first is not None:
+        yield first
+    yield from iterator
+
+
+def _note_openai_usage(usage):
+    """把OpenAI接口返回的usage写入当前调用的计量"""
+    if usage is None:
+        return
+    details = getattr(usage, "completion_tokens_details", None)
+    prompt_details = getattr(usage, "prompt_tokens_details", None)
+    note(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens,
+         reasoning_tokens=getattr(details, "reasoning_tokens", None),
+         cached_tokens=getattr(prompt_details, "cached_tokens", None))
+
+
+def _note_ollama_usage(response):
+    """把Ollama响应中的token数和模型加载耗时写入当前调用的计量"""
+    if response.get("eval_count") is None:
+        return
+    note(prompt_tokens=response.get("prompt_eval_count"), completion_tokens=response.get("eval_count"),
+         load_ms=round((response.get("load_duration") or 0) / 1e6, 1))
+
+
+class LLMCallError(Exception):
+    """LLM调用失败
+
+    Attributes:
+        model: 调用的模型
+        backend: 后端名称
+        retryable: 是否为可重试的临时性错误（超时、连接失败、限流、服务端错误、空响应）
+        status_code: HTTP状态码（如有）
+    """
+
+    def __init__(self, message, model="", backend="", retryable=True, status_code=None):
+        super().__init__(message)
+        self.model = model
+        self.backend = backend
+        self.retryable = retryable
+        self.status_code = status_code
+
+
+class ReasoningTruncatedError(LLMCallError):
+    """流式模式下推理超过max_reasoning_tokens、还没有输出正文就被截断
+
+    重试同样会在推理阶段被截断，因此不可重试；这不是后端故障，不计入熔断。
+    """
+
+    def __init__(self, message, model="", backend=""):
+        super().__init__(message, model=model, backend=backend, retryable=False)
+
+
+def _is_retryable_status(status_code) -> bool:
+    return status_code is None or status_code == 429 or status_code >= 500
 
-load_dotenv()
-API_BASE_URL = os.getenv("API_BASE_URL")
-API_KEY = os.getenv("API_KEY")
 
 class LLMClient(ABC):
+    backend = ""  # 后端名称，用于调度器按后端限制并发
+    supports_batch = False  # 是否支持batch_chat在一次请求中完成多个对话
+    transcript = None  # 转录写入器（transcript.TranscriptWriter），None表示不记录
+    debug_log = False  # 调试模式：在请求线程中同步写出完整的问答文本
+
+    def _log_call(self, model, messages, content, reasoning_content):
+        """记录一次调用的完整问答
+
+        平时只把记录交给后台的转录写入器；调试模式下同步写入llm.log和转录文件，便于边运行边查看。
+        """
+        if self.debug_log:
+            self.logger.info("-" * 5 + f" {model}[{self.backend}] " + "-" * 5)
+            self.logger.info(f"Question: \n{messages[-1]['content']}")
+            if reasoning_content != "":
+                self.logger.info(f"Think: \n{reasoning_content}")
+            self.logger.info(f"Answer: \n{content}")
+        if self.transcript is None:
+            return
+        record = {
+            "type": "call", "time": time.time(), "backend": self.backend, "model": model, **current_tags(),
+            "messages": list(messages), "reasoning": reasoning_content, "answer": content
+        }
+        if self.debug_log:
+            self.transcript.write_sync(record)
+        else:
+            self.transcript.submit(record)
+
+    def warm_up(self, model):
+        """在对局开始前确认模型可用并预先加载，默认不做任何事"""
+        pass
+
+    def batch_chat(self, conversations, model, schema=None, stop_on=None, **options):
+        """在一次请求中完成多个对话（需supports_batch为True）
+
+        Args:
+            conversations: 消息列表的列表
+            model: 使用的LLM模型
+            schema: 所有对话共用的JSON Schema
+            stop_on: 所有对话共用的提前结束条件，批量调用不使用流式输出，后端可以忽略
+            options: 后端相关的选项（对话模板、max_tokens等）
+
+        Returns:
+            list: 与conversations顺序一致的 (content, reasoning_content, 该对话的计量字段)
+
+        Raises:
+            LLMCallError: 调用失败，整批都失败
+        """
+        raise NotImplementedError(f"{type(self).__name__} 不支持批量调用")
+
+    def loaded_models(self):
+        """服务端当前已加载到内存的模型集合，用于健康检查和路由；无法获知时返回None
+
+        Raises:
+            LLMCallError: 服务不可用
+        """
+        return None
+
     @abstractmethod
-    def chat(self, messages, model):
+    def chat(self, messages, model, schema=None, stop_on=None):
         """与LLM交互
         
         Args:
             messages: 消息列表
             model: 使用的LLM模型
+            schema: 可选的JSON Schema，后端支持时用于约束输出格式，不支持时忽略
+            stop_on: 流式模式下的提前结束条件（"json" 或 "paragraph"），非流式模式下忽略
         
         Returns:
             tuple: (content, reasoning_content)
+
+        Raises:
+            LLMCallError: 调用失败
         """
         pass
 
 class OpenAIClient(LLMClient):
-    def __init__(self, api_key=API_KEY, base_url=API_BASE_URL):
-        """初始化OpenAI客户端"""
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url=base_url
+    backend = "openai"
+    supports_batch = True  # vLLM、llama.cpp等OpenAI兼容服务的 /v1/completions 接受提示词列表
+    # 结构化输出的降级顺序：JSON Schema -> JSON模式 -> 不约束
+    RESPONSE_FORMAT_LEVELS = ("json_schema", "json_object", None)
+
+    def __init__(self, api_key=None, base_url=None, stream=False, max_reasoning_tokens=None,
+                 http_options=None, transcript=None, debug_log=False):
+        """初始化OpenAI客户端
+
+        Args:
+            api_key: API密钥，None时使用环境变量（或项目根目录下.env）中的API_KEY
+            base_url: 服务地址，None时使用API_BASE_URL
+            stream: 是否使用流式输出，流式时可按stop_on提前结束请求
+            max_reasoning_tokens: 流式模式下推理token的上限，超出后放弃本次请求，None表示不限制
+            http_options: 连接池参数（见build_http_options），None时使用SDK默认设置
+            transcript: 转录写入器，None时不记录完整问答
+            debug_log: 调试模式，在请求线程中同步写出完整问答
+        """
+        self.stream = stream
+        self.transcript = transcript
+        self.debug_log = debug_log
+        self.max_reasoning_tokens = max_reasoning_tokens
+        self.client = openai.OpenAI(
+            api_key=api_key if api_key is not None else env("API_KEY"),
+            base_url=base_url if base_url is not None else env("API_BASE_URL"),
+            http_client=openai.DefaultHttpxClient(**http_options) if http_options else None
         )
-        self.logger = logging.getLogger("llm")
-        self.logger.handlers = []  # 移除已有的handler，防止重复
-        self.logger.addHandler(log_handler)
-        self.logger.propagate = False  # 不向上冒泡到root logger
-        self.logger.setLevel(logging.INFO)
+        self.logger = llm_logger
+        self._format_level = {}  # {模型: 当前可用的结构化输出级别下标}
 
-        
-    def chat(self, messages, model):
+    def _create(self, messages, model, schema, **extra):
+        """发起请求；服务端不支持所请求的response_format时逐级降级重试，并记住该模型的能力"""
+        if schema is None:
+            return self.client.chat.completions.create(model=model, messages=messages, **extra)
+        level = self._format_level.get(model, 0)
+        while True:
+            response_format = self.RESPONSE_FORMAT_LEVELS[level]
+            kwargs = dict(extra)
+            if response_format == "json_schema":
+                kwargs["response_format"] = {
+                    "type": "json_schema",
+                    "json_schema": {"name": "response", "schema": schema, "strict": True}
+                }
+            elif response_format == "json_object":
+                kwargs["response_format"] = {"type": "json_object"}
+            try:
+                return self.client.chat.completions.create(model=model, messages=messages, **kwargs)
+            except openai.BadRequestError as e:
+                if response_format is None:
+                    raise
+                level += 1
+                self._format_level[model] = level
+                self.logger.warning(f"{model} 不支持 response_format={response_format}，降级重试: {str(e)}")
+
+    def _chat_stream(self, messages, model, schema, stop_on):
+        """流式请求，边接收边解析，满足stop_on条件或推理超限时立即关闭连接"""
+        accumulator = StreamAccumulator(stop_on=stop_on, max_reasoning_tokens=self.max_reasoning_tokens)
+        stream = self._create(messages, model, schema, stream=True)
+        chunks = 0
+        usage = None
+        try:
+            for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                reasoning = getattr(delta, "reasoning_content", None) or ""
+                if reasoning or delta.content:
+                    note_first_token()
+                    chunks += 1
+                accumulator.feed_reasoning(reasoning)
+                accumulator.feed_content(delta.content or "")
+                if accumulator.done:
+                    break
+        finally:
+            stream.close()
+        if usage is not None:
+            _note_openai_usage(usage)
+        else:
+            # 服务端没有下发usage（或请求被提前结束），按增量块数估计
+            note(completion_tokens=chunks, reasoning_tokens=accumulator.reasoning_tokens, tokens_estimated=True)
+        content, reasoning_content = accumulator.finish()
+        if accumulator.reasoning_truncated:
+            self.logger.warning(f"{model} 推理超过 {self.max_reasoning_tokens} token，已提前终止")
+            if not content.strip():
+                # 没有正文可供解析，不交给JSON修复
+                raise ReasoningTruncatedError(f"推理超过 {self.max_reasoning_tokens} token，没有输出内容",
+                                              model=model, backend=self.backend)
+        return content, reasoning_content
+
+    def chat(self, messages, model, schema=None, stop_on=None):
         """与OpenAI LLM交互
         
         Args:
             messages: 消息列表
             model: 使用的LLM模型
+            schema: 可选的JSON Schema，通过response_format约束输出
+            stop_on: 流式模式下的提前结束条件
         
         Returns:
             tuple: (content, reasoning_content)
         """
         try:
-            self.logger.info("-" * 5 + f" {model}[OpenAI] " + "-" * 5)
-            self.logger.info(f"Question: {messages[0]['content']}")
-            self.logger.info("")
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-            )
+            if self.stream:
+                content, reasoning_content = self._chat_stream(messages, model, schema, stop_on)
+                self._log_call(model, messages, content, reasoning_content)
+                return content, reasoning_content
+            response = self._create(messages, model, schema)
+            _note_openai_usage(getattr(response, "usage", None))
             if response.choices:
                 message = response.choices[0].message
                 content = message.content if message.content else ""
-                reasoning_content = getattr(message, "reasoning_content", "")
-                if reasoning_content != "":
-                    self.logger.info(f"Think: \n{reasoning_content}")
-                else: 
+                reasoning_content = getattr(message, "reasoning_content", "") or ""
+                if reasoning_content == "":
                     reasoning_matches = re.findall(r'<think>(.*?)</think>', content, re.DOTALL)
                     reasoning_content = "\n".join(reasoning_matches)
                     
                     # 移除<think></think>内容后的剩余部分
                     content = re.sub(r'<think>.*?</think>', '', content, flags=re.DOTALL).strip()
-                    
-                self.logger.info(f"Answer: \n{content}")
-                self.logger.info("-" * 5 + f" {model}[OpenAI] " + "-" * 5)
+
+                self._log_call(model, messages, content, reasoning_content)
                 return content, reasoning_content
             self.logger.warning("LLM没有返回有效内容")
-            return "", ""
+            raise LLMCallError("LLM没有返回有效内容", model=model, backend=self.backend)
                 
+        except openai.APIStatusError as e:
+            self.logger.error(f"LLM调用出错: {str(e)}")
+            raise LLMCallError(str(e), model=model, backend=self.backend,
+                               retryable=_is_retryable_status(e.status_code), status_code=e.status_code) from e
+        except (openai.APIConnectionError, httpx.TransportError) as e:
+            # 包括超时和流式读取中断
+            self.logger.error(f"LLM调用出错: {str(e)}")
+            raise LLMCallError(str(e), model=model, backend=self.backend) from e
+        except LLMCallError:
+            raise
         except Exception as e:
+            # 其它异常（如流式数据块格式错误）同样作为调用失败交给调用方降级处理，不让原始异常中断对局
             self.logger.error(f"LLM调用出错: {str(e)}")
-            return "", ""
+            raise LLMCallError(str(e), model=model, backend=self.backend, retryable=False) from e
+
+    def batch_chat(self, conversations, model, schema=None, stop_on=None, template="chatml", max_tokens=2048,
+                   guided_json=False):
+        """通过 /v1/completions 在一次请求中完成多个对话
+
+        对话按template渲染为纯文本提示词；guided_json为True时把schema作为vLLM的guided_json参数约束输出。
+        响应中只有整批的usage合计，平均分到每个对话并标记为估算值。
+        """
+        chat_template = CHAT_TEMPLATES[template]
+        extra = {"extra_body": {"guided_json": schema}} if guided_json and schema is not None else {}
+        try:
+            response = self.client.completions.create(
+                model=model, prompt=[render_chat(messages, template) for messages in conversations],
+                max_tokens=max_tokens, stop=chat_template["stop"], **extra
+            )
+        except openai.APIStatusError as e:
+            self.logger.error(f"LLM批量调用出错: {str(e)}")
+            raise LLMCallError(str(e), model=model, backend=self.backend,
+                               retryable=_is_retryable_status(e.status_code), status_code=e.status_code) from e
+        except (openai.APIConnectionError, httpx.TransportError) as e:
+            self.logger.error(f"LLM批量调用出错: {str(e)}")
+            raise LLMCallError(str(e), model=model, backend=self.backend) from e
+        except Exception as e:
+            self.logger.error(f"LLM批量调用出错: {str(e)}")
+            raise LLMCallError(str(e), model=model, backend=self.backend, retryable=False) from e
+        if len(response.choices) != len(conversations):
+            raise LLMCallError(f"批量调用返回了 {len(response.choices)} 个结果，预期 {len(conversations)} 个",
+                               model=model, backend=self.backend)
+        texts = [""] * len(conversations)
+        for choice in response.choices:
+            texts[choice.index] = choice.text or ""
+        stats = {}
+        if response.usage is not None:
+            stats = {"prompt_tokens": response.usage.prompt_tokens // len(conversations),
+                     "completion_tokens": response.usage.completion_tokens // len(conversations),
+                     "tokens_estimated": True}
+        results = []
+        for messages, text in zip(conversations, texts):
+            content, reasoning_content = _split_reasoning(text)
+            self._log_call(model, messages, content, reasoning_content)
+            results.append((content, reasoning_content, dict(stats)))
+        return results
+
+    def warm_up(self, model):
+        """确认模型在服务端可用，部分OpenAI兼容服务不提供模型查询接口，此时只记录警告"""
+        try:
+            self.client.models.retrieve(model)
+        except Exception as e:
+            self.logger.warning(f"无法确认模型 {model} 是否可用: {str(e)}")
+
+    def loaded_models(self):
+        """远程服务没有模型加载的概念，只通过查询模型列表确认服务可用"""
+        try:
+            self.client.models.list()
+        except (openai.APIConnectionError, openai.APIStatusError) as e:
+            raise LLMCallError(str(e), backend=self.backend,
+                               status_code=getattr(e, "status_code", None)) from e
+        return None
 
 
 class OllamaClient(LLMClient):
-    def __init__(self):
-        """初始化Ollama客户端"""
-        self.logger = logging.getLogger("llm")
-        self.logger.handlers = []  # 移除已有的handler，防止重复
-        self.logger.addHandler(log_handler)
-        self.logger.propagate = False  # 不向上冒泡到root logger
-        self.logger.setLevel(logging.INFO)
+    backend = "ollama"
+
+    def __init__(self, host=None, stream=False, max_reasoning_tokens=None, http_options=None, transcript=None,
+                 debug_log=False):
+        """初始化Ollama客户端
+
+        Args:
+            host: Ollama服务地址，None时使用OLLAMA_HOST环境变量或默认的本地地址
+            stream: 是否使用流式输出，流式时可按stop_on提前结束请求
+            max_reasoning_tokens: 流式模式下推理token的上限，超出后放弃本次请求，None表示不限制
+            http_options: 连接池参数（见build_http_options），None时使用SDK默认设置
+            transcript: 转录写入器，None时不记录完整问答
+            debug_log: 调试模式，在请求线程中同步写出完整问答
+        """
+        self.stream = stream
+        self.transcript = transcript
+        self.debug_log = debug_log
+        self.max_reasoning_tokens = max_reasoning_tokens
+        self.client = ollama.Client(host=host, **(http_options or {}))
+        self.logger = llm_logger
+        self._schema_unsupported = set()  # 不支持format结构化输出的模型
+
+    def _create(self, messages, model, schema, stream=False):
+        """发起请求；Ollama版本过旧不支持以JSON Schema作为format时，去掉format重试并记住该模型"""
+        keep_alive = current_keep_alive()
+        if schema is None or model in self._schema_unsupported:
+            return self.client.chat(model, messages=messages, stream=stream, keep_alive=keep_alive)
+        try:
+            response = self.client.chat(model, messages=messages, format=schema, stream=stream,
+                                        keep_alive=keep_alive)
+            if stream:
+                # 流式请求在取第一个块时才真正发出，这里预取以便在此处理不支持format的错误
+                first = next(response, None)
+                return _prepend(first, response)
+            return response
+        except ollama.ResponseError as e:
+            if e.status_code != 400:
+                raise
+            self._schema_unsupported.add(model)
+            self.logger.warning(f"{model} 不支持结构化输出，降级重试: {str(e)}")
+            return self.client.chat(model, messages=messages, stream=stream, keep_alive=keep_alive)
+
+    def _chat_stream(self, messages, model, schema, stop_on):
+        """流式请求，边接收边解析，满足stop_on条件或推理超限时立即关闭连接"""
+        accumulator = StreamAccumulator(stop_on=stop_on, max_reasoning_tokens=self.max_reasoning_tokens)
+        stream = self._create(messages, model, schema, stream=True)
+        chunks = 0
+        last = None
+        try:
+            for chunk in stream:
+                last = chunk
+                message = chunk['message']
+                thinking = getattr(message, "thinking", None) or ""
+                if thinking or message['content']:
+                    note_first_token()
+                    chunks += 1
+                accumulator.feed_reasoning(thinking)
+                accumulator.feed_content(message['content'] or "")
+                if accumulator.done:
+                    break
+        finally:
+            stream.close()
+        if last is not None and last.get("done"):
+            _note_ollama_usage(last)
+            note(reasoning_tokens=accumulator.reasoning_tokens)
+        else:
+            # 请求被提前结束，拿不到最终统计，按增量块数估计
+            note(completion_tokens=chunks, reasoning_tokens=accumulator.reasoning_tokens, tokens_estimated=True)
+        content, reasoning_content = accumulator.finish()
+        if accumulator.reasoning_truncated:
+            self.logger.warning(f"{model} 推理超过 {self.max_reasoning_tokens} token，已提前终止")
+            if not content.strip():
+                # 没有正文可供解析，不交给JSON修复
+                raise ReasoningTruncatedError(f"推理超过 {self.max_reasoning_tokens} token，没有输出内容",
+                                              model=model, backend=self.backend)
+        return content, reasoning_content
         
-    def chat(self, messages, model="deepseek-r1:14b"):
+    def chat(self, messages, model="deepseek-r1:14b", schema=None, stop_on=None):
         """与Ollama交互
         
         Args:
             messages: 消息列表
             model: 使用的LLM模型
+            schema: 可选的JSON Schema，作为Ollama的format参数约束输出
+            stop_on: 流式模式下的提前结束条件
         
         Returns:
             tuple: (content, reasoning_content)
         """
         try:
-            self.logger.info("-" * 5 + f" {model}[Local] " + "-" * 5)
-            self.logger.info(f"Question: \n{messages[0]['content']}")
-            self.logger.info("")
+            if self.stream:
+                content, reasoning_content = self._chat_stream(messages, model, schema, stop_on)
+            else:
+                response: ollama.ChatResponse = self._create(messages, model, schema)
+                _note_ollama_usage(response)
+                full_content = response['message']['content']
 
-            response: ollama.ChatResponse = ollama.chat(model, messages=messages)
-            full_content = response['message']['content']
-            
-            # for deepseek
-            # 提取<think></think>中的内容
-            reasoning_matches = re.findall(r'<think>(.*?)</think>', full_content, re.DOTALL)
-            reasoning_content = "\n".join(reasoning_matches)
-            
-            # 移除<think></think>内容后的剩余部分
-            content = re.sub(r'<think>.*?</think>', '', full_content, flags=re.DOTALL).strip()
+                # for deepseek
+                # 提取<think></think>中的内容
+                reasoning_matches = re.findall(r'<think>(.*?)</think>', full_content, re.DOTALL)
+                reasoning_content = "\n".join(reasoning_matches)
+
+                # 移除<think></think>内容后的剩余部分
+                content = re.sub(r'<think>.*?</think>', '', full_content, flags=re.DOTALL).strip()
             
-            if reasoning_content != "":
-                self.logger.info(f"Think: \n{reasoning_content}")
-            self.logger.info(f"Answer: \n{content}")
-            self.logger.info("-" * 5 + f" {model}[Local] " + "-" * 5)
+            self._log_call(model, messages, content, reasoning_content)
             return content, reasoning_content
         except ollama.ResponseError as e:
+            # 模型不存在(404)不会在对局中途拉取，应在开局前通过warm_up准备好
             self.logger.error(f"Ollama调用出错: {str(e)}")
-            if e.status_code == 404:
-                ollama.pull(model)
-                
-            return "", ""
+            raise LLMCallError(str(e), model=model, backend=self.backend,
+                               retryable=_is_retryable_status(e.status_code), status_code=e.status_code) from e
+        except (httpx.TransportError, ConnectionError) as e:
+            # 包括超时和Ollama服务未启动
+            self.logger.error(f"Ollama调用出错: {str(e)}")
+            raise LLMCallError(str(e), model=model, backend=self.backend) from e
+        except LLMCallError:
+            raise
+        except Exception as e:
+            # 其它异常（如ollama库的其它错误、流式数据块格式错误）同样作为调用失败交给调用方降级处理
+            self.logger.error(f"Ollama调用出错: {str(e)}")
+            raise LLMCallError(str(e), model=model, backend=self.backend, retryable=False) from e
+
+    def warm_up(self, model, keep_alive="30m"):
+        """确认模型已下载（必要时拉取），并预先加载到内存中"""
+        try:
+            self.client.show(model)
+        except ollama.ResponseError as e:
+            if e.status_code != 404:
+                raise
+            self.logger.info(f"本地没有模型 {model}，开始拉取")
+            self.client.pull(model)
+        # 空提示词的generate请求只加载模型，不进行推理
+        self.client.generate(model=model, prompt="", keep_alive=keep_alive)
+
+    def loaded_models(self):
+        try:
+            return {item.model for item in self.client.ps().models}
+        except ollama.ResponseError as e:
+            raise LLMCallError(str(e), backend=self.backend, status_code=e.status_code) from e
+        except (httpx.TransportError, ConnectionError) as e:
+            raise LLMCallError(str(e), backend=self.backend) from e
         
 
+class InstrumentedClient(LLMClient):
+    """记录每次chat调用的耗时、首token时间和token数，作为每个玩家最外层的客户端
+
+    记录带上调用方通过metrics.tag_calls设置的标签（game_id、round、phase），写入metrics_recorder。
+    """
+
+    def __init__(self, client: LLMClient, player: str = "", recorder=metrics_recorder):
+        self.client = client
+        self.player = player
+        self.recorder = recorder
+
+    @property
+    def backend(self):
+        return self.client.backend
+
+    def warm_up(self, model):
+        self.client.warm_up(model)
+
+    def chat(self, messages, model, **options):
+        stats = start_call()
+        try:
+            return self.client.chat(messages, model, **options)
+        except LLMCallError as e:
+            stats["error"] = type(e).__name__
+            raise
+        finally:
+            stats = finish_call(stats)
+            self.recorder.record({
+                **current_tags(), "player": self.player, "model": model, "backend": self.backend, **stats
+            })
+
+
+def wrap_with_metrics(client: LLMClient, player: str, config) -> LLMClient:
+    """根据配置为客户端加上调用计量，未启用时原样返回"""
+    if not config.get("enabled", True):
+        return client
+    return InstrumentedClient(client, player)
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_llm_client(local: bool, host=None, pool_config=None, **options) -> LLMClient:
+    """获取共享的LLM客户端
+
+    同一后端地址和选项只创建一个客户端实例，所有玩家和同一进程内的所有对局共用其连接池，
+    避免每个玩家各自建立连接和TLS握手。
+
+    Args:
+        local: True为本地Ollama，False为OpenAI兼容接口
+        host: 后端地址，Ollama为服务地址，OpenAI为base_url；None时使用默认配置
+        pool_config: 连接池配置，键与build_http_options的参数一致
+        options: 传给客户端构造函数的其它选项（stream、max_reasoning_tokens等）
+    """
+    pool_config = pool_config or {}
+    key = (local, host, tuple(sorted(pool_config.items())), tuple(sorted(options.items())))
+    with _registry_lock:
+        client = _registry.get(key)
+        if client is None:
+            http_options = build_http_options(**pool_config)
+            if local:
+                client = OllamaClient(host=host, http_options=http_options, **options)
+            else:
+                client = OpenAIClient(base_url=host, http_options=http_options, **options)
+            _registry[key] = client
+        return client
+
+
 # 使用示例
 if __name__ == "__main__":
     llm = OllamaClient()
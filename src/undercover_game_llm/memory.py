@@ -0,0 +1,180 @@
+import re
+import threading
+from functools import lru_cache
+from importlib.util import find_spec
+from typing import Dict, Iterable, List, Optional
+
+from runtime import LazyModule
+
+# 可选依赖，未安装时按字符估算并用后端返回的token数校准；第一次计数时才导入
+TIKTOKEN_AVAILABLE = find_spec("tiktoken") is not None
+tiktoken = LazyModule("tiktoken")
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uff00-\uffef]")
+
+
+@lru_cache(maxsize=None)
+def _tiktoken_encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # 非OpenAI模型（本地模型）没有对应的编码，用通用编码近似
+        return tiktoken.get_encoding("o200k_base")
+
+
+class TokenCounter:
+    """提示词的token计数
+
+    安装了tiktoken时使用真实的分词器；否则按汉字约1个token、其他字符约4个一个token估算。
+    两种方式都会按模型乘以校准系数，系数由后端实际返回的prompt_tokens与估算值之比得出（见calibrate），
+    对本地模型等tiktoken无法准确分词的情况同样适用。
+    """
+
+    def __init__(self, smoothing: float = 0.3):
+        self.smoothing = smoothing  # 校准系数的指数平滑权重
+        self.scale: Dict[str, float] = {}  # {模型: 校准系数}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def _raw_count(text: str, model: str) -> int:
+        if not text:
+            return 0
+        if TIKTOKEN_AVAILABLE:
+            return len(_tiktoken_encoding(model).encode(text))
+        cjk = len(_CJK_PATTERN.findall(text))
+        return cjk + (len(text) - cjk + 3) // 4
+
+    def count(self, text: str, model: str) -> int:
+        """text在model下的token数"""
+        return round(self._raw_count(text, model) * self.scale.get(model, 1.0))
+
+    def calibrate(self, records: Iterable[Dict]):
+        """用计量记录中后端返回的prompt_tokens校准各模型的估算
+
+        记录需同时带有prompt_tokens（后端实际值）和prompt_sections标签（本计数器在调用前的估算）。
+        """
+        actual: Dict[str, int] = {}
+        estimated: Dict[str, int] = {}
+        for record in records:
+            sections = record.get("prompt_sections")
+            if not sections or not record.get("prompt_tokens") or record.get("cache_hit"):
+                continue
+            model = record["model"]
+            actual[model] = actual.get(model, 0) + record["prompt_tokens"]
+            estimated[model] = estimated.get(model, 0) + sections["total"]
+        with self._lock:
+            for model, total in estimated.items():
+                current = self.scale.get(model, 1.0)
+                # 估算值是按当时的系数缩放过的，先还原为原始计数再求比例
+                observed = actual[model] / (total / current)
+                self.scale[model] = current + self.smoothing * (observed - current)
+
+
+token_counter = TokenCounter()
+
+
+class PlayerMemory:
+    """玩家跨局积累的记忆：对其他玩家的印象和对规则的理解，带token预算
+
+    每次更新后如果总量超过budget_tokens，由玩家调用compression_plan选出需要压缩的条目，
+    用LLM把它们概括为不超过summary_tokens的摘要（失败时截断），保证提示词中记忆部分的大小有上限。
+    """
+
+    def __init__(self, budget_tokens: int = 0, summary_tokens: int = 120, rules_tokens: int = 400):
+        """初始化
+
+        Args:
+            budget_tokens: 印象和规则理解合计的token上限，0表示不限制
+            summary_tokens: 压缩后每条印象的目标token数
+            rules_tokens: 规则理解单独的token上限，超出时压缩
+        """
+        self.budget_tokens = budget_tokens
+        self.summary_tokens = summary_tokens
+        self.rules_tokens = rules_tokens
+        self.impressions: Dict[int, str] = {}  # {其他玩家ID: 印象描述}
+        self.rules = ""
+        self.summarized: Dict[int, bool] = {}  # 当前印象是否是压缩后的摘要
+        self._updates: Dict[int, int] = {}  # {玩家ID: 最后一次更新的序号}，序号越小越旧
+        self._sequence = 0
+        self.compressions = 0  # 本局的压缩次数
+
+    def settings(self) -> Dict[str, int]:
+        """token预算相关的配置，与 [memory] 配置的键一致"""
+        return {"budget_tokens": self.budget_tokens, "summary_tokens": self.summary_tokens,
+                "rules_tokens": self.rules_tokens}
+
+    def set_impression(self, player_id: int, text: str, summarized: bool = False):
+        self._sequence += 1
+        self.impressions[player_id] = text
+        self.summarized[player_id] = summarized
+        self._updates[player_id] = self._sequence
+
+    def breakdown(self, model: str) -> Dict[str, int]:
+        """记忆各部分的token数"""
+        impressions = sum(token_counter.count(text, model) for text in self.impressions.values())
+        rules = token_counter.count(self.rules, model)
+        return {"impressions": impressions, "rules": rules, "total": impressions + rules}
+
+    def compression_plan(self, model: str) -> Dict[str, List[int]]:
+        """超出预算时需要压缩的条目：{"impressions": 玩家ID列表（旧且长的优先）, "rules": [] 或 [0]}"""
+        plan = {"impressions": [], "rules": []}
+        if not self.budget_tokens:
+            return plan
+        rules = token_counter.count(self.rules, model)
+        if rules > self.rules_tokens:
+            plan["rules"] = [0]
+            rules = self.rules_tokens
+        sizes = {pid: token_counter.count(text, model) for pid, text in self.impressions.items()}
+        total = rules + sum(sizes.values())
+        # 先压缩未压缩过的旧印象，同样新旧时先压缩长的
+        candidates = sorted(
+            (pid for pid, size in sizes.items() if size > self.summary_tokens),
+            key=lambda pid: (self.summarized.get(pid, False), self._updates.get(pid, 0), -sizes[pid])
+        )
+        for pid in candidates:
+            if total <= self.budget_tokens:
+                break
+            plan["impressions"].append(pid)
+            total -= sizes[pid] - self.summary_tokens
+        return plan
+
+    def export(self) -> Dict:
+        return {
+            "impressions": {str(pid): text for pid, text in self.impressions.items()},
+            "player_rules": self.rules
+        }
+
+    def load(self, memory: Dict):
+        self.impressions = {}
+        self.summarized = {}
+        self._updates = {}
+        for pid, text in memory.get("impressions", {}).items():
+            self.set_impression(int(pid), text)
+        self.rules = memory.get("player_rules", "")
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str) -> str:
+    """把文字截断到不超过max_tokens，压缩调用失败时的兜底"""
+    if token_counter.count(text, model) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if token_counter.count(text[:middle], model) <= max_tokens - 1:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + "…"
+
+
+def prompt_sections(messages: List[Dict], model: str, sections: Optional[Dict[str, str]] = None) -> Dict[str, int]:
+    """一次请求的提示词各部分token数：system（系统前缀）、sections中的各部分（如印象、规则）、other（其余）和total"""
+    system = sum(token_counter.count(m["content"], model) for m in messages if m["role"] == "system")
+    user = sum(token_counter.count(m["content"], model) for m in messages if m["role"] != "system")
+    breakdown = {"system": system}
+    for name, text in (sections or {}).items():
+        breakdown[name] = token_counter.count(text, model)
+    breakdown["other"] = max(0, user - sum(breakdown[name] for name in (sections or {})))
+    breakdown["total"] = system + user
+    return breakdown
@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional
+
+# 调用标签（game_id、round、phase等），由调用方通过tag_calls设置，沿调用链向下传递
+_call_tags: ContextVar[Dict] = ContextVar("llm_call_tags", default={})
+# 当前正在进行的chat调用的统计，由各层客户端通过note写入
+_current_call: ContextVar[Optional[Dict]] = ContextVar("llm_current_call", default=None)
+
+# 每条记录中的计量字段，cached_tokens为后端报告的命中提示词缓存的token数
+TOKEN_FIELDS = ("prompt_tokens", "completion_tokens", "reasoning_tokens", "cached_tokens")
+
+
+@contextmanager
+def tag_calls(**tags):
+    """在with块内发出的所有LLM调用都带上这些标签，可以嵌套，内层标签覆盖外层
+
+    标签保存在contextvars中，通过LLMScheduler提交到线程池的任务会继承提交时的标签。
+    """
+    token = _call_tags.set({**_call_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        _call_tags.reset(token)
+
+
+def current_tags() -> Dict:
+    """当前上下文中的调用标签"""
+    return _call_tags.get()
+
+
+def start_call() -> Dict:
+    """开始计量一次chat调用，返回供note写入的统计字典"""
+    stats = {"_start": time.perf_counter()}
+    stats["_token"] = _current_call.set(stats)
+    return stats
+
+
+def finish_call(stats: Dict) -> Dict:
+    """结束计量，返回带有耗时的统计信息（不含标签）"""
+    _current_call.reset(stats.pop("_token"))
+    stats["wall_ms"] = round((time.perf_counter() - stats.pop("_start")) * 1000, 1)
+    return stats
+
+
+def note(**stats):
+    """为当前chat调用补充统计信息（token数、是否命中缓存等），不在计量中的调用直接忽略"""
+    current = _current_call.get()
+    if current is not None:
+        current.update(stats)
+
+
+def note_first_token():
+    """记录当前调用收到第一个输出token的时间，只记录第一次"""
+    current = _current_call.get()
+    if current is not None and "ttft_ms" not in current:
+        current["ttft_ms"] = round((time.perf_counter() - current["_start"]) * 1000, 1)
+
+
+class MetricsRecorder:
+    """进程内的LLM调用记录收集器"""
+
+    def __init__(self):
+        self._records: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def record(self, record: Dict):
+        with self._lock:
+            self._records.append(record)
+
+    def drain(self, game_id=None) -> List[Dict]:
+        """取出并移除记录，指定game_id时只取出该局的记录"""
+        with self._lock:
+            if game_id is None:
+                drained, self._records = self._records, []
+            else:
+                drained = [r for r in self._records if r.get("game_id") == game_id]
+                self._records = [r for r in self._records if r.get("game_id") != game_id]
+        return drained
+
+
+metrics_recorder = MetricsRecorder()
+
+
+def export_metrics(records: Iterable[Dict], path: str):
+    """把调用记录追加写入JSONL文件，每行一次调用"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    lines = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in records)
+    if not lines:
+        return
+    # 一次写入，多个进程向同一文件追加时不会交错
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(lines)
+
+
+def load_metrics(path: str) -> List[Dict]:
+    """读取JSONL格式的调用记录"""
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+
+def summarize_metrics(records: Iterable[Dict], key: str = "phase") -> Dict[str, Dict]:
+    """按key分组汇总调用次数、耗时和token数"""
+    groups: Dict[str, Dict] = {}
+    for record in records:
+        group = groups.setdefault(str(record.get(key, "unknown")), {
+            "calls": 0, "errors": 0, "cache_hits": 0, "wall_ms": 0.0, "load_ms": 0.0, "ttft_ms": 0.0, "ttft_calls": 0,
+            **{field: 0 for field in TOKEN_FIELDS}
+        })
+        group["calls"] += 1
+        group["errors"] += 1 if record.get("error") else 0
+        group["cache_hits"] += 1 if record.get("cache_hit") else 0
+        group["wall_ms"] += record.get("wall_ms", 0.0)
+        group["load_ms"] += record.get("load_ms") or 0.0  # 本地后端加载模型的耗时
+        if record.get("ttft_ms") is not None:
+            group["ttft_ms"] += record["ttft_ms"]
+            group["ttft_calls"] += 1
+        for field in TOKEN_FIELDS:
+            group[field] += record.get(field) or 0
+    for group in groups.values():
+        group["wall_ms"] = round(group["wall_ms"], 1)
+        group["load_ms"] = round(group["load_ms"], 1)
+        ttft_calls = group.pop("ttft_calls")
+        ttft_total = group.pop("ttft_ms")
+        group["avg_ttft_ms"] = round(ttft_total / ttft_calls, 1) if ttft_calls else None
+    return groups
@@ -0,0 +1,199 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from llm_client import LLMCallError, LLMClient, current_keep_alive
+from metrics import note, note_first_token
+from stream_parser import STOP_ON_PARAGRAPH
+
+# 延迟分布
+LATENCY_FIXED = "fixed"  # 固定为latency_mean
+LATENCY_UNIFORM = "uniform"  # [0, 2 * latency_mean] 均匀分布
+LATENCY_LOGNORMAL = "lognormal"  # 对数正态分布，均值为latency_mean，latency_sigma控制长尾
+LATENCY_DISTRIBUTIONS = (LATENCY_FIXED, LATENCY_UNIFORM, LATENCY_LOGNORMAL)
+
+_KEY_VALUE_PATTERN = re.compile(r"^\s*([A-Za-z_]+)\s*[:：]\s*(.*?)\s*$", re.MULTILINE)
+
+
+class MockLLMClient(LLMClient):
+    """不依赖任何外部服务的LLM客户端，用于离线测试和压测
+
+    根据请求的JSON Schema和内容生成合法的描述、投票、印象（逐个或批量）、规则理解和JSON纠正回复，
+    可配置延迟分布、调用失败率和输出畸形JSON的比例。
+    capacity模拟服务端同时处理的请求数上限（如llama.cpp的并行槽位），超出的请求排队；
+    批量调用只占一个位置、只采样一次延迟，模拟理想的GPU批处理。
+    设置max_loaded时模拟本地后端的模型加载：同时最多加载max_loaded个模型，调用未加载的模型需额外等待load_latency
+    （与本地后端一样，同一时刻只能加载一个模型），
+    并按keep_alive提示为0时在调用后卸载模型，用于离线评估调度器的模型驻留管理。
+    """
+
+    backend = "mock"
+    supports_batch = True
+
+    def __init__(self, latency_mean: float = 0.0, latency_distribution: str = LATENCY_FIXED,
+                 latency_sigma: float = 0.5, failure_rate: float = 0.0, malformed_rate: float = 0.0,
+                 seed: Optional[int] = None, max_loaded: int = 0, load_latency: float = 0.0, capacity: int = 0):
+        """初始化
+
+        Args:
+            latency_mean: 每次调用的平均延迟秒数
+            latency_distribution: 延迟分布，fixed、uniform或lognormal
+            latency_sigma: lognormal分布的形状参数，越大长尾越明显
+            failure_rate: 调用失败（抛出可重试的LLMCallError）的概率
+            malformed_rate: 描述、投票和批量反思回复为无法直接解析的JSON的概率
+            seed: 随机种子，相同种子得到相同的回复序列（单线程时）
+            max_loaded: 模拟同时加载的模型数上限，0表示不模拟模型加载
+            load_latency: 模拟加载一个模型的秒数
+            capacity: 模拟服务端同时处理的请求数上限，0表示不限制
+        """
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"未知的延迟分布: {latency_distribution}")
+        self.latency_mean = latency_mean
+        self.latency_distribution = latency_distribution
+        self.latency_sigma = latency_sigma
+        self.failure_rate = failure_rate
+        self.malformed_rate = malformed_rate
+        self.max_loaded = max_loaded
+        self.load_latency = load_latency
+        self._loaded: "OrderedDict[str, bool]" = OrderedDict()  # 已加载的模型，按最近使用排序
+        self.loads = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._capacity = threading.BoundedSemaphore(capacity) if capacity else None
+
+    def _sample_latency(self) -> float:
+        if self.latency_mean <= 0:
+            return 0.0
+        if self.latency_distribution == LATENCY_UNIFORM:
+            return self._rng.uniform(0, 2 * self.latency_mean)
+        if self.latency_distribution == LATENCY_LOGNORMAL:
+            # 使对数正态分布的均值等于latency_mean
+            mu = math.log(self.latency_mean) - self.latency_sigma ** 2 / 2
+            return self._rng.lognormvariate(mu, self.latency_sigma)
+        return self.latency_mean
+
+    def _load(self, model: str) -> float:
+        """模拟加载模型，返回加载耗时（调用方需持有锁）"""
+        if not self.max_loaded:
+            return 0.0
+        if model in self._loaded:
+            self._loaded.move_to_end(model)
+            return 0.0
+        self._loaded[model] = True
+        if len(self._loaded) > self.max_loaded:
+            self._loaded.popitem(last=False)
+        self.loads += 1
+        return self.load_latency
+
+    def chat(self, messages, model, schema=None, stop_on=None):
+        with self._lock:
+            load = self._load(model)
+            latency = self._sample_latency()
+            failed = self._rng.random() < self.failure_rate
+            malformed = self._rng.random() < self.malformed_rate
+            content = self._reply(messages, schema, stop_on, malformed)
+        if load:
+            with self._load_lock:
+                time.sleep(load)
+        if latency:
+            self._serve(latency)
+        if self.max_loaded and current_keep_alive() == 0:
+            with self._lock:
+                self._loaded.pop(model, None)
+        if failed:
+            raise LLMCallError("模拟的后端故障", model=model, backend=self.backend, status_code=503)
+        if load:
+            note(load_ms=round(load * 1000, 1))
+        note_first_token()
+        note(prompt_tokens=sum(len(m["content"]) for m in messages) // 2, completion_tokens=len(content) // 2)
+        return content, ""
+
+    def _serve(self, latency: float):
+        """模拟服务端处理一个请求（或一批请求）的耗时"""
+        if self._capacity is None:
+            time.sleep(latency)
+            return
+        with self._capacity:
+            time.sleep(latency)
+
+    def batch_chat(self, conversations, model, schema=None, stop_on=None, **options):
+        with self._lock:
+            load = self._load(model)
+            latency = self._sample_latency()
+            failed = self._rng.random() < self.failure_rate
+            contents = [self._reply(messages, schema, stop_on, self._rng.random() < self.malformed_rate)
+                        for messages in conversations]
+        if load:
+            with self._load_lock:
+                time.sleep(load)
+        if latency:
+            self._serve(latency)
+        if failed:
+            raise LLMCallError("模拟的后端故障", model=model, backend=self.backend, status_code=503)
+        return [
+            (content, "", {"prompt_tokens": sum(len(m["content"]) for m in messages) // 2,
+                           "completion_tokens": len(content) // 2})
+            for messages, content in zip(conversations, contents)
+        ]
+
+    def _reply(self, messages, schema, stop_on, malformed: bool) -> str:
+        """根据请求类型生成回复（调用方需持有锁）"""
+        properties = (schema or {}).get("properties", {})
+        if "undercover_name" in properties:
+            fields = {
+                "undercover_name": self._rng.choice(properties["undercover_name"]["enum"]),
+                "reason": "他的描述和其他人不太一样"
+            }
+        elif "behavior" in properties:
+            fields = {"behavior": f"模拟描述{self._rng.randrange(1000)}", "reason": "描述得比较笼统"}
+        elif properties:
+            # 批量反思：以玩家名字为键的印象
+            fields = {name: f"模拟印象{self._rng.randrange(1000)}：发言比较谨慎。" for name in properties}
+        elif len(messages) == 1:
+            # 没有系统前缀的单条消息只有JSON纠正请求
+            return self._repair(messages[0]["content"])
+        elif stop_on == STOP_ON_PARAGRAPH:
+            # 只有反思印象按段落结束
+            return f"模拟印象{self._rng.randrange(1000)}：发言比较谨慎。"
+        else:
+            return "模拟的规则理解：描述要贴近自己的词，同时不要过于直白。"
+        if malformed:
+            # 不带括号的键值对，本地修复无法处理，需要走JSON纠正
+            return "\n".join(f"{key}: {value}" for key, value in fields.items())
+        return json.dumps(fields, ensure_ascii=False)
+
+    @staticmethod
+    def _repair(prompt: str) -> str:
+        """把模拟的畸形输出（每行一个键值对）还原为JSON"""
+        return json.dumps(dict(_KEY_VALUE_PATTERN.findall(prompt)), ensure_ascii=False)
+
+
+_mock_clients: Dict[tuple, MockLLMClient] = {}
+_mock_lock = threading.Lock()
+
+
+def get_mock_client(config: Dict) -> MockLLMClient:
+    """获取进程内共享的模拟客户端，相同配置只创建一次"""
+    key = tuple(sorted((k, v) for k, v in config.items() if k != "enabled"))
+    with _mock_lock:
+        client = _mock_clients.get(key)
+        if client is None:
+            client = MockLLMClient(
+                latency_mean=config.get("latency_mean", 0.0),
+                latency_distribution=config.get("latency_distribution", LATENCY_FIXED),
+                latency_sigma=config.get("latency_sigma", 0.5),
+                failure_rate=config.get("failure_rate", 0.0),
+                malformed_rate=config.get("malformed_rate", 0.0),
+                seed=config.get("seed"),
+                max_loaded=config.get("max_loaded", 0),
+                load_latency=config.get("load_latency", 0.0),
+                capacity=config.get("capacity", 0)
+            )
+            _mock_clients[key] = client
+        return client
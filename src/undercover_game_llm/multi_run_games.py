@@ -1,18 +1,29 @@
 from game import UndercoverGame
 import sys
 
-from game_analysis import print_game_winners_table, print_player_win_stats
+from analytics import GameAnalytics
+from game_analysis import print_game_winners_table, print_player_stats, print_player_win_stats
+from player import warm_up_models
+import player_configs
+from scheduler import LLMScheduler
 
-def multi_run_games(num_runs):
-    player_map = None
+def multi_run_games(num_runs, scheduler=None, parallel_votes=False, player_map=None, save=True, verbose=True,
+                    analytics=None, description_mode="sequential"):
     game_results = []
     # 运行多次游戏
     for i in range(num_runs):
-        print(f"-- 运行第 {i + 1} / {num_runs} 次游戏 --")
-        game = UndercoverGame(player_map=player_map, game_id=i + 1)
-        game.start_game()
+        if verbose:
+            print(f"-- 运行第 {i + 1} / {num_runs} 次游戏 --")
+        game = UndercoverGame(player_map=player_map, game_id=i + 1, scheduler=scheduler,
+                              parallel_votes=parallel_votes, verbose=verbose, description_mode=description_mode)
+        if player_map is None and player_configs.llm_config.get("warm_up", False):
+            warm_up_models(game.player_map.values())
+        game.start_game(save=save)
+        game.events.close()  # 不保存时也及时释放事件的临时文件
         player_map = game.player_map
         game_results.append(game.game_result)
+        if analytics is not None:
+            analytics.add_result(game.game_result)  # 每局结束后更新累计统计
     return player_map, game_results
 
 
@@ -21,6 +32,15 @@ if __name__ == "__main__":
         num_runs = int(sys.argv[1])
     else:
         num_runs = 1  # 默认运行1次
-    final_player_map, final_game_results = multi_run_games(num_runs)
+    scheduler_config = player_configs.scheduler_config
+    scheduler = LLMScheduler.from_config(scheduler_config)
+    final_analytics = GameAnalytics()
+    final_player_map, final_game_results = multi_run_games(
+        num_runs, scheduler, parallel_votes=scheduler_config.get("parallel_votes", False), analytics=final_analytics,
+        description_mode=scheduler_config.get("description_mode", "sequential")
+    )
+    if scheduler:
+        scheduler.shutdown()
     print_game_winners_table(final_game_results)
-    print_player_win_stats(final_player_map, final_game_results)
+    print_player_win_stats(final_analytics)
+    print_player_stats(final_analytics)
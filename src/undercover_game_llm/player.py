@@ -1,96 +1,247 @@
-import json
-import re
-from typing import List, Dict, Tuple
-from llm_client import LLMClient, OpenAIClient, OllamaClient  # 假设llm_client.py在同一目录
+from collections import Counter
+from concurrent.futures import Future
+from typing import Iterable, List, Dict, Optional, Tuple
+from coalescer import wrap_with_batching
+from llm_client import LLMCallError, LLMClient, get_llm_client, wrap_with_metrics  # 假设llm_client.py在同一目录
+from json_repair import TIER_FAILED, TIER_LLM, extract_json
+from llm_cache import RecordingClient, wrap_with_cache
+from memory import PlayerMemory, prompt_sections, truncate_to_tokens
+from metrics import tag_calls
+from mock_client import get_mock_client
+import player_configs
+from prompt_builder import PromptBuilder
+from resilience import wrap_with_resilience
+from router import get_router
+from runtime import load_prompt
+from stream_parser import STOP_ON_JSON, STOP_ON_PARAGRAPH
+from transcript import get_transcript_writer
+from scheduler import LLMScheduler
+
+# 提示词模板，第一次使用时才从项目根目录下的prompts目录读取（见runtime.load_prompt）
+_PROMPT_FILES = {
+    "RULES": "rule_base.txt",
+    "SYSTEM_PREFIX_TEMPLATE": "system_prefix_template.txt",
+    "ANALYZE_TEMPLATE": "analyze_game_rule.txt",
+    "VOTE_TEMPLATE": "vote_prompt_template.txt",
+    "DESCRIPTION_TEMPLATE": "description_prompt_template.txt",
+    "DESCRIPTION_AWARE_TEMPLATE": "description_aware_prompt_template.txt",
+    "REFLECT_TEMPLATE": "reflect_prompt_template.txt",
+    "REFLECT_BATCH_TEMPLATE": "reflect_batch_prompt_template.txt",
+    "CORRECT_JSON_TEMPLATE": "correct_json_template.txt",
+    "SUMMARIZE_MEMORY_TEMPLATE": "summarize_memory_template.txt",
+}
+
 
-# 读取提示词模板
 def load_prompt_template(file_name: str) -> str:
-    """从文件加载提示词模板"""
-    try:
-        with open(f"prompts/{file_name}", "r", encoding="utf-8") as f:
-            return f.read()
-    except:
-        print(f"警告: 无法加载提示词模板 {file_name}")
-        return ""
-
-# 加载所有提示词模板
-RULES = load_prompt_template("rule_base.txt")
-ANALYZE_TEMPLATE = load_prompt_template("analyze_game_rule.txt")
-VOTE_TEMPLATE = load_prompt_template("vote_prompt_template.txt")
-DESCRIPTION_TEMPLATE = load_prompt_template("description_prompt_template.txt")
-REFLECT_TEMPLATE = load_prompt_template("reflect_prompt_template.txt")
-CORRECT_JSON_TEMPLATE = load_prompt_template("correct_json_template.txt")
+    """加载提示词模板"""
+    return load_prompt(file_name)
+
+
+def __getattr__(name: str):
+    # 兼容以模块属性访问模板（如 player.VOTE_TEMPLATE）
+    if name in _PROMPT_FILES:
+        return load_prompt(_PROMPT_FILES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# 结构化输出使用的JSON Schema，后端支持时模型输出天然合法
+DESCRIPTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "behavior": {"type": "string"},
+        "reason": {"type": "string"}
+    },
+    "required": ["behavior", "reason"],
+    "additionalProperties": False
+}
+
+
+def build_vote_schema(candidate_names: List[str]) -> Dict:
+    """投票的JSON Schema，卧底名字限定为候选玩家之一"""
+    return {
+        "type": "object",
+        "properties": {
+            "undercover_name": {"type": "string", "enum": candidate_names},
+            "reason": {"type": "string"}
+        },
+        "required": ["undercover_name", "reason"],
+        "additionalProperties": False
+    }
+
+
+def build_reflect_schema(player_names: List[str]) -> Dict:
+    """批量反思的JSON Schema，每个玩家名字对应一段印象"""
+    return {
+        "type": "object",
+        "properties": {name: {"type": "string"} for name in player_names},
+        "required": player_names,
+        "additionalProperties": False
+    }
+
+
+# 反思方式
+REFLECT_PER_PLAYER = "per_player"  # 对每个其他玩家单独调用一次
+REFLECT_BATCHED = "batched"  # 一次调用更新全部印象，解析失败的部分退回逐个调用
+REFLECTION_MODES = (REFLECT_PER_PLAYER, REFLECT_BATCHED)
+
+
+def reflection_mode_for(model: str) -> str:
+    """模型使用的反思方式，[reflection.models]中单独配置的优先"""
+    reflection_config = player_configs.reflection_config
+    mode = reflection_config.get("models", {}).get(model, reflection_config.get("mode", REFLECT_PER_PLAYER))
+    if mode not in REFLECTION_MODES:
+        raise ValueError(f"未知的反思方式: {mode}")
+    return mode
 
 
 # 定义AI玩家类
 class AIPlayer:
-    def __init__(self, player_id: int, name: str, word: str, role: str, model: str, local: bool):
+    def __init__(self, player_id: int, name: str, word: str, role: str, model: str, local: bool,
+                 llm_client: Optional[LLMClient] = None):
         self.player_id = player_id
         self.name = name  # 玩家名称
         self.word = word  # 分配到的词语
         self.role = role  # "平民" 或 "卧底"
         self.is_alive = True
-        self.impressions: Dict[int, str] = {}  # {其他玩家ID: 印象描述}
-        self.player_rules = ""  # 玩家对游戏规则的理解
+        # 对其他玩家的印象和对规则的理解，超出token预算时压缩
+        memory_config = player_configs.memory_config
+        self.memory = PlayerMemory(
+            budget_tokens=memory_config.get("budget_tokens", 0),
+            summary_tokens=memory_config.get("summary_tokens", 120),
+            rules_tokens=memory_config.get("rules_tokens", 400)
+        )
         self.player_map = {}  # 玩家映射 {玩家ID: AIPlayer实例}
+        # 规则与身份作为稳定的系统前缀
+        self.prompt_builder = PromptBuilder(load_prompt("system_prefix_template.txt"), load_prompt("rule_base.txt"),
+                                            name)
+        self.json_repair_stats: Counter = Counter()  # 每个JSON修复层级的命中次数
+        self.llm_failures: List[Dict] = []  # 本局中LLM调用最终失败的记录
+        self.recorded_calls: List[Dict] = []  # 本局中每次LLM调用的输出，用于回放
+        self.local = local
+        self.model = model
+        self.reflection_mode = reflection_mode_for(model)
+        self.reflection_stats: Counter = Counter()  # 批量反思的结果：完整、部分退回逐个调用、整体退回
+        # 给定客户端时（如回放）直接使用，不创建后端连接
+        self.llm_client: LLMClient = llm_client or self._build_llm_client(local)
+
+    @property
+    def impressions(self) -> Dict[int, str]:
+        """{其他玩家ID: 印象描述}"""
+        return self.memory.impressions
+
+    @impressions.setter
+    def impressions(self, impressions: Dict[int, str]):
+        self.memory.load({"impressions": impressions, "player_rules": self.player_rules})
+
+    @property
+    def player_rules(self) -> str:
+        """玩家对游戏规则的理解"""
+        return self.memory.rules
+
+    @player_rules.setter
+    def player_rules(self, rules: str):
+        self.memory.rules = rules
 
-        # 根据配置选择LLM客户端
-        if local:
-            self.llm_client: LLMClient = OllamaClient()
+    def _build_llm_client(self, local: bool) -> LLMClient:
+        """根据配置创建LLM客户端，并依次套上请求合并、重试熔断、缓存、回放记录和调用计量"""
+        llm_config = player_configs.llm_config
+        client_options = {
+            "stream": llm_config.get("stream", False),
+            "max_reasoning_tokens": llm_config.get("max_reasoning_tokens") or None,
+            "transcript": get_transcript_writer(llm_config.get("transcript", {})),
+            "debug_log": llm_config.get("transcript", {}).get("debug", False)
+        }
+        mock_config = llm_config.get("mock", {})
+        if mock_config.get("enabled", False):
+            # 离线测试和压测使用不访问任何服务的模拟后端
+            client = get_mock_client(mock_config)
         else:
-            self.llm_client: LLMClient = OpenAIClient()
-        self.model = model
+            # 配置了多个端点且其中有提供该模型的端点时由路由分配请求，否则使用默认地址；
+            # 同一后端的所有玩家共用一个带连接池的客户端
+            router = get_router(llm_config.get("router", {}), local, pool_config=llm_config.get("pool"),
+                                **client_options)
+            if router is not None and router.serves(self.model):
+                client = router
+            else:
+                client = get_llm_client(local, pool_config=llm_config.get("pool"), **client_options)
+        client = wrap_with_batching(client, llm_config.get("batch", {}))
+        client = wrap_with_resilience(client, llm_config.get("resilience", {}))
+        client = wrap_with_cache(client, player_configs.cache_config)
+        if player_configs.replay_config.get("record", False):
+            client = RecordingClient(client, self.recorded_calls)
+        return wrap_with_metrics(client, self.name, player_configs.metrics_config)
 
     def _try_correct_json(self, error_json: str) -> str:
         """
         尝试修正错误的JSON字符串，使用CORRECT_JSON_TEMPLATE提示词调用codellama:13b模型。
         返回模型生成的字符串。
         """
-        prompt = CORRECT_JSON_TEMPLATE.format(error_json=error_json)
-        content, _ = self.llm_client.chat(
-            messages=[{"role": "user", "content": prompt}],
-            model=self.model
-        )
+        prompt = load_prompt("correct_json_template.txt").format(error_json=error_json)
+        with tag_calls(phase="json_repair"):
+            content, _ = self.llm_client.chat(
+                messages=[{"role": "user", "content": prompt}],
+                model=self.model
+            )
         return content.strip()
     
 
     def _parse_json_content(self, content: str, times=0) -> Dict:
         if times > 3:
+            self.json_repair_stats[TIER_FAILED] += 1
             raise ValueError("解析JSON失败次数过多，可能是输入内容格式不正确")
-        json_match = re.search(r'({[\s\S]*})', content)
-        if json_match:
-            json_str = json_match.group(1)
-            try:
-                result = json.loads(json_str)
-            except:
-                # 尝试修正JSON
-                corrected = self._try_correct_json(json_str)
-                result = self._parse_json_content(corrected, times + 1)
-        else:
-            # 尝试修正JSON
-            corrected = self._try_correct_json(content)
-            result = self._parse_json_content(corrected, times + 1)
-        return result
+        if not content.strip():
+            # 空响应没有可以纠正的内容，不调用LLM修复
+            self.json_repair_stats[TIER_FAILED] += 1
+            raise ValueError("模型没有输出内容")
+        # 先在本地提取和修复，只有本地修复失败才交给LLM纠正
+        result, tier = extract_json(content)
+        if result is not None:
+            self.json_repair_stats[tier if times == 0 else TIER_LLM] += 1
+            return result
+        corrected = self._try_correct_json(content)
+        return self._parse_json_content(corrected, times + 1)
+
+    def _record_failure(self, phase: str, error: LLMCallError):
+        """记录一次最终失败的LLM调用"""
+        self.llm_failures.append({
+            "player": self.name,
+            "model": self.model,
+            "phase": phase,
+            "error_type": type(error).__name__,
+            "message": str(error)[:200]
+        })
+        print(f"{self.name}调用模型失败（{phase}）: {str(error)}")
                 
-    def generate_description(self) -> str:
-        """生成对自己词语的描述"""
+    def generate_description(self, earlier_descriptions: Optional[Dict[int, str]] = None) -> Tuple[str, str]:
+        """生成对自己词语的描述
+
+        Args:
+            earlier_descriptions: 本轮在自己之前发言的玩家的描述 {玩家ID: 描述}，为None时提示词中不包含本轮的描述
+        """
         # 准备模板变量
         template_vars = {
-            "rules": RULES,
-            "self_name": self.name,
             "player_rules": self.player_rules,
             "player_impressions": self._format_impressions(),
             "current_word": self.word
         }
+        template = load_prompt("description_prompt_template.txt")
+        if earlier_descriptions is not None:
+            template = load_prompt("description_aware_prompt_template.txt")
+            template_vars["earlier_descriptions"] = (
+                self._format_descriptions(earlier_descriptions) or "暂无，你是本轮第一个发言的玩家"
+            )
 
         # 填充模板
-        prompt = DESCRIPTION_TEMPLATE.format(**template_vars)
+        messages = self.prompt_builder.build(template, self.model, **template_vars)
 
         # 调用LLM
-        content, _ = self.llm_client.chat(
-            messages=[{"role": "user", "content": prompt}],
-            model=self.model
-        )
+        try:
+            with self._measure_prompt(messages, template_vars):
+                content, _ = self.llm_client.chat(messages=messages, model=self.model, schema=DESCRIPTION_SCHEMA,
+                                                  stop_on=STOP_ON_JSON)
+        except LLMCallError as e:
+            self._record_failure("description", e)
+            return "", f"{self.name}调用模型失败，本轮未能发言"
 
         # 解析JSON响应
         try:
@@ -98,18 +249,23 @@ class AIPlayer:
             behavior = response.get("behavior", "")
             reason = response.get("reason", "")
             return behavior, reason
+        except LLMCallError as e:
+            # JSON纠正请求失败
+            self._record_failure("json_repair", e)
+            return content.strip(), f"{self.name}响应解析失败，原样输出模型返回内容"
         except Exception as e:
             print(f"{self.name}响应解析失败: {str(e)}")
             # 备用方案
             backup_desc = content.strip()
             return backup_desc, f"{self.name}响应解析失败，原样输出模型返回内容"
 
-    def vote(self, candidates: List[int], current_descriptions: Dict[int, str]) -> Tuple[int, str]:
-        """投票选出怀疑的卧底"""
+    def vote(self, candidates: List[int], current_descriptions: Dict[int, str]) -> Tuple[Optional[int], str, bool]:
+        """投票选出怀疑的卧底，返回 (玩家ID, 理由, 是否为惩罚票)
+
+        模型调用失败时返回 (None, 原因, False) 表示弃权；响应无法解析或投给了不存在的玩家时投给自己作为惩罚。
+        """
         # 准备模板变量
         template_vars = {
-            "rules": RULES,
-            "self_name": self.name,
             "alive_players": ', '.join(self.player_map[pid].name for pid in candidates),
             "player_descriptions": self._format_descriptions(current_descriptions),
             "player_rules": self.player_rules,
@@ -118,13 +274,17 @@ class AIPlayer:
         }
 
         # 填充模板
-        prompt = VOTE_TEMPLATE.format(**template_vars)
+        messages = self.prompt_builder.build(load_prompt("vote_prompt_template.txt"), self.model, **template_vars)
+        schema = build_vote_schema([self.player_map[pid].name for pid in candidates])
 
         # 调用LLM
-        content, _ = self.llm_client.chat(
-            messages=[{"role": "user", "content": prompt}],
-            model=self.model
-        )
+        try:
+            with self._measure_prompt(messages, template_vars):
+                content, _ = self.llm_client.chat(messages=messages, model=self.model, schema=schema,
+                                                  stop_on=STOP_ON_JSON)
+        except LLMCallError as e:
+            self._record_failure("vote", e)
+            return None, f"{self.name}调用模型失败，弃权", False
 
         # 解析JSON响应
         try:
@@ -135,70 +295,200 @@ class AIPlayer:
             # 通过名称查找玩家ID
             for player_id in candidates:
                 if self.player_map[player_id].name == undercover_name:
-                    return player_id, reason
+                    return player_id, reason, False
 
             # 如果找不到匹配名称，返回一个默认值
-            return self.player_id, f"{self.name}没有返回正确的玩家名称，作为惩罚，投票给 {self.name}"
+            return self.player_id, f"{self.name}没有返回正确的玩家名称，作为惩罚，投票给 {self.name}", True
+        except LLMCallError as e:
+            # JSON纠正请求失败，属于后端故障而不是模型的错误，不做惩罚
+            self._record_failure("json_repair", e)
+            return None, f"{self.name}调用模型失败，弃权", False
         except Exception as e:
             print(f"{self.name}响应解析失败: {str(e)}")
             # 备用方案
-            return self.player_id, f"{self.name}响应解析失败，作为惩罚，投票给 {self.name}"
+            return self.player_id, f"{self.name}响应解析失败，作为惩罚，投票给 {self.name}", True
 
     def update_impressions(self, game_history: str):
         """根据游戏历史更新对其他玩家的印象"""
         # 先更新对其他玩家的印象
-        for player_id in list(self.impressions.keys()):
-            if player_id == self.player_id:
-                continue
-
-            # 准备模板变量
-            template_vars = {
-                "rules": RULES,
-                "self_name": self.name,
-                "player": self.player_map[player_id].name,
-                "round_base_info": game_history,
-                "round_action_info": self._get_action_info(player_id),
-                "previous_impression": self.impressions.get(player_id, "暂无印象")
-            }
-
-            # 填充模板
-            prompt = REFLECT_TEMPLATE.format(**template_vars)
-
-            # 调用LLM
-            content, _ = self.llm_client.chat(
-                messages=[{"role": "user", "content": prompt}],
-                model=self.model
-            )
-
-            # 更新印象
-            self.impressions[player_id] = content.strip()
+        targets = self._impression_targets()
+        if self.reflection_mode == REFLECT_BATCHED:
+            impressions = self.reflect_all(targets, game_history)
+        else:
+            impressions = {player_id: self.reflect_on(player_id, game_history) for player_id in targets}
+        for player_id in targets:
+            self.memory.set_impression(player_id, impressions[player_id])
 
         # 然后更新对游戏规则的理解
         self._update_game_rules(game_history)
+        self._compress_memory()
+
+    def update_impressions_async(self, game_history: str, scheduler: LLMScheduler) -> Future:
+        """通过调度器并发更新印象，返回整个更新完成时结束的Future
+
+        对每个玩家的反思调用互相独立，会并发执行；规则理解的更新依赖自己的全部印象，需等待其完成后再提交。
+        批量反思只有一次调用，整个更新作为一个任务提交。
+        """
+        if self.reflection_mode == REFLECT_BATCHED:
+            return scheduler.submit(self.update_impressions, game_history, backend=self.llm_client.backend,
+                                    model=self.model)
+        targets = self._impression_targets()
+        reflect_futures = [
+            scheduler.submit(self.reflect_on, player_id, game_history, backend=self.llm_client.backend,
+                             model=self.model)
+            for player_id in targets
+        ]
+
+        def finish():
+            # 按原有顺序写回印象，保证结果与串行执行一致
+            for player_id, future in zip(targets, reflect_futures):
+                self.memory.set_impression(player_id, future.result())
+            self._update_game_rules(game_history)
+            self._compress_memory()
+
+        return scheduler.submit_after(reflect_futures, finish, backend=self.llm_client.backend,
+                                      model=self.model)
+
+    def reflect_all(self, targets: List[int], game_history: str) -> Dict[int, str]:
+        """一次调用更新对所有targets的印象，返回 {玩家ID: 新印象}
+
+        模型返回以玩家名字为键的JSON；解析失败时全部退回逐个反思，缺少或为空的玩家单独反思。
+        """
+        names = {self.player_map[player_id].name: player_id for player_id in targets}
+        previous_impressions = "\n".join(
+            f"{name}: {self.impressions.get(player_id, '暂无印象')}" for name, player_id in names.items()
+        )
+        messages = self.prompt_builder.build(
+            load_prompt("reflect_batch_prompt_template.txt"), self.model, round_base_info=game_history,
+            previous_impressions=previous_impressions, players="、".join(names)
+        )
+        response = {}
+        try:
+            with tag_calls(reflection=REFLECT_BATCHED), \
+                    self._measure_prompt(messages, {"player_impressions": previous_impressions}):
+                content, _ = self.llm_client.chat(messages=messages, model=self.model,
+                                                  schema=build_reflect_schema(list(names)), stop_on=STOP_ON_JSON)
+            response = self._parse_json_content(content)
+        except LLMCallError as e:
+            self._record_failure("reflect", e)
+        except Exception as e:
+            print(f"{self.name}批量反思解析失败，改为逐个反思: {str(e)}")
+
+        impressions = {
+            names[name]: text.strip() for name, text in response.items()
+            if name in names and isinstance(text, str) and text.strip()
+        }
+        missing = [player_id for player_id in targets if player_id not in impressions]
+        self.reflection_stats["batched_ok" if not missing else
+                              "batched_partial" if impressions else "batched_fallback"] += 1
+        for player_id in missing:
+            impressions[player_id] = self.reflect_on(player_id, game_history)
+        return impressions
+
+    def _impression_targets(self) -> List[int]:
+        """需要更新印象的其他玩家ID列表"""
+        return [player_id for player_id in self.impressions.keys() if player_id != self.player_id]
+
+    def reflect_on(self, player_id: int, game_history: str) -> str:
+        """根据游戏历史反思对某个玩家的印象，返回新的印象描述"""
+        # 准备模板变量
+        template_vars = {
+            "player": self.player_map[player_id].name,
+            "round_base_info": game_history,
+            "round_action_info": self._get_action_info(player_id),
+            "previous_impression": self.impressions.get(player_id, "暂无印象")
+        }
+
+        # 填充模板
+        messages = self.prompt_builder.build(load_prompt("reflect_prompt_template.txt"), self.model, **template_vars)
+
+        # 调用LLM，印象只需要一段不换行的文字
+        try:
+            with tag_calls(reflection=REFLECT_PER_PLAYER), \
+                    self._measure_prompt(messages, {"player_impressions": template_vars["previous_impression"]}):
+                content, _ = self.llm_client.chat(messages=messages, model=self.model, stop_on=STOP_ON_PARAGRAPH)
+        except LLMCallError as e:
+            # 保留原有印象
+            self._record_failure("reflect", e)
+            return self.impressions.get(player_id, "暂无印象")
+        return content.strip()
 
     def _update_game_rules(self, game_history: str):
         """更新玩家对游戏规则的理解"""
         # 准备模板变量
         template_vars = {
-            "rules": RULES,
-            "self_name": self.name,
             "player_descriptions": game_history,
             "player_rules": self.player_rules,
             "player_impressions": self._format_impressions()
         }
 
         # 填充模板
-        prompt = ANALYZE_TEMPLATE.format(**template_vars)
+        messages = self.prompt_builder.build(load_prompt("analyze_game_rule.txt"), self.model, **template_vars)
 
         # 调用LLM
-        content, _ = self.llm_client.chat(
-            messages=[{"role": "user", "content": prompt}],
-            model=self.model
-        )
+        try:
+            with tag_calls(phase="rules"), self._measure_prompt(messages, template_vars):
+                content, _ = self.llm_client.chat(messages=messages, model=self.model)
+        except LLMCallError as e:
+            # 保留原有的规则理解
+            self._record_failure("rules", e)
+            return
 
         # 更新规则理解
         self.player_rules = content.strip()
 
+    def _measure_prompt(self, messages: List[Dict], template_vars: Dict):
+        """把本次提示词中印象、规则和其余部分的token数作为prompt_sections标签记入调用计量"""
+        sections = {}
+        if "player_impressions" in template_vars:
+            sections["impressions"] = template_vars["player_impressions"]
+        if "player_rules" in template_vars:
+            sections["rules"] = template_vars["player_rules"]
+        return tag_calls(prompt_sections=prompt_sections(messages, self.model, sections))
+
+    def _compress_memory(self):
+        """记忆超出token预算时，用LLM把最旧、最长的印象和过长的规则理解压缩为摘要"""
+        plan = self.memory.compression_plan(self.model)
+        for player_id in plan["impressions"]:
+            summary = self._summarize(f"对玩家{self.player_map[player_id].name}的印象",
+                                      self.impressions[player_id], self.memory.summary_tokens)
+            self.memory.set_impression(player_id, summary, summarized=True)
+            self.memory.compressions += 1
+        if plan["rules"]:
+            self.player_rules = self._summarize("对游戏规则和策略的理解", self.player_rules,
+                                                self.memory.rules_tokens)
+            self.memory.compressions += 1
+
+    def _summarize(self, subject: str, content: str, max_tokens: int) -> str:
+        """把一段记忆压缩到不超过max_tokens，模型调用失败或输出仍然过长时截断"""
+        messages = self.prompt_builder.build(load_prompt("summarize_memory_template.txt"), self.model, subject=subject,
+                                             content=content, max_words=max_tokens)
+        try:
+            with tag_calls(phase="memory"), self._measure_prompt(messages, {}):
+                summary, _ = self.llm_client.chat(messages=messages, model=self.model, stop_on=STOP_ON_PARAGRAPH)
+            summary = summary.strip() or content
+        except LLMCallError as e:
+            self._record_failure("memory", e)
+            summary = content
+        return truncate_to_tokens(summary, max_tokens, self.model)
+
+    def reset_stats(self):
+        """重置按局统计的指标"""
+        self.prompt_builder.reset_stats()
+        self.json_repair_stats = Counter()
+        self.llm_failures = []
+        self.reflection_stats = Counter()
+        self.memory.compressions = 0
+        self.recorded_calls.clear()  # RecordingClient持有同一个列表
+
+    def export_memory(self) -> Dict:
+        """导出玩家跨局积累的记忆（印象和规则理解），可JSON序列化"""
+        return self.memory.export()
+
+    def load_memory(self, memory: Dict):
+        """恢复由export_memory导出的记忆"""
+        self.memory.load(memory)
+
     def _format_impressions(self) -> str:
         """格式化印象信息"""
         return '\n'.join(
@@ -216,3 +506,15 @@ class AIPlayer:
     def _get_action_info(self, target_player_id: int) -> str:
         """获取目标玩家的行动信息"""
         return f"你正在分析 {self.player_map[target_player_id].name} 的行为模式、发言策略和投票倾向。"
+
+
+def warm_up_models(players: Iterable[AIPlayer]):
+    """在开局前预热所有玩家用到的模型：确认模型存在并提前加载，避免首个请求承担加载耗时"""
+    warmed = set()
+    for player in players:
+        key = (id(player.llm_client), player.model)
+        if key in warmed:
+            continue
+        warmed.add(key)
+        print(f"预热模型 {player.model} ({player.llm_client.backend})")
+        player.llm_client.warm_up(player.model)
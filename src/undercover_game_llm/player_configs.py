@@ -1,10 +1,85 @@
-import os.path
+from typing import Dict, Optional
 
-import toml
+from runtime import load_config
 
-def load_player_configs(toml_path):
-    data = toml.load(toml_path)
+
+def _load(toml_path: Optional[str]) -> Dict:
+    """toml_path为None时返回进程内共享的项目配置（第一次使用时读取），否则读取指定的文件"""
+    if toml_path is None:
+        return load_config()
+    import toml
+    return toml.load(toml_path)
+
+
+def load_player_configs(toml_path=None):
+    data = _load(toml_path)
     return data['player']
 
 
-player_configs = load_player_configs('conf/player_config.toml')
\ No newline at end of file
+def load_scheduler_config(toml_path=None):
+    data = _load(toml_path)
+    return data.setdefault('scheduler', {})
+
+
+def load_cache_config(toml_path=None):
+    data = _load(toml_path)
+    return data.setdefault('cache', {})
+
+
+def load_llm_config(toml_path=None):
+    data = _load(toml_path)
+    return data.setdefault('llm', {})
+
+
+def load_metrics_config(toml_path=None):
+    data = _load(toml_path)
+    return data.setdefault('metrics', {})
+
+
+def load_replay_config(toml_path=None):
+    data = _load(toml_path)
+    return data.setdefault('replay', {})
+
+
+def load_results_config(toml_path=None):
+    data = _load(toml_path)
+    return data.setdefault('results', {})
+
+
+def load_words_config(toml_path=None):
+    data = _load(toml_path)
+    return data.setdefault('words', {})
+
+
+def load_memory_config(toml_path=None):
+    data = _load(toml_path)
+    return data.setdefault('memory', {})
+
+
+def load_reflection_config(toml_path=None):
+    data = _load(toml_path)
+    return data.setdefault('reflection', {})
+
+
+# 模块级的配置在第一次访问时才读取配置文件。各模块在使用时通过 player_configs.llm_config 访问，
+# 导入模块本身不读取配置；各处拿到的是同一个字典，运行时的修改（如基准测试启用模拟后端）对所有模块可见
+_LOADERS = {
+    "player_configs": load_player_configs,
+    "scheduler_config": load_scheduler_config,
+    "cache_config": load_cache_config,
+    "llm_config": load_llm_config,
+    "metrics_config": load_metrics_config,
+    "replay_config": load_replay_config,
+    "results_config": load_results_config,
+    "words_config": load_words_config,
+    "memory_config": load_memory_config,
+    "reflection_config": load_reflection_config,
+}
+
+
+def __getattr__(name: str):
+    if name not in _LOADERS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = _LOADERS[name]()
+    globals()[name] = value
+    return value
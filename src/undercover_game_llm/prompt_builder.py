@@ -0,0 +1,85 @@
+import hashlib
+import threading
+from typing import Dict, Iterable, List
+
+
+class PrefixTracker:
+    """按模型记录最近一次构建的系统前缀，用于在构建提示词时估计后端KV缓存/提示词缓存的命中情况
+
+    Ollama等本地后端通常每个已加载模型只保留上一个请求的KV缓存，
+    所以只有当同一模型连续收到相同前缀时才能复用，这里按同样的口径估计命中。
+    构建的提示词不一定真的发出（命中响应缓存、合并后由批量调用发出、重试），这只是估计；
+    后端实际报告的缓存命中见summarize_prefix_stats中的cached_token_ratio。
+    """
+
+    def __init__(self):
+        self._last_prefix: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, prefix_hash: str) -> bool:
+        """记录一次构建，返回其前缀是否与该模型上一次构建的前缀一致"""
+        with self._lock:
+            hit = self._last_prefix.get(model) == prefix_hash
+            self._last_prefix[model] = prefix_hash
+        return hit
+
+
+prefix_tracker = PrefixTracker()
+
+
+class PromptBuilder:
+    """把提示词拆分为稳定的系统前缀（游戏规则 + 玩家身份）和每次变化的用户消息
+
+    系统前缀对同一玩家只生成一次，保证每次请求字节级一致，后端才能复用前缀的KV缓存。
+    """
+
+    def __init__(self, prefix_template: str, rules: str, self_name: str):
+        self.self_name = self_name
+        self.system_prefix = prefix_template.format(rules=rules, self_name=self_name)
+        self.prefix_hash = hashlib.sha256(self.system_prefix.encode("utf-8")).hexdigest()
+        self._lock = threading.Lock()  # 同一玩家的多个请求可能并发构建
+        self.stats = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        """重置前缀命中统计"""
+        with self._lock:
+            self.stats = {"requests": 0, "estimated_prefix_hits": 0, "prefix_chars": 0, "total_chars": 0}
+
+    def build(self, template: str, model: str, **template_vars) -> List[Dict]:
+        """填充模板并返回消息列表，同时按构建时的口径估计前缀命中情况"""
+        suffix = template.format(self_name=self.self_name, **template_vars)
+        hit = prefix_tracker.record(model, self.prefix_hash)
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["estimated_prefix_hits"] += int(hit)
+            self.stats["prefix_chars"] += len(self.system_prefix)
+            self.stats["total_chars"] += len(self.system_prefix) + len(suffix)
+        return [
+            {"role": "system", "content": self.system_prefix},
+            {"role": "user", "content": suffix}
+        ]
+
+
+def summarize_prefix_stats(stats_list: List[Dict], records: Iterable[Dict] = ()) -> Dict:
+    """汇总多个PromptBuilder的统计和本局的调用计量
+
+    estimated_prefix_hit_ratio是构建提示词时的估计；cached_token_ratio是后端在usage中报告的
+    提示词缓存命中token数（prompt_tokens_details.cached_tokens）占提示词token数的比例，
+    只统计真正发出且报告了该字段的调用，后端不报告时为None。prefix_share是前缀在提示词中的占比。
+    """
+    total = {"requests": 0, "estimated_prefix_hits": 0, "prefix_chars": 0, "total_chars": 0}
+    for stats in stats_list:
+        for key in total:
+            total[key] += stats.get(key, 0)
+    total["estimated_prefix_hit_ratio"] = total["estimated_prefix_hits"] / total["requests"] \
+        if total["requests"] else 0.0
+    total["prefix_share"] = total["prefix_chars"] / total["total_chars"] if total["total_chars"] else 0.0
+    reported = [record for record in records
+                if record.get("cached_tokens") is not None and record.get("prompt_tokens")
+                and not record.get("cache_hit") and not record.get("error")]
+    total["reported_calls"] = len(reported)
+    total["cached_tokens"] = sum(record["cached_tokens"] for record in reported)
+    prompt_tokens = sum(record["prompt_tokens"] for record in reported)
+    total["cached_token_ratio"] = total["cached_tokens"] / prompt_tokens if reported else None
+    return total
@@ -0,0 +1,142 @@
+import argparse
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from game import UndercoverGame
+from game_analysis import read_json_from_file
+from llm_cache import ReplayClient
+from memory import token_counter
+from player import AIPlayer
+import player_configs
+from result_store import iter_results
+
+
+def load_game_result(path: str, game_uid: Optional[str] = None) -> Optional[Dict]:
+    """从结果存储（.jsonl）中按对局ID取出一局，未指定ID时取最后一局；也接受旧版本的单局结果文件"""
+    if not path.endswith(".jsonl"):
+        return read_json_from_file(path)
+    found = None
+    for result in iter_results(path):
+        if game_uid is None:
+            found = result
+        elif result.get("game_uid") == game_uid:
+            return result
+    if found is None:
+        print(f"警告: {path} 中没有对局 {game_uid}")
+    return found
+
+
+def build_replay_players(game_result: Dict, strict: bool = True) -> Dict[int, AIPlayer]:
+    """根据对局结果中的玩家信息和记录的模型输出重建玩家，恢复开局时的记忆"""
+    recorded = game_result.get("llm_calls")
+    if recorded is None:
+        raise ValueError("结果文件中没有记录模型输出（llm_calls），无法回放；请在 [replay] 中设置 record = true 后重新运行对局")
+    player_map: Dict[int, AIPlayer] = {}
+    for info in game_result["players"]:
+        player_map[info["player_id"]] = AIPlayer(
+            player_id=info["player_id"],
+            name=info["name"],
+            word="",
+            role="平民",
+            model=info["model"],
+            local=info["local"],
+            llm_client=ReplayClient(recorded.get(info["name"], []), strict=strict)
+        )
+        if "reflection" in info:
+            # 使用原对局的反思方式，而不是当前配置
+            player_map[info["player_id"]].reflection_mode = info["reflection"]
+    for pid, player in player_map.items():
+        player.player_map = player_map
+        player.load_memory(game_result["initial_memory"][str(pid)])
+    return player_map
+
+
+@contextmanager
+def recorded_memory_settings(game_result: Dict):
+    """在with块内使用原对局的记忆配置和token计数校准系数，结束时恢复本进程原来的设置
+
+    记忆压缩按token预算和token数决策，配置不同会生成不同的提示词，回放时找不到记录的输出；
+    对局结束时的校准也会修改token_counter，不恢复会影响同一进程中之后的对局。
+    没有记录记忆配置的旧结果沿用当前配置。
+    """
+    saved_config = player_configs.memory_config
+    saved_scale = token_counter.scale
+    try:
+        if "memory_config" in game_result:
+            player_configs.memory_config = {**saved_config, **game_result["memory_config"]}
+        token_counter.scale = dict(game_result.get("token_scale", {}))
+        yield
+    finally:
+        player_configs.memory_config = saved_config
+        token_counter.scale = saved_scale
+
+
+def replay_game(game_result: Dict, strict: bool = True, verbose: bool = False,
+                game_id: Optional[int] = None) -> UndercoverGame:
+    """不访问任何后端地重新运行一局，返回回放后的对局
+
+    使用结果中保存的种子，词语、卧底、发言顺序和PK平票与原对局一致；模型输出来自结果中的记录。
+    """
+    # 记忆压缩按token预算和token数决策，使用原对局的记忆配置和校准系数
+    with recorded_memory_settings(game_result):
+        player_map = build_replay_players(game_result, strict=strict)
+        # 并行描述与逐个调用的输出相同，回放时不使用调度器，只需区分是否能看到本轮之前的描述
+        game = UndercoverGame(player_map=player_map, game_id=game_id or 1, seed=game_result["seed"],
+                              verbose=verbose, description_mode=game_result.get("description_mode", "sequential"))
+        words = game_result.get("words", {})
+        if words and (game.civilian_word, game.undercover_word) != (words["civilian"], words["undercover"]):
+            # gamewords.json被修改过，种子不再对应原来的词语，按记录恢复
+            game.civilian_word, game.undercover_word = words["civilian"], words["undercover"]
+            for player in player_map.values():
+                player.word = game.undercover_word if player.role == "卧底" else game.civilian_word
+        game.start_game(save=False)
+    return game
+
+
+def diff_results(original: Dict, replayed: Dict) -> List[str]:
+    """比较两局的对局记录和胜负，返回差异描述，为空表示完全一致"""
+    differences = []
+    for key in ("winners", "role"):
+        if original.get(key) != replayed.get(key):
+            differences.append(f"{key}: {original.get(key)} != {replayed.get(key)}")
+    original_events = [event["event"] for event in original.get("game_history", [])]
+    replayed_events = [event["event"] for event in replayed.get("game_history", [])]
+    for index, (a, b) in enumerate(zip(original_events, replayed_events)):
+        if a != b:
+            differences.append(f"第 {index} 条事件不同:\n  原始: {a}\n  回放: {b}")
+            break
+    if len(original_events) != len(replayed_events):
+        differences.append(f"事件数量不同: {len(original_events)} != {len(replayed_events)}")
+    return differences
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="从结果文件回放对局（不访问LLM后端）")
+    parser.add_argument("result_file", help="结果存储（games.jsonl）或旧版本的 result_*.json 结果文件")
+    parser.add_argument("--game-uid", default=None, help="要回放的对局ID，默认为结果存储中的最后一局")
+    parser.add_argument("--lenient", action="store_true", help="提示词变化时按调用顺序取用记录，而不是报错")
+    parser.add_argument("--verbose", action="store_true", help="打印对局过程")
+    parser.add_argument("--bench", type=int, default=0, help="重复回放的次数，用于测量引擎本身的吞吐")
+    args = parser.parse_args()
+
+    result = load_game_result(args.result_file, args.game_uid)
+    if result is None:
+        raise SystemExit(1)
+    replayed = replay_game(result, strict=not args.lenient, verbose=args.verbose)
+    differences = diff_results(result, replayed.full_result())
+    mismatches = sum(player.llm_client.mismatches for player in replayed.player_map.values())
+    if differences:
+        print("回放结果与原对局不一致:")
+        print("\n".join(differences))
+    else:
+        print("回放结果与原对局一致")
+    if mismatches:
+        print(f"有 {mismatches} 次调用的提示词与记录不同，按顺序使用了记录的输出")
+
+    if args.bench:
+        start = time.perf_counter()
+        for i in range(args.bench):
+            replay_game(result, strict=not args.lenient, game_id=i + 1)
+        elapsed = time.perf_counter() - start
+        print(f"回放 {args.bench} 局，耗时 {elapsed:.2f}s，{args.bench / elapsed:.1f} 局/秒")
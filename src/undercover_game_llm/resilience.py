@@ -0,0 +1,292 @@
+import contextvars
+import json
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Optional
+
+from llm_client import LLMCallError, LLMClient, ReasoningTruncatedError, llm_logger
+from metrics import note
+
+
+class CircuitOpenError(LLMCallError):
+    """模型的熔断器处于打开状态，请求未发出"""
+
+
+class DeadlineExceededError(LLMCallError):
+    """单次调用（含重试）超过了截止时间"""
+
+
+class RetryBudget:
+    """重试预算：每次成功调用存入ratio个令牌，每次重试消耗一个令牌
+
+    后端大面积故障时重试会迅速耗尽预算，避免重试风暴进一步压垮后端。
+    """
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """单个模型的熔断器
+
+    连续失败failure_threshold次后打开，打开期间直接拒绝请求；
+    经过reset_timeout秒后进入半开状态，只放行一个试探请求，成功则关闭，失败则重新打开。
+    只有说明后端不健康的错误（可重试的错误、5xx和超时）计为失败，见 counts_as_failure。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """当前是否允许发出请求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def release(self):
+        """请求以不反映后端健康状况的错误结束（如请求本身有误）：不计入失败，只归还半开状态的试探名额"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+def counts_as_failure(error: LLMCallError) -> bool:
+    """错误是否说明后端不健康，应计入熔断器
+
+    可重试的错误（连接失败、429、5xx等）、5xx和超时计入；4xx等请求本身的错误（如不支持的response_format）
+    和思考超出上限（ReasoningTruncatedError）说明后端能正常响应，不计入，以免错误的请求让健康的后端熔断。
+    """
+    if isinstance(error, ReasoningTruncatedError):
+        return False
+    if isinstance(error, DeadlineExceededError) or error.retryable:
+        return True
+    return error.status_code is not None and error.status_code >= 500
+
+
+class ResilientClient(LLMClient):
+    """为LLMClient增加截止时间、指数退避重试、重试预算和按模型熔断的包装
+
+    每次最终失败都会以结构化记录的形式写入日志并通知on_failure回调，然后抛出LLMCallError，
+    由调用方决定如何处理（而不是返回空字符串让调用方误当作模型输出）。
+    """
+
+    def __init__(self, client: LLMClient, max_attempts: int = 3, base_delay: float = 1.0,
+                 max_delay: float = 20.0, deadline: Optional[float] = 600.0,
+                 retry_budget: Optional[RetryBudget] = None, failure_threshold: int = 5,
+                 reset_timeout: float = 60.0):
+        """初始化
+
+        Args:
+            client: 被包装的客户端
+            max_attempts: 单次调用的最大尝试次数（含第一次）
+            base_delay: 退避的基础等待秒数，第n次重试最多等待 base_delay * 2^n 秒（全抖动）
+            max_delay: 单次退避的最大等待秒数
+            deadline: 单次调用（含所有重试）的截止秒数，None表示不限制
+            retry_budget: 重试预算，默认每次成功存入0.2次重试
+            failure_threshold: 熔断器打开前允许的连续失败次数
+            reset_timeout: 熔断器打开后多久进入半开状态
+        """
+        self.client = client
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_budget = retry_budget or RetryBudget()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failure_counts: Counter = Counter()  # {(模型, 错误类型): 次数}
+        self.on_failure: List[Callable[[Dict], None]] = []
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self.abandoned = 0  # 超过截止时间后被放弃、仍在等待后端返回的请求数
+
+    @property
+    def backend(self):
+        return self.client.backend
+
+    def warm_up(self, model):
+        self.client.warm_up(model)
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            if model not in self._breakers:
+                self._breakers[model] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self._breakers[model]
+
+    def chat(self, messages, model, **options):
+        breaker = self.breaker(model)
+        if not breaker.allow():
+            error = CircuitOpenError(f"{model} 熔断中，跳过请求", model=model, backend=self.backend,
+                                     retryable=False)
+            self._report(model, error, attempts=0)
+            raise error
+
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = self._attempt(messages, model, options, start)
+            except LLMCallError as e:
+                if counts_as_failure(e):
+                    breaker.record_failure()
+                else:
+                    breaker.release()
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                if not self._should_retry(e, attempt, start, delay):
+                    self._report(model, e, attempts=attempt)
+                    raise
+                time.sleep(delay)
+                if not breaker.allow():
+                    error = CircuitOpenError(f"{model} 熔断中，停止重试", model=model, backend=self.backend,
+                                             retryable=False)
+                    self._report(model, error, attempts=attempt)
+                    raise error from e
+                continue
+            breaker.record_success()
+            self.retry_budget.deposit()
+            if attempt > 1:
+                note(attempts=attempt)
+            return result
+
+    def _attempt(self, messages, model, options, start):
+        """执行一次请求，超过截止时间时抛出DeadlineExceededError
+
+        请求在为本次调用单独启动的线程中执行，调用方在自己的线程上等待截止时间。不使用共享的线程池：
+        线程池的大小会在调度器、路由和请求合并的配置之外另行限制在途请求数和合并的批量大小，
+        被放弃的请求也会一直占着池中的线程。被放弃的请求只占用自己的线程，由连接池超时兜底结束。
+        """
+        if self.deadline is None:
+            return self.client.chat(messages, model, **options)
+        remaining = self.deadline - (time.monotonic() - start)
+        if remaining <= 0:
+            raise DeadlineExceededError(f"{model} 调用超过 {self.deadline} 秒", model=model,
+                                        backend=self.backend, retryable=False)
+        future: Future = Future()
+        abandoned = threading.Event()
+
+        def run():
+            try:
+                future.set_result(self.client.chat(messages, model, **options))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                if abandoned.is_set():
+                    with self._lock:
+                        self.abandoned -= 1
+
+        # 在辅助线程中沿用调用方的上下文，使计量信息能写回当前调用
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(run,), name="llm-deadline", daemon=True).start()
+        try:
+            return future.result(timeout=remaining)
+        except FutureTimeoutError:
+            with self._lock:
+                # 与run的finally互斥：请求恰好在此时结束时不再计为被放弃
+                if not future.done():
+                    abandoned.set()
+                    self.abandoned += 1
+            if future.done() and not abandoned.is_set():
+                return future.result()
+            raise DeadlineExceededError(f"{model} 调用超过 {self.deadline} 秒", model=model,
+                                        backend=self.backend, retryable=False)
+
+    def _should_retry(self, error: LLMCallError, attempt: int, start: float, delay: float) -> bool:
+        if not error.retryable or attempt >= self.max_attempts:
+            return False
+        if self.deadline is not None and time.monotonic() - start + delay >= self.deadline:
+            return False
+        return self.retry_budget.try_withdraw()
+
+    def _report(self, model: str, error: LLMCallError, attempts: int):
+        """记录一次最终失败"""
+        record = {
+            "event": "llm_failure",
+            "time": time.time(),
+            "backend": self.backend,
+            "model": model,
+            "error_type": type(error).__name__,
+            "status_code": error.status_code,
+            "retryable": error.retryable,
+            "attempts": attempts,
+            "breaker_state": self.breaker(model).state,
+            "message": str(error)[:500]
+        }
+        with self._lock:
+            self.failure_counts[(model, record["error_type"])] += 1
+        llm_logger.error(json.dumps(record, ensure_ascii=False))
+        for callback in self.on_failure:
+            callback(record)
+
+
+_resilient_clients: Dict[int, ResilientClient] = {}
+_resilient_lock = threading.Lock()
+
+
+def wrap_with_resilience(client: LLMClient, config: Dict) -> LLMClient:
+    """根据配置为客户端加上重试和熔断，同一个底层客户端只包装一次，以共享熔断器和重试预算"""
+    if not config.get("enabled", True):
+        return client
+    with _resilient_lock:
+        wrapped = _resilient_clients.get(id(client))
+        if wrapped is None:
+            wrapped = ResilientClient(
+                client,
+                max_attempts=config.get("max_attempts", 3),
+                base_delay=config.get("base_delay", 1.0),
+                max_delay=config.get("max_delay", 20.0),
+                deadline=config.get("deadline", 600.0) or None,
+                retry_budget=RetryBudget(config.get("retry_budget_ratio", 0.2),
+                                         config.get("retry_budget_max", 10.0)),
+                failure_threshold=config.get("breaker_failure_threshold", 5),
+                reset_timeout=config.get("breaker_reset_timeout", 60.0)
+            )
+            _resilient_clients[id(client)] = wrapped
+        return wrapped
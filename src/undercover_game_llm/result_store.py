@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Iterator, Optional, Tuple
+
+from event_store import EventStore
+from runtime import project_path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def new_game_uid() -> str:
+    """全局唯一的对局ID，并发进程之间也不会重复"""
+    return uuid.uuid4().hex
+
+
+class _FileLock:
+    """跨进程的文件锁，用于多个进程向同一个结果文件追加"""
+
+    def __init__(self, f):
+        self.f = f
+
+    def __enter__(self):
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        else:
+            self.f.seek(0)
+            msvcrt.locking(self.f.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        else:
+            self.f.seek(0)
+            msvcrt.locking(self.f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class ResultStore:
+    """追加写入的对局结果存储，每行一局（JSONL）
+
+    写入时持有文件锁，一局的全部内容在一次加锁内写完，多进程并发追加不会交错；
+    进程中途崩溃可能留下不完整的最后一行，读取时会被跳过。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """path为None时使用项目根目录下的results/games.jsonl"""
+        path = path or default_store_path()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, result: Dict, events: Optional[EventStore] = None) -> str:
+        """追加一局结果，events不为None时作为game_history逐条流式写出；返回对局ID"""
+        record = dict(result)
+        record.setdefault("game_uid", new_game_uid())
+        record.setdefault("saved_at", time.time())
+        head = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        with self._lock, open(self.path, "a+b") as f, _FileLock(f):
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # 上次写入中途崩溃留下的不完整行，先结束它，避免和本局拼在同一行
+                    f.write(b"\n")
+            if events is None:
+                f.write((head + "\n").encode("utf-8"))
+            else:
+                f.write((head[:-1] + ',"game_history":[').encode("utf-8"))
+                separator = ""
+                for event in events:
+                    line = json.dumps(event.to_dict(), ensure_ascii=False, separators=(",", ":"))
+                    f.write((separator + line).encode("utf-8"))
+                    separator = ","
+                f.write(b"]}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return record["game_uid"]
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter_results(self.path)
+
+
+def default_store_path() -> str:
+    """默认的结果存储文件：项目根目录下的results/games.jsonl，与从哪个目录启动无关"""
+    return project_path("results", "games.jsonl")
+
+
+def iter_results(path: Optional[str] = None) -> Iterator[Dict]:
+    """逐局读取结果存储，不会一次性把整个文件读入内存"""
+    path = path or default_store_path()
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # 写入中途崩溃留下的不完整行
+                continue
+
+
+def iter_new_results(path: str, offset: int = 0) -> Iterator[Tuple[Dict, int]]:
+    """从文件偏移offset开始读取新追加的对局，逐局返回 (结果, 该行之后的偏移)
+
+    只返回以换行结尾的完整行，正在写入的最后一行留到下次读取。
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            try:
+                yield json.loads(line), offset
+            except json.JSONDecodeError:
+                continue
+
+
+_stores: Dict[str, ResultStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_result_store(path: Optional[str] = None) -> ResultStore:
+    """获取进程内共享的结果存储"""
+    path = path or default_store_path()
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = ResultStore(path)
+        return _stores[path]
+
+
+def import_legacy_results(result_dir: Optional[str] = None, store: Optional[ResultStore] = None) -> int:
+    """把旧版本每局一个的 result_*.json 文件导入结果存储，返回导入的局数
+
+    result_dir默认为项目根目录下的results。已导入过的文件（按legacy_file记录）会被跳过，可以重复运行。原文件不会被删除。
+    """
+    result_dir = result_dir or project_path("results")
+    store = store or get_result_store()
+    imported = {result.get("legacy_file") for result in iter_results(store.path)}
+    count = 0
+    for file_name in sorted(os.listdir(result_dir)) if os.path.isdir(result_dir) else []:
+        if not (file_name.startswith("result_") and file_name.endswith(".json")):
+            continue
+        if file_name in imported:
+            continue
+        try:
+            with open(os.path.join(result_dir, file_name), "r", encoding="utf-8") as f:
+                result = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"警告: 无法读取文件 {file_name}，错误: {e}")
+            continue
+        result["legacy_file"] = file_name
+        store.append(result)
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对局结果存储工具")
+    parser.add_argument("command", choices=["import", "count"],
+                        help="import: 导入旧的result_*.json文件；count: 统计存储中的局数")
+    parser.add_argument("--results-dir", default=project_path("results"), help="旧结果文件所在目录")
+    parser.add_argument("--store", default=default_store_path(), help="结果存储文件")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        imported_count = import_legacy_results(args.results_dir, ResultStore(args.store))
+        print(f"导入了 {imported_count} 局结果到 {args.store}")
+    else:
+        print(f"{args.store} 中共有 {sum(1 for _ in iter_results(args.store))} 局结果")
@@ -0,0 +1,245 @@
+import threading
+import time
+from typing import Dict, List, Optional
+
+from llm_client import LLMCallError, LLMClient, current_keep_alive, get_llm_client, llm_logger
+from metrics import note
+
+# 负载均衡策略
+STRATEGY_LEAST_OUTSTANDING = "least_outstanding"  # 在途请求最少
+STRATEGY_LATENCY = "latency"  # 在途请求数乘以该模型在该端点的平均耗时
+STRATEGIES = (STRATEGY_LEAST_OUTSTANDING, STRATEGY_LATENCY)
+
+
+class Endpoint:
+    """一台推理服务器及其路由状态"""
+
+    def __init__(self, name: str, client: LLMClient, models: Optional[List[str]] = None):
+        """初始化
+
+        Args:
+            name: 端点名称，写入调用计量
+            client: 访问该服务器的客户端
+            models: 该服务器提供的模型，为空表示提供所有模型
+        """
+        self.name = name
+        self.client = client
+        self.models = set(models or [])
+        self.outstanding = 0  # 在途请求数
+        self.latency_ms: Dict[str, float] = {}  # {模型: 调用耗时的指数平均}
+        self.loaded = set() if client.backend == "ollama" else None  # 已加载的模型，None表示不区分是否加载
+        self.down_until = 0.0  # 被标记为不可用的截止时间
+
+    def serves(self, model: str) -> bool:
+        return not self.models or model in self.models
+
+    def is_loaded(self, model: str) -> bool:
+        return self.loaded is None or model in self.loaded
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.down_until
+
+
+class EndpointRouter(LLMClient):
+    """把请求分散到多台推理服务器的客户端
+
+    每次调用在提供该模型的可用端点中选择负载最低的一个：least_outstanding按在途请求数，
+    latency按在途请求数乘以该模型在该端点的平均耗时（没有记录的端点按已知的最快耗时估计，使其能被试用）。
+    尚未加载该模型的端点额外计入cold_penalty个在途请求，优先使用已加载模型的端点，负载差距足够大时才去加载。
+    调用出现可重试的错误时端点在failure_cooldown秒内不再被选择，外层的重试会落到其他端点；
+    所有端点都不可用时选择最早恢复的端点。health_interval大于0时后台定期检查各端点并同步已加载的模型。
+    端点支持批量调用时路由也支持：请求合并（见coalescer）得到的一批请求整体发往一个端点，按批量大小计入在途请求。
+    """
+
+    def __init__(self, endpoints: List[Endpoint], strategy: str = STRATEGY_LEAST_OUTSTANDING,
+                 failure_cooldown: float = 15.0, cold_penalty: float = 2.0, smoothing: float = 0.3):
+        if not endpoints:
+            raise ValueError("路由至少需要一个端点")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"未知的负载均衡策略: {strategy}")
+        backends = {endpoint.client.backend for endpoint in endpoints}
+        if len(backends) > 1:
+            raise ValueError(f"同一个路由中的端点必须使用同一种后端: {backends}")
+        self.endpoints = endpoints
+        self.strategy = strategy
+        self.failure_cooldown = failure_cooldown
+        self.cold_penalty = cold_penalty
+        self.smoothing = smoothing
+        self.logger = llm_logger
+        self._lock = threading.Lock()
+        self._health_thread: Optional[threading.Thread] = None
+
+    @property
+    def backend(self):
+        return self.endpoints[0].client.backend
+
+    @property
+    def supports_batch(self):
+        return all(endpoint.client.supports_batch for endpoint in self.endpoints)
+
+    def serves(self, model: str) -> bool:
+        return any(endpoint.serves(model) for endpoint in self.endpoints)
+
+    def _score(self, endpoint: Endpoint, model: str) -> float:
+        load = endpoint.outstanding + (0 if endpoint.is_loaded(model) else self.cold_penalty)
+        if self.strategy == STRATEGY_LEAST_OUTSTANDING:
+            return load
+        known = [e.latency_ms[model] for e in self.endpoints if model in e.latency_ms]
+        latency = endpoint.latency_ms.get(model, min(known, default=1.0))
+        return (load + 1) * latency
+
+    def _choose(self, model: str, count: int = 1) -> Endpoint:
+        """选择端点并计入count个在途请求（调用方需持有锁）"""
+        candidates = [endpoint for endpoint in self.endpoints if endpoint.serves(model)]
+        if not candidates:
+            raise LLMCallError(f"没有端点提供模型 {model}", model=model, backend=self.backend, retryable=False)
+        now = time.monotonic()
+        healthy = [endpoint for endpoint in candidates if endpoint.healthy(now)]
+        if healthy:
+            endpoint = min(healthy, key=lambda e: self._score(e, model))
+        else:
+            endpoint = min(candidates, key=lambda e: e.down_until)
+        endpoint.outstanding += count
+        return endpoint
+
+    def chat(self, messages, model, schema=None, stop_on=None):
+        def call(endpoint: Endpoint):
+            note(endpoint=endpoint.name)
+            return endpoint.client.chat(messages, model, schema=schema, stop_on=stop_on)
+        return self._dispatch(model, call)
+
+    def batch_chat(self, conversations, model, schema=None, stop_on=None, **options):
+        def call(endpoint: Endpoint):
+            results = endpoint.client.batch_chat(conversations, model, schema=schema, stop_on=stop_on, **options)
+            # 各调用方用自己那一项的计量字段记录本次调用，端点也随之记录
+            return [(content, reasoning_content, {**stats, "endpoint": endpoint.name})
+                    for content, reasoning_content, stats in results]
+        return self._dispatch(model, call, count=len(conversations))
+
+    def _dispatch(self, model: str, call, count: int = 1):
+        """选择端点执行call(端点)，维护在途请求数、端点可用状态、平均耗时和已加载的模型"""
+        with self._lock:
+            endpoint = self._choose(model, count)
+        start = time.perf_counter()
+        try:
+            result = call(endpoint)
+        except LLMCallError as e:
+            if e.retryable:
+                with self._lock:
+                    endpoint.down_until = time.monotonic() + self.failure_cooldown
+                self.logger.warning(f"端点 {endpoint.name} 调用失败，{self.failure_cooldown}秒内不再使用: {str(e)}")
+            raise
+        finally:
+            # 无论调用如何结束（包括未包装为LLMCallError的异常）都要归还在途请求
+            with self._lock:
+                endpoint.outstanding -= count
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            previous = endpoint.latency_ms.get(model)
+            endpoint.latency_ms[model] = elapsed_ms if previous is None else \
+                previous + self.smoothing * (elapsed_ms - previous)
+            if endpoint.loaded is not None:
+                if current_keep_alive() == 0:
+                    endpoint.loaded.discard(model)  # 调度器要求调用后立即卸载
+                else:
+                    endpoint.loaded.add(model)
+        return result
+
+    def warm_up(self, model):
+        """在所有提供该模型的端点上确认模型可用，不可用的端点被标记后跳过"""
+        for endpoint in self.endpoints:
+            if not endpoint.serves(model):
+                continue
+            try:
+                endpoint.client.warm_up(model)
+            except Exception as e:
+                self.logger.warning(f"端点 {endpoint.name} 预热 {model} 失败: {str(e)}")
+                with self._lock:
+                    endpoint.down_until = time.monotonic() + self.failure_cooldown
+                continue
+            with self._lock:
+                if endpoint.loaded is not None:
+                    endpoint.loaded.add(model)
+
+    def check_health(self):
+        """检查所有端点：不可用的端点标记为failure_cooldown秒内不选择，可用的端点恢复并同步已加载的模型"""
+        for endpoint in self.endpoints:
+            try:
+                loaded = endpoint.client.loaded_models()
+            except Exception as e:
+                self.logger.warning(f"端点 {endpoint.name} 健康检查失败: {str(e)}")
+                with self._lock:
+                    endpoint.down_until = time.monotonic() + self.failure_cooldown
+                continue
+            with self._lock:
+                endpoint.down_until = 0.0
+                if loaded is not None:
+                    endpoint.loaded = set(loaded)
+
+    def start_health_checks(self, interval: float):
+        """启动后台健康检查线程，每interval秒检查一次"""
+        if self._health_thread is not None:
+            return
+
+        def loop():
+            while True:
+                try:
+                    self.check_health()
+                except Exception as e:
+                    # 任何异常都不能让检查线程退出，否则端点恢复后也不会再被标记为可用
+                    self.logger.warning(f"端点健康检查出错: {str(e)}")
+                time.sleep(interval)
+        self._health_thread = threading.Thread(target=loop, name="llm-health", daemon=True)
+        self._health_thread.start()
+
+    def stats(self) -> Dict[str, Dict]:
+        """各端点的在途请求数、是否可用和已加载的模型"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                endpoint.name: {
+                    "outstanding": endpoint.outstanding,
+                    "healthy": endpoint.healthy(now),
+                    "loaded": sorted(endpoint.loaded) if endpoint.loaded is not None else None
+                }
+                for endpoint in self.endpoints
+            }
+
+
+_routers: Dict[tuple, Optional[EndpointRouter]] = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(config: Dict, local: bool, pool_config=None, **options) -> Optional[EndpointRouter]:
+    """根据 [llm.router] 配置获取进程内共享的路由，未启用或没有该类后端的端点时返回None
+
+    Args:
+        config: 路由配置
+        local: True为Ollama端点，False为OpenAI兼容端点
+        pool_config: 连接池配置，每个端点各自使用一个连接池
+        options: 传给客户端构造函数的其它选项
+    """
+    if not config.get("enabled", False):
+        return None
+    key = (local, tuple(sorted((pool_config or {}).items())), tuple(sorted(options.items())))
+    with _routers_lock:
+        if key in _routers:
+            return _routers[key]
+        endpoints = [
+            Endpoint(item.get("name", item["host"]),
+                     get_llm_client(local, host=item["host"], pool_config=pool_config, **options),
+                     item.get("models"))
+            for item in config.get("endpoints", []) if item.get("local", True) == local
+        ]
+        router = None
+        if endpoints:
+            router = EndpointRouter(
+                endpoints,
+                strategy=config.get("strategy", STRATEGY_LEAST_OUTSTANDING),
+                failure_cooldown=config.get("failure_cooldown", 15.0),
+                cold_penalty=config.get("cold_penalty", 2.0)
+            )
+            if config.get("health_interval", 0) > 0:
+                router.start_health_checks(config["health_interval"])
+        _routers[key] = router
+        return router
@@ -0,0 +1,106 @@
+import importlib
+import os
+import threading
+from functools import lru_cache
+from typing import Dict, Optional
+
+# 项目根目录的标志文件
+_ROOT_MARKER = os.path.join("conf", "player_config.toml")
+# 配置中按项目根目录解析的路径项：path、以_path结尾的项和directory
+_PATH_KEYS = ("path", "directory")
+
+
+def _find_root(start: str) -> Optional[str]:
+    directory = os.path.abspath(start)
+    while True:
+        if os.path.exists(os.path.join(directory, _ROOT_MARKER)):
+            return directory
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+@lru_cache(maxsize=None)
+def project_root() -> str:
+    """项目根目录（包含conf/player_config.toml的目录）
+
+    依次使用UNDERCOVER_ROOT环境变量、从本文件所在目录向上查找、从当前目录向上查找，都找不到时为当前目录。
+    配置、提示词、.env和日志都相对于项目根目录，与从哪个目录启动无关。
+    """
+    root = os.getenv("UNDERCOVER_ROOT")
+    if root:
+        return os.path.abspath(root)
+    return _find_root(os.path.dirname(__file__)) or _find_root(os.getcwd()) or os.getcwd()
+
+
+def project_path(*parts: str) -> str:
+    """相对路径按项目根目录解析，绝对路径原样返回"""
+    path = os.path.join(*parts)
+    return path if os.path.isabs(path) else os.path.join(project_root(), path)
+
+
+def _resolve_paths(section: Dict):
+    for key, value in section.items():
+        if isinstance(value, dict):
+            _resolve_paths(value)
+        elif isinstance(value, str) and (key in _PATH_KEYS or key.endswith("_path")):
+            section[key] = project_path(value)
+
+
+_config: Optional[Dict] = None
+_config_lock = threading.Lock()
+
+
+def load_config() -> Dict:
+    """项目配置conf/player_config.toml，第一次调用时读取，之后返回同一个字典
+
+    配置中的相对路径（path、*_path、directory）已按项目根目录解析为绝对路径。
+    """
+    global _config
+    with _config_lock:
+        if _config is None:
+            import toml
+            config = toml.load(project_path(_ROOT_MARKER))
+            _resolve_paths(config)
+            _config = config
+        return _config
+
+
+@lru_cache(maxsize=None)
+def load_prompt(file_name: str) -> str:
+    """读取prompts目录下的提示词模板，第一次使用时才读取"""
+    try:
+        with open(project_path("prompts", file_name), "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        print(f"警告: 无法加载提示词模板 {file_name}")
+        return ""
+
+
+_env_loaded = False
+_env_lock = threading.Lock()
+
+
+def env(name: str, default: Optional[str] = None) -> Optional[str]:
+    """读取环境变量，第一次调用时先加载项目根目录下的.env（不覆盖已有的环境变量）"""
+    global _env_loaded
+    with _env_lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv(project_path(".env"))
+            _env_loaded = True
+    return os.getenv(name, default)
+
+
+class LazyModule:
+    """第一次访问属性时才导入的模块，用于只在实际使用某个后端时才加载其SDK"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
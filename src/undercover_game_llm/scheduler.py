@@ -0,0 +1,246 @@
+import contextvars
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from llm_client import LLMClient, keep_alive_hint
+
+
+class ModelResidency:
+    """本地后端的模型驻留管理
+
+    本地后端同时能加载的模型有限，换用未加载的模型需要先卸载别的模型再加载（数秒到数十秒）。
+    同一时刻最多允许max_resident个模型有在途调用：已驻留模型的调用直接执行；
+    未驻留的模型在有空位、或有已驻留模型空闲（没有在途和等待中的调用）时才能载入，空闲模型按最久未用淘汰。
+    多个未驻留模型同时等待时，先载入等待调用最多的模型，使同一模型的调用集中执行，减少来回切换。
+
+    每次调用带上keep_alive提示：模型会继续被使用时保留keep_alive时长；
+    模型没有其他待执行的调用而别的模型正在等待空位时为0，调用结束后后端立即卸载它，为下一个模型腾出内存。
+    """
+
+    def __init__(self, max_resident: int = 1, keep_alive: Optional[str] = "30m"):
+        """初始化
+
+        Args:
+            max_resident: 同时驻留的模型数上限，应与后端的内存能容纳的模型数一致
+            keep_alive: 模型仍会被使用时的保留时长，None表示使用后端的默认值
+        """
+        self.max_resident = max(1, max_resident)
+        self.keep_alive = keep_alive
+        self._cond = threading.Condition()
+        self._resident: "OrderedDict[str, int]" = OrderedDict()  # {模型: 在途调用数}，按最近使用排序
+        self._waiting: Dict[str, int] = {}  # {模型: 等待中的调用数}
+        self.loads = 0  # 载入模型的次数
+        self.evictions = 0  # 为载入其他模型而淘汰的次数，即模型切换次数
+
+    def _idle(self, model: str) -> bool:
+        return self._resident[model] == 0 and not self._waiting.get(model)
+
+    def _next_model(self) -> Optional[str]:
+        """等待中调用最多的未驻留模型，数量相同时取先开始等待的"""
+        candidates = [model for model in self._waiting if model not in self._resident]
+        return max(candidates, key=lambda model: self._waiting[model], default=None)
+
+    def _admissible(self, model: str) -> bool:
+        if model in self._resident:
+            return True
+        if model != self._next_model():
+            return False
+        return len(self._resident) < self.max_resident or any(self._idle(m) for m in self._resident)
+
+    def acquire(self, model: str):
+        """等待model可以执行，返回本次调用的keep_alive提示"""
+        with self._cond:
+            self._waiting[model] = self._waiting.get(model, 0) + 1
+            while not self._admissible(model):
+                self._cond.wait()
+            self._waiting[model] -= 1
+            if not self._waiting[model]:
+                del self._waiting[model]
+            if model not in self._resident:
+                if len(self._resident) >= self.max_resident:
+                    evicted = next(m for m in self._resident if self._idle(m))
+                    del self._resident[evicted]
+                    self.evictions += 1
+                self._resident[model] = 0
+                self.loads += 1
+            self._resident[model] += 1
+            self._resident.move_to_end(model)
+            self._cond.notify_all()  # 等待中的调用最多的模型可能已经变化
+            if model not in self._waiting and self._next_model() is not None:
+                return 0
+            return self.keep_alive
+
+    def release(self, model: str):
+        with self._cond:
+            self._resident[model] -= 1
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {"loads": self.loads, "swaps": self.evictions}
+
+
+class LLMScheduler:
+    """有界的LLM调用调度器
+
+    使用线程池并发执行LLM调用，并通过信号量同时限制全局和每个后端的在途请求数。
+    提交的任务在真正调用LLM前先获取后端槽位，再获取全局槽位，避免等待某个已满后端的任务占住全局槽位。
+    对启用了模型驻留管理的后端，提交时注明模型的任务在获取槽位之前还要等待模型可以驻留（见ModelResidency）。
+    """
+
+    def __init__(self, max_inflight: int = 8, backend_limits: Optional[Dict[str, int]] = None,
+                 max_workers: Optional[int] = None, residency: Optional[Dict[str, ModelResidency]] = None):
+        """初始化调度器
+
+        Args:
+            max_inflight: 全局最大在途请求数
+            backend_limits: 每个后端的最大在途请求数，如 {"ollama": 2, "openai": 8}
+            max_workers: 线程池大小，默认为全局限制与各后端限制之和；启用模型驻留管理时至少为64，
+                使等待载入的任务都能进入线程池参与按模型的分组
+            residency: 每个后端的模型驻留管理，如 {"ollama": ModelResidency(2)}
+        """
+        self.max_inflight = max_inflight
+        self.backend_limits = dict(backend_limits or {})
+        self.residency = dict(residency or {})
+        self._global_slots = threading.BoundedSemaphore(max_inflight)
+        self._backend_slots = {
+            backend: threading.BoundedSemaphore(limit)
+            for backend, limit in self.backend_limits.items()
+        }
+        if max_workers is None:
+            max_workers = max_inflight + sum(self.backend_limits.values())
+            if self.residency:
+                max_workers = max(max_workers, 64)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+
+    @classmethod
+    def from_config(cls, config: Dict) -> Optional["LLMScheduler"]:
+        """根据配置创建调度器，未启用时返回None（即串行执行）"""
+        if not config.get("enabled", False):
+            return None
+        residency_config = config.get("residency", {})
+        residency = None
+        if residency_config.get("enabled", False):
+            residency = {
+                backend: ModelResidency(residency_config.get("max_resident_models", 1),
+                                        residency_config.get("keep_alive", "30m"))
+                for backend in residency_config.get("backends", ["ollama"])
+            }
+        return cls(
+            max_inflight=config.get("max_inflight", 8),
+            backend_limits=config.get("backend_limits"),
+            max_workers=config.get("max_workers"),
+            residency=residency,
+        )
+
+    @contextmanager
+    def slot(self, backend: Optional[str] = None, model: Optional[str] = None):
+        """占用一个在途请求槽位，返回本次调用的keep_alive提示（不管理驻留时为None）"""
+        residency = self.residency.get(backend) if model else None
+        keep_alive = residency.acquire(model) if residency is not None else None
+        backend_slot = self._backend_slots.get(backend)
+        try:
+            if backend_slot is not None:
+                backend_slot.acquire()
+            try:
+                with self._global_slots:
+                    yield keep_alive
+            finally:
+                if backend_slot is not None:
+                    backend_slot.release()
+        finally:
+            if residency is not None:
+                residency.release(model)
+
+    def submit(self, fn: Callable, *args, backend: Optional[str] = None, model: Optional[str] = None,
+               **kwargs) -> Future:
+        """提交一个任务，任务在获得槽位后执行，并继承提交时的上下文（如调用计量的标签）
+
+        model为任务中调用的模型，后端启用了模型驻留管理时据此排队，并为任务中的调用设置keep_alive提示。
+        """
+        context = contextvars.copy_context()
+
+        def call(keep_alive):
+            if keep_alive is None:
+                return fn(*args, **kwargs)
+            with keep_alive_hint(keep_alive):
+                return fn(*args, **kwargs)
+
+        def run():
+            with self.slot(backend, model) as keep_alive:
+                return context.run(call, keep_alive)
+        return self._executor.submit(run)
+
+    def residency_stats(self) -> Dict[str, int]:
+        """所有后端合计的模型载入和切换次数"""
+        stats = {"loads": 0, "swaps": 0}
+        for residency in self.residency.values():
+            for key, value in residency.stats().items():
+                stats[key] += value
+        return stats
+
+    def submit_after(self, futures: List[Future], fn: Callable, *args,
+                     backend: Optional[str] = None, model: Optional[str] = None, **kwargs) -> Future:
+        """在futures全部完成后再提交fn，返回代表fn执行结果的Future
+
+        不会阻塞任何工作线程等待依赖，依赖完成时由最后一个完成的任务的回调负责提交。
+        """
+        result: Future = Future()
+        remaining = [len(futures)]
+        lock = threading.Lock()
+        context = contextvars.copy_context()  # 回调在其它线程中执行，需沿用调用submit_after时的上下文
+
+        def relay(inner: Future):
+            exc = inner.exception()
+            if exc is not None:
+                result.set_exception(exc)
+            else:
+                result.set_result(inner.result())
+
+        def start():
+            context.run(self.submit, fn, *args, backend=backend, model=model, **kwargs).add_done_callback(relay)
+
+        def on_done(_):
+            with lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                start()
+
+        if not futures:
+            start()
+        for future in futures:
+            future.add_done_callback(on_done)
+        return result
+
+    def shutdown(self, wait: bool = True):
+        """关闭线程池"""
+        self._executor.shutdown(wait=wait)
+
+
+class ThrottledClient(LLMClient):
+    """在每次chat调用前占用一个外部信号量的LLM客户端包装
+
+    用于多进程场景下按后端限制在途请求数，信号量可以是multiprocessing.Manager创建的代理对象。
+    """
+
+    def __init__(self, client: LLMClient, semaphore):
+        self.client = client
+        self.semaphore = semaphore
+
+    @property
+    def backend(self):
+        return self.client.backend
+
+    def warm_up(self, model):
+        self.client.warm_up(model)
+
+    def chat(self, messages, model, **options):
+        self.semaphore.acquire()
+        try:
+            return self.client.chat(messages, model, **options)
+        finally:
+            self.semaphore.release()
@@ -0,0 +1,145 @@
+import json
+from typing import Optional, Tuple
+
+# 提前结束条件
+STOP_ON_JSON = "json"  # 收到第一个完整的JSON对象后结束
+STOP_ON_PARAGRAPH = "paragraph"  # 收到第一段非空文字（遇到换行）后结束
+
+_THINK_OPEN = "<think>"
+_THINK_CLOSE = "</think>"
+
+
+def _partial_tag_length(text: str, tag: str) -> int:
+    """text末尾与tag开头重合的最大长度（不含完整的tag）"""
+    for length in range(min(len(text), len(tag) - 1), 0, -1):
+        if tag.startswith(text[-length:]):
+            return length
+    return 0
+
+
+def _is_json_object(text: str) -> bool:
+    try:
+        return isinstance(json.loads(text), dict)
+    except json.JSONDecodeError:
+        return False
+
+
+class StreamAccumulator:
+    """增量解析流式输出：分离推理内容和正文，并判断是否可以提前结束请求
+
+    推理内容既可能以 <think></think> 标签混在正文中（deepseek-r1、qwen3等），
+    也可能由后端单独下发（OpenAI兼容接口的reasoning_content、Ollama的thinking），两种都支持。
+    流式接口每个增量块大约对应一个token，推理token数按块数估计。
+    """
+
+    def __init__(self, stop_on: Optional[str] = None, max_reasoning_tokens: Optional[int] = None):
+        self.stop_on = stop_on
+        self.max_reasoning_tokens = max_reasoning_tokens
+        self.content = ""
+        self.reasoning = ""
+        self.reasoning_tokens = 0
+        self.reasoning_truncated = False  # 是否因推理token超限而被截断
+        self._pending = ""  # 尚未确定归属的文本（可能是被拆开的标签）
+        self._in_think = False
+        self._done = False
+        # 正文JSON对象的增量括号扫描状态
+        self._scan_pos = 0
+        self._depth = 0
+        self._in_str = False
+        self._escape = False
+        self._json_start = 0
+        self._json_end: Optional[int] = None
+
+    @property
+    def done(self) -> bool:
+        """是否已经可以结束请求"""
+        return self._done
+
+    def feed_reasoning(self, text: str):
+        """接收后端单独下发的推理内容"""
+        if not text:
+            return
+        self.reasoning += text
+        self._count_reasoning_token()
+
+    def feed_content(self, text: str):
+        """接收正文增量，其中可能包含 <think> 标签"""
+        if not text or self._done:
+            return
+        self._pending += text
+        while self._pending:
+            tag = _THINK_CLOSE if self._in_think else _THINK_OPEN
+            index = self._pending.find(tag)
+            if index >= 0:
+                self._emit(self._pending[:index])
+                self._pending = self._pending[index + len(tag):]
+                self._in_think = not self._in_think
+                continue
+            # 末尾可能是被拆开的标签，只保留恰好是标签前缀的尾部
+            keep = _partial_tag_length(self._pending, tag)
+            self._emit(self._pending[:len(self._pending) - keep])
+            self._pending = self._pending[len(self._pending) - keep:]
+            break
+        if self._in_think and text:
+            self._count_reasoning_token()
+        self._check_stop()
+
+    def finish(self) -> Tuple[str, str]:
+        """流结束（或提前结束）时调用，返回 (content, reasoning_content)"""
+        if self._pending and not self._done:
+            self._emit(self._pending)
+        self._pending = ""
+        content = self.content
+        if self._json_end is not None:
+            content = content[:self._json_end]
+        elif self.stop_on == STOP_ON_PARAGRAPH and self._done:
+            content = content.strip().split("\n", 1)[0]
+        return content.strip(), self.reasoning.strip()
+
+    def _emit(self, text: str):
+        if not text:
+            return
+        if self._in_think:
+            self.reasoning += text
+        else:
+            self.content += text
+
+    def _count_reasoning_token(self):
+        self.reasoning_tokens += 1
+        if self.max_reasoning_tokens and self.reasoning_tokens >= self.max_reasoning_tokens and not self.content:
+            self.reasoning_truncated = True
+            self._done = True
+
+    def _check_stop(self):
+        if self.stop_on == STOP_ON_JSON:
+            self._scan_json()
+        elif self.stop_on == STOP_ON_PARAGRAPH:
+            stripped = self.content.lstrip()
+            if stripped and "\n" in stripped:
+                self._done = True
+
+    def _scan_json(self):
+        """增量扫描正文，遇到第一个括号配平且能解析的JSON对象时结束"""
+        text = self.content
+        for i in range(self._scan_pos, len(text)):
+            ch = text[i]
+            if self._in_str:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_str = False
+            elif ch == '"' and self._depth > 0:
+                self._in_str = True
+            elif ch == "{":
+                if self._depth == 0:
+                    self._json_start = i
+                self._depth += 1
+            elif ch == "}" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0 and _is_json_object(text[self._json_start:i + 1]):
+                    self._json_end = i + 1
+                    self._done = True
+                    break
+        self._scan_pos = len(text)
@@ -0,0 +1,209 @@
+import argparse
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from game import UndercoverGame
+from analytics import GameAnalytics
+from game_analysis import (print_game_winners_table, print_player_stats, print_player_win_stats,
+                           print_word_pair_stats)
+from player import warm_up_models
+import player_configs
+from result_store import ResultStore, iter_results
+from runtime import project_path
+from scheduler import LLMScheduler, ThrottledClient
+from transcript import flush_transcripts
+
+
+def _load_chain_checkpoint(checkpoint_path: str) -> Tuple[Dict[int, str], Optional[Dict]]:
+    """读取一条游戏链的检查点，返回 ({已完成的game_id: 对局ID}, 最后一局结束后的玩家记忆)"""
+    done: Dict[int, str] = {}
+    memory = None
+    if not os.path.exists(checkpoint_path):
+        return done, memory
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 进程崩溃时可能留下不完整的最后一行，忽略即可
+                continue
+            done[record["game_id"]] = record["game_uid"]
+            memory = record.get("player_memory")
+    return done, memory
+
+
+def _run_chain(chain_id: int, game_ids: List[int], tournament_dir: str, chained: bool,
+               backend_semaphores: Optional[Dict] = None) -> List[str]:
+    """在工作进程中顺序运行一条游戏链，返回各局的对局ID
+
+    chained为True时，链内后一局沿用前一局的玩家（即保留学到的印象和规则理解），否则每局都是全新玩家。
+    每局结果追加到比赛目录下共享的games.jsonl，之后追加写入检查点，进程崩溃后可从最后完成的一局继续。
+    """
+    store = ResultStore(os.path.join(tournament_dir, "games.jsonl"))
+    checkpoint_path = os.path.join(tournament_dir, f"chain_{chain_id:04d}.jsonl")
+    done, memory = _load_chain_checkpoint(checkpoint_path)
+    scheduler_config = player_configs.scheduler_config
+    scheduler = LLMScheduler.from_config(scheduler_config)
+    parallel_votes = scheduler_config.get("parallel_votes", False)
+    description_mode = scheduler_config.get("description_mode", "sequential")
+
+    game_uids = [done[game_id] for game_id in game_ids if game_id in done]
+    player_map = None
+    warmed_up = not player_configs.llm_config.get("warm_up", False)
+    try:
+        for game_id in game_ids:
+            if game_id in done:
+                continue
+            game = UndercoverGame(player_map=player_map, game_id=game_id, scheduler=scheduler,
+                                  parallel_votes=parallel_votes, description_mode=description_mode)
+            if player_map is None:
+                # 新创建的玩家：套上跨进程的后端限流，并在链式模式下恢复检查点中的记忆
+                for player in game.player_map.values():
+                    semaphore = (backend_semaphores or {}).get(player.llm_client.backend)
+                    if semaphore is not None:
+                        player.llm_client = ThrottledClient(player.llm_client, semaphore)
+                    if chained and memory:
+                        player.load_memory(memory[str(player.player_id)])
+                if not warmed_up:
+                    # 每个工作进程只预热一次，模型由后端常驻
+                    warm_up_models(game.player_map.values())
+                    warmed_up = True
+            game.start_game(save=False)
+            game_uid = game.save_results(store)
+            game.export_metrics(os.path.join(tournament_dir, "metrics.jsonl"))
+            game_uids.append(game_uid)
+
+            record = {"game_id": game_id, "game_uid": game_uid}
+            if chained:
+                record["player_memory"] = {
+                    str(pid): player.export_memory() for pid, player in game.player_map.items()
+                }
+                player_map = game.player_map
+            with open(checkpoint_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    finally:
+        if scheduler:
+            scheduler.shutdown()
+        # 工作进程退出时不会执行atexit，需主动把缓冲的转录写入文件
+        flush_transcripts()
+    return game_uids
+
+
+def _run_chains(chains: List[Tuple[int, List[int]]], tournament_dir: str, chained: bool,
+                backend_semaphores: Optional[Dict] = None) -> Dict[int, Tuple[List[str], Optional[str]]]:
+    """在工作进程中用线程同时运行多条游戏链，返回 {链编号: (对局ID列表, 失败原因或None)}
+
+    同一进程内的对局共用底层客户端，并发的同模型请求可以被合并为批量调用（见coalescer）。
+    """
+    outcomes = {}
+    with ThreadPoolExecutor(max_workers=len(chains), thread_name_prefix="chain") as executor:
+        futures = {
+            executor.submit(_run_chain, chain_id, game_ids, tournament_dir, chained, backend_semaphores): chain_id
+            for chain_id, game_ids in chains
+        }
+        for future in as_completed(futures):
+            try:
+                outcomes[futures[future]] = (future.result(), None)
+            except Exception as e:
+                outcomes[futures[future]] = ([], str(e))
+    return outcomes
+
+
+def plan_chains(num_games: int, chain_length: int) -> List[List[int]]:
+    """把 1..num_games 的游戏编号切分为若干条长度不超过chain_length的游戏链"""
+    game_ids = list(range(1, num_games + 1))
+    return [game_ids[i:i + chain_length] for i in range(0, num_games, chain_length)]
+
+
+def run_tournament(num_games: int, workers: int = 4, mode: str = "independent", chain_length: int = 10,
+                   name: Optional[str] = None, backend_limits: Optional[Dict[str, int]] = None,
+                   chains_per_worker: int = 1) -> List[Dict]:
+    """多进程并发运行一组游戏，返回所有游戏结果
+
+    Args:
+        num_games: 总局数
+        workers: 并发的工作进程数
+        mode: "independent" 每局使用全新玩家；"chained" 同一条链内的游戏沿用玩家的学习状态
+        chain_length: 每条游戏链的局数，也是检查点与任务分配的粒度
+        name: 比赛名称，结果和检查点存放在项目根目录的 results/tournament_<name>/ 下，使用相同名称即可断点续跑
+        backend_limits: 所有进程共享的每后端最大在途请求数，如 {"ollama": 2}
+        chains_per_worker: 每个工作进程同时运行的游戏链数，大于1时同一进程内不同对局的请求可以合并为批量调用
+    """
+    if mode not in ("independent", "chained"):
+        raise ValueError(f"未知的比赛模式: {mode}")
+    name = name or datetime.now().strftime("%Y%m%d_%H%M%S")
+    tournament_dir = project_path("results", f"tournament_{name}")
+    os.makedirs(tournament_dir, exist_ok=True)
+    chains = plan_chains(num_games, chain_length)
+
+    game_uids: List[str] = []
+    with multiprocessing.Manager() as manager:
+        backend_semaphores = {
+            backend: manager.BoundedSemaphore(limit) for backend, limit in (backend_limits or {}).items()
+        }
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            if chains_per_worker > 1:
+                numbered = list(enumerate(chains))
+                groups = [numbered[i:i + chains_per_worker] for i in range(0, len(numbered), chains_per_worker)]
+                futures = {
+                    executor.submit(_run_chains, group, tournament_dir, mode == "chained", backend_semaphores):
+                        [chain_id for chain_id, _ in group]
+                    for group in groups
+                }
+            else:
+                futures = {
+                    executor.submit(_run_chain, chain_id, game_ids, tournament_dir, mode == "chained",
+                                    backend_semaphores): [chain_id]
+                    for chain_id, game_ids in enumerate(chains)
+                }
+            finished = 0
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                    outcomes = result if isinstance(result, dict) else {futures[future][0]: (result, None)}
+                except Exception as e:
+                    outcomes = {chain_id: ([], str(e)) for chain_id in futures[future]}
+                for chain_id, (uids, error) in sorted(outcomes.items()):
+                    finished += 1
+                    game_uids.extend(uids)
+                    if error is None:
+                        print(f"-- 游戏链 {chain_id} 完成（{finished} / {len(chains)}） --")
+                    else:
+                        # 失败的链保留已完成部分的检查点，重新运行同名比赛即可续跑
+                        print(f"警告: 游戏链 {chain_id} 运行失败: {error}")
+
+    # 结果存储中可能还有同名比赛此前运行失败、未写入检查点的对局，只取检查点中记录的
+    wanted = set(game_uids)
+    game_results = [result for result in iter_results(os.path.join(tournament_dir, "games.jsonl"))
+                    if result.get("game_uid") in wanted]
+    return sorted(game_results, key=lambda result: result.get("game_id", 0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多进程并发运行谁是卧底比赛")
+    parser.add_argument("num_games", type=int, help="总局数")
+    parser.add_argument("--workers", type=int, default=4, help="并发的工作进程数")
+    parser.add_argument("--mode", choices=["independent", "chained"], default="independent",
+                        help="independent: 每局独立；chained: 链内沿用玩家学到的印象和规则")
+    parser.add_argument("--chain-length", type=int, default=10, help="每条游戏链的局数")
+    parser.add_argument("--name", help="比赛名称，使用已有名称可在崩溃后续跑")
+    parser.add_argument("--chains-per-worker", type=int, default=1,
+                        help="每个工作进程同时运行的游戏链数，配合 [llm.batch] 可跨对局合并请求")
+    args = parser.parse_args()
+
+    results = run_tournament(
+        args.num_games, workers=args.workers, mode=args.mode, chain_length=args.chain_length,
+        name=args.name, backend_limits=player_configs.scheduler_config.get("backend_limits"),
+        chains_per_worker=args.chains_per_worker
+    )
+    analytics = GameAnalytics()
+    for result in results:
+        analytics.add_result(result)
+    print_game_winners_table(results)
+    print_player_win_stats(analytics)
+    print_player_stats(analytics)
+    print_word_pair_stats(analytics)
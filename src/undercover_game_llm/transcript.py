@@ -0,0 +1,185 @@
+import atexit
+import gzip
+import hashlib
+import io
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from importlib.util import find_spec
+from typing import Dict, Iterator, List, Optional
+
+from runtime import LazyModule, project_path
+
+ZSTD_AVAILABLE = find_spec("zstandard") is not None  # 未安装zstandard时退回gzip
+zstandard = LazyModule("zstandard")  # 第一次写入或读取zstd转录时才导入
+
+
+def prefix_hash(text: str) -> str:
+    """系统前缀的内容哈希，用于在转录中引用"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class TranscriptWriter:
+    """后台线程写入LLM调用转录
+
+    调用方只把记录放进队列，序列化、压缩和磁盘写入都在后台线程中完成。
+    记录按块压缩后追加到文件（每块是一个独立的gzip成员或zstd帧），进程中途退出时已写入的块仍可读取。
+    相同的系统前缀（规则与身份）在每个文件中只保存一次，调用记录中以哈希引用。
+    """
+
+    def __init__(self, directory: str = "log/transcripts", compression: str = "zstd",
+                 flush_interval: float = 2.0, flush_bytes: int = 1024 * 1024, max_queue: int = 10000):
+        """初始化并启动后台写入线程
+
+        Args:
+            directory: 转录文件目录，每个进程写一个文件
+            compression: "zstd"或"gzip"，zstd不可用时自动使用gzip
+            flush_interval: 最多缓冲多少秒后写入一块
+            flush_bytes: 缓冲达到多少字节后写入一块
+            max_queue: 队列最大长度，写入跟不上时丢弃新记录而不是阻塞调用方
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.compression = compression if compression != "zstd" or ZSTD_AVAILABLE else "gzip"
+        suffix = ".jsonl.zst" if self.compression == "zstd" else ".jsonl.gz"
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.path = os.path.join(directory, f"transcript_{timestamp}_{os.getpid()}{suffix}")
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.dropped = 0  # 因队列已满而丢弃的记录数
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._buffer = io.StringIO()
+        self._seen_prefixes = set()
+        self._thread = threading.Thread(target=self._run, name="transcript-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, record: Dict):
+        """提交一条调用记录，不阻塞"""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def write_sync(self, record: Dict):
+        """提交记录并等待其写入磁盘（调试模式使用）"""
+        self._queue.put(record)
+        self.flush()
+
+    def flush(self):
+        """等待队列中的记录全部写入磁盘"""
+        if not self._thread.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self):
+        """写完剩余记录并停止后台线程"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = False
+            if item is None:
+                self._write_block()
+                return
+            if isinstance(item, threading.Event):
+                self._write_block()
+                item.set()
+                last_flush = time.monotonic()
+                continue
+            if item:
+                self._append(item)
+            if self._buffer.tell() >= self.flush_bytes or time.monotonic() - last_flush >= self.flush_interval:
+                self._write_block()
+                last_flush = time.monotonic()
+
+    def _append(self, record: Dict):
+        """序列化一条记录到缓冲区，首次出现的系统前缀先单独写一条前缀记录"""
+        messages = record.pop("messages", [])
+        if messages and messages[0]["role"] == "system":
+            system = messages[0]["content"]
+            digest = prefix_hash(system)
+            if digest not in self._seen_prefixes:
+                self._seen_prefixes.add(digest)
+                self._write_line({"type": "prefix", "hash": digest, "content": system})
+            record["prefix"] = digest
+            messages = messages[1:]
+        record["messages"] = messages
+        self._write_line(record)
+
+    def _write_line(self, record: Dict):
+        self._buffer.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def _write_block(self):
+        data = self._buffer.getvalue().encode("utf-8")
+        if not data:
+            return
+        self._buffer = io.StringIO()
+        if self.compression == "zstd":
+            block = zstandard.ZstdCompressor().compress(data)
+        else:
+            block = gzip.compress(data)
+        with open(self.path, "ab") as f:
+            f.write(block)
+
+
+_writers: Dict[str, TranscriptWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_transcript_writer(config: Dict) -> Optional[TranscriptWriter]:
+    """获取进程内共享的转录写入器，未启用时返回None"""
+    if not config.get("enabled", True):
+        return None
+    directory = config.get("directory", project_path("log", "transcripts"))
+    with _writers_lock:
+        writer = _writers.get(directory)
+        if writer is None:
+            writer = TranscriptWriter(directory, compression=config.get("compression", "zstd"),
+                                      flush_interval=config.get("flush_interval", 2.0))
+            _writers[directory] = writer
+        return writer
+
+
+def flush_transcripts():
+    """把所有写入器中尚未落盘的记录写入文件"""
+    with _writers_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        writer.flush()
+
+
+@atexit.register
+def _close_writers():
+    with _writers_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        writer.close()
+
+
+def read_transcript(path: str) -> Iterator[Dict]:
+    """读取转录文件，逐条返回调用记录，系统前缀会被还原到messages开头"""
+    with open(path, "rb") as f:
+        if path.endswith(".zst"):
+            raw = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        else:
+            raw = gzip.GzipFile(fileobj=f)
+        prefixes: Dict[str, str] = {}
+        for line in io.TextIOWrapper(raw, encoding="utf-8"):
+            record = json.loads(line)
+            if record.get("type") == "prefix":
+                prefixes[record["hash"]] = record["content"]
+                continue
+            messages: List[Dict] = record["messages"]
+            if "prefix" in record:
+                messages.insert(0, {"role": "system", "content": prefixes[record.pop("prefix")]})
+            yield record
@@ -0,0 +1,305 @@
+import hashlib
+import json
+import mmap
+import os
+import random
+import struct
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from analytics import GameAnalytics
+from runtime import project_path
+
+UNCATEGORIZED = "未分类"
+
+# 编译后的文件头：魔数、词语对数量、源文件大小、源文件修改时间（纳秒）、元数据（分类名）偏移
+_HEADER = struct.Struct("<8sIQQQ")
+_MAGIC = b"UCWBANK1"
+
+
+def pair_id(civilian: str, undercover: str) -> str:
+    """词语对的稳定ID，只取决于两个词本身，与在文件中的位置无关"""
+    return hashlib.sha1(f"{civilian}/{undercover}".encode("utf-8")).hexdigest()[:16]
+
+
+def _parse_entry(entry) -> Tuple[str, str, str, int]:
+    """解析gamewords.json中的一项，支持 [平民词, 卧底词] 和带分类、难度的对象两种写法"""
+    if isinstance(entry, dict):
+        return (entry["civilian"], entry["undercover"], entry.get("category", UNCATEGORIZED),
+                int(entry.get("difficulty", -1)))
+    return entry[0], entry[1], UNCATEGORIZED, -1
+
+
+def _layout(count: int) -> Dict[str, int]:
+    """编译文件中各数组的偏移，只取决于词语对数量"""
+    ids = _HEADER.size
+    categories = ids + 8 * count
+    difficulties = categories + 2 * count
+    offsets = (difficulties + count + 3) // 4 * 4
+    strings = offsets + 4 * (2 * count + 1)
+    return {"ids": ids, "categories": categories, "difficulties": difficulties,
+            "offsets": offsets, "strings": strings}
+
+
+def compile_word_bank(json_path: str, compiled_path: str):
+    """把gamewords.json编译为可内存映射的二进制格式
+
+    词语以UTF-8连续存放，另有定长的ID、分类、难度和字符串偏移数组，打开时无需解析，
+    第i组词语只需按偏移读取对应的两段字节。
+    """
+    with open(json_path, "r", encoding="utf-8") as f:
+        entries = [_parse_entry(entry) for entry in json.load(f)]
+    category_names = sorted({entry[2] for entry in entries})
+    category_index = {name: i for i, name in enumerate(category_names)}
+
+    blob = bytearray()
+    offsets = [0]
+    for civilian, undercover, _, _ in entries:
+        for word in (civilian, undercover):
+            blob += word.encode("utf-8")
+            offsets.append(len(blob))
+    ids = np.array([int(pair_id(c, u), 16) for c, u, _, _ in entries], dtype="<u8")
+    categories = np.array([category_index[entry[2]] for entry in entries], dtype="<u2")
+    difficulties = np.array([entry[3] for entry in entries], dtype="i1")
+
+    layout = _layout(len(entries))
+    meta_offset = layout["strings"] + len(blob)
+    stat = os.stat(json_path)
+    directory = os.path.dirname(compiled_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{compiled_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, len(entries), stat.st_size, stat.st_mtime_ns, meta_offset))
+        f.write(ids.tobytes())
+        f.write(categories.tobytes())
+        f.write(difficulties.tobytes())
+        f.write(b"\0" * (layout["offsets"] - f.tell()))
+        f.write(np.array(offsets, dtype="<u4").tobytes())
+        f.write(bytes(blob))
+        f.write(json.dumps(category_names, ensure_ascii=False).encode("utf-8"))
+    # 先写临时文件再替换，并发启动的进程不会读到写了一半的文件
+    os.replace(temp_path, compiled_path)
+
+
+class WordBank:
+    """内存映射的词语库
+
+    打开时只读取文件头并建立数组视图，耗时与词语数量无关；源文件gamewords.json变化后自动重新编译。
+    """
+
+    def __init__(self, json_path: str = "conf/gamewords.json", compiled_path: str = "cache/gamewords.bin"):
+        self.json_path = json_path
+        self.compiled_path = compiled_path
+        if not self._is_fresh():
+            compile_word_bank(json_path, compiled_path)
+        with open(compiled_path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _, count, _, _, meta_offset = _HEADER.unpack_from(self._mmap, 0)
+        layout = _layout(count)
+        self._count = count
+        self._ids = np.frombuffer(self._mmap, dtype="<u8", count=count, offset=layout["ids"])
+        self.categories = np.frombuffer(self._mmap, dtype="<u2", count=count, offset=layout["categories"])
+        self.difficulties = np.frombuffer(self._mmap, dtype="i1", count=count, offset=layout["difficulties"])
+        self._offsets = np.frombuffer(self._mmap, dtype="<u4", count=2 * count + 1, offset=layout["offsets"])
+        self._strings = layout["strings"]
+        self.category_names: List[str] = json.loads(self._mmap[meta_offset:].decode("utf-8"))
+
+    def _is_fresh(self) -> bool:
+        """编译文件是否对应当前的源文件（按大小和修改时间判断）"""
+        if not os.path.exists(self.compiled_path):
+            return False
+        with open(self.compiled_path, "rb") as f:
+            header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return False
+        magic, _, size, mtime_ns, _ = _HEADER.unpack(header)
+        stat = os.stat(self.json_path)
+        return magic == _MAGIC and size == stat.st_size and mtime_ns == stat.st_mtime_ns
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _word(self, k: int) -> str:
+        start, end = int(self._offsets[k]), int(self._offsets[k + 1])
+        return self._mmap[self._strings + start:self._strings + end].decode("utf-8")
+
+    def __getitem__(self, index: int) -> Tuple[str, str]:
+        """第index组词语 (平民词, 卧底词)"""
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        return self._word(2 * index), self._word(2 * index + 1)
+
+    def pair_id(self, index: int) -> str:
+        return f"{int(self._ids[index]):016x}"
+
+    def indices_of(self, pair_ids: List[str]) -> Dict[str, int]:
+        """按词语对ID查找下标，只比较内存映射的ID数组、不解码词语；不在词语库中的ID不出现在结果中"""
+        wanted = np.array([int(pid, 16) for pid in pair_ids], dtype="<u8")
+        return {f"{int(self._ids[index]):016x}": int(index)
+                for index in np.flatnonzero(np.isin(self._ids, wanted))}
+
+    def category(self, index: int) -> str:
+        return self.category_names[int(self.categories[index])]
+
+
+_banks: Dict[Tuple[str, str], WordBank] = {}
+_banks_lock = threading.Lock()
+
+
+def get_word_bank(json_path: str = "conf/gamewords.json", compiled_path: str = "cache/gamewords.bin") -> WordBank:
+    """获取进程内共享的词语库，只在第一次使用时打开"""
+    with _banks_lock:
+        key = (json_path, compiled_path)
+        if key not in _banks:
+            _banks[key] = WordBank(json_path, compiled_path)
+        return _banks[key]
+
+
+class WordSampler:
+    """词语抽样策略
+
+    sample接收对局随机数生成器产生的一个 [0, len(bank)) 内的均匀随机数draw和对局编号，返回词语下标。
+    对局始终恰好消耗这一次随机数，之后的卧底、发言顺序等随机序列与抽样策略无关；
+    策略需要的其他随机性只能由draw、对局编号和配置的种子决定，保证相同种子的对局抽到相同的词语。
+    """
+
+    name = "uniform"
+
+    def __init__(self, bank: WordBank):
+        self.bank = bank
+
+    def sample(self, draw: int, game_index: int) -> int:
+        return draw
+
+
+class ShuffleSampler(WordSampler):
+    """不放回抽样：按固定种子打乱全部词语，第k局使用排列中的第k组，用完一轮后才会重复
+
+    排列只取决于种子和词语数量，比赛中不同进程的对局按全局对局编号取用，同样不会重复。
+    排列在第一次抽样时才生成。
+    """
+
+    name = "shuffle"
+
+    def __init__(self, bank: WordBank, seed: int = 0):
+        super().__init__(bank)
+        self.seed = seed
+        self._order: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def sample(self, draw: int, game_index: int) -> int:
+        with self._lock:
+            if self._order is None:
+                self._order = np.random.default_rng(self.seed).permutation(len(self.bank))
+        return int(self._order[(game_index - 1) % len(self._order)])
+
+
+class StratifiedSampler(WordSampler):
+    """分层抽样：各分类（或难度）按对局编号轮流出题，分类内部由种子、对局编号和draw确定的随机数均匀选择
+
+    分层在第一次抽样时才按词语库的分类（或难度）划分。
+    """
+
+    name = "stratified"
+
+    def __init__(self, bank: WordBank, by: str = "category", seed: int = 0):
+        super().__init__(bank)
+        if by not in ("category", "difficulty"):
+            raise ValueError(f"未知的分层依据: {by}")
+        self.by = by
+        self.seed = seed
+        self._strata: Optional[List[np.ndarray]] = None
+        self._lock = threading.Lock()
+
+    def sample(self, draw: int, game_index: int) -> int:
+        with self._lock:
+            if self._strata is None:
+                keys = self.bank.categories if self.by == "category" else self.bank.difficulties
+                self._strata = [np.flatnonzero(keys == key) for key in np.unique(keys)]
+        stratum = self._strata[(game_index - 1) % len(self._strata)]
+        # draw的取值范围一般不是分层大小的整数倍，直接取模会偏向分层中靠前的词语
+        rng = np.random.default_rng([self.seed, game_index, draw])
+        return int(stratum[rng.integers(len(stratum))])
+
+
+class BalancedSampler(WordSampler):
+    """按历史胜率失衡程度加权：平民胜率越偏离目标值的词语越少被抽到，没有历史记录的词语权重为1
+
+    胜率按先验平滑：(平民胜局 + prior * 目标胜率) / (局数 + prior)，局数少时不会被过度降权。
+    加权抽样使用由种子、对局编号和draw确定的随机数，相同种子的对局抽到相同的词语。
+    权重在第一次抽样时才按词语对ID计算，创建时不读取词语库。
+    """
+
+    name = "balanced"
+
+    def __init__(self, bank: WordBank, pair_stats: Dict[str, Dict], target_win_rate: float = 0.5,
+                 prior: float = 5.0, min_weight: float = 0.05, seed: int = 0):
+        """初始化
+
+        Args:
+            pair_stats: {"平民词/卧底词": {"games": 局数, "civilian_win_rate": 平民胜率}}，
+                即GameAnalytics.word_pair_stats()的返回值
+            seed: 配置的种子，与对局编号和draw一起决定加权抽样的随机数
+        """
+        super().__init__(bank)
+        self.pair_stats = pair_stats
+        self.target_win_rate = target_win_rate
+        self.prior = prior
+        self.min_weight = min_weight
+        self.seed = seed
+        self._cumulative: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def _build_weights(self) -> np.ndarray:
+        """有历史记录的词语按胜率失衡程度降权，其余为1"""
+        weights = np.ones(len(self.bank))
+        stats_by_id = {pair_id(*key.split("/", 1)): stats for key, stats in self.pair_stats.items()}
+        for pid, index in self.bank.indices_of(list(stats_by_id)).items():
+            stats = stats_by_id[pid]
+            wins = stats["civilian_win_rate"] * stats["games"]
+            rate = (wins + self.prior * self.target_win_rate) / (stats["games"] + self.prior)
+            weights[index] = max(self.min_weight, 1 - 2 * abs(rate - self.target_win_rate))
+        return weights
+
+    def sample(self, draw: int, game_index: int) -> int:
+        with self._lock:
+            if self._cumulative is None:
+                self._cumulative = np.cumsum(self._build_weights())
+        point = random.Random(f"{self.seed}:{game_index}:{draw}").random() * self._cumulative[-1]
+        return min(int(np.searchsorted(self._cumulative, point, side="right")), len(self._cumulative) - 1)
+
+
+def create_word_sampler(config: Dict, bank: Optional[WordBank] = None) -> WordSampler:
+    """根据 [words] 配置创建抽样策略"""
+    bank = bank or get_word_bank(config.get("path", project_path("conf", "gamewords.json")),
+                                 config.get("compiled_path", project_path("cache", "gamewords.bin")))
+    strategy = config.get("sampling", "uniform")
+    if strategy == "uniform":
+        return WordSampler(bank)
+    if strategy == "shuffle":
+        return ShuffleSampler(bank, seed=config.get("seed", 0))
+    if strategy == "stratified":
+        return StratifiedSampler(bank, by=config.get("stratify_by", "category"), seed=config.get("seed", 0))
+    if strategy == "balanced":
+        analytics = GameAnalytics.load(config.get("analytics_path", project_path("results", "analytics.npz")))
+        return BalancedSampler(bank, analytics.word_pair_stats(),
+                               target_win_rate=config.get("target_win_rate", 0.5), seed=config.get("seed", 0))
+    raise ValueError(f"未知的词语抽样策略: {strategy}")
+
+
+_samplers: Dict[str, WordSampler] = {}
+
+
+def get_word_sampler(config: Dict) -> WordSampler:
+    """获取进程内共享的抽样策略，相同配置只创建一次"""
+    key = json.dumps(config, sort_keys=True)
+    with _banks_lock:
+        sampler = _samplers.get(key)
+    if sampler is None:
+        sampler = create_word_sampler(config)
+        with _banks_lock:
+            sampler = _samplers.setdefault(key, sampler)
+    return sampler
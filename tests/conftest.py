@@ -0,0 +1,6 @@
+import os
+import sys
+
+# 源码按扁平方式相互导入（from llm_client import ...），测试时把源码目录加入搜索路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src",
+                                "undercover_game_llm"))
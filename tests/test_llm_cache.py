@@ -0,0 +1,30 @@
+import player_configs
+from game import UndercoverGame, create_players
+from llm_cache import REPLAY_ONLY, CacheMissError, CachedLLMClient, ResponseCache
+from llm_client import LLMCallError
+from mock_client import MockLLMClient
+
+
+def test_replay_only_miss_is_llm_call_error(tmp_path):
+    client = CachedLLMClient(MockLLMClient(), ResponseCache(str(tmp_path / "cache.sqlite")), mode=REPLAY_ONLY)
+    try:
+        client.chat([{"role": "user", "content": "你好"}], "mock")
+    except LLMCallError as e:
+        assert isinstance(e, CacheMissError)
+        assert not e.retryable
+    else:
+        raise AssertionError("replay_only模式下未命中应报错")
+
+
+def test_replay_only_miss_does_not_crash_game(tmp_path, monkeypatch):
+    """缓存为空时每次调用都未命中，玩家按调用失败降级，对局仍能正常结束"""
+    monkeypatch.setattr(player_configs, "llm_config", {"mock": {"enabled": True}}, raising=False)
+    monkeypatch.setattr(player_configs, "cache_config",
+                        {"enabled": True, "mode": REPLAY_ONLY, "path": str(tmp_path / "cache.sqlite")},
+                        raising=False)
+    monkeypatch.setattr(player_configs, "replay_config", {"record": False}, raising=False)
+    player_map = create_players([{"name": f"玩家{i}", "model": "mock", "local": True} for i in range(4)])
+    game = UndercoverGame(player_map=player_map, verbose=False, seed=1)
+    game.start_game(save=False)
+    assert "winners" in game.full_result()
+    assert game.check_game_end()